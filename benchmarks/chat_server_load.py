@@ -0,0 +1,126 @@
+"""
+End-to-end load test of examples/chat_server.py against the fake streaming LLM in fake_models.py.
+Starts the server in-process, opens many concurrent sessions that each chat for a few turns over real
+HTTP connections, and reports time to first token, turn latency and throughput. It also checks that
+every session kept its own memory.
+
+Usage:
+    python -m benchmarks.chat_server_load
+    python -m benchmarks.chat_server_load --sessions 500 --turns 5 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# The server shouldn't read or write on-disk caches & sessions, so they're disabled before config is loaded
+os.environ["LLM_CACHE_PATH"] = ""
+os.environ["CHAT_SESSION_DIR"] = ""
+os.environ["CHAT_MEMORY_TOKEN_BUDGET"] = "0"
+
+from benchmarks.fake_models import FakeStreamingLLM
+from benchmarks.run import mean, percentile
+from examples.chat_server import ChatServer
+
+
+async def chat_turn(port, session_id, message):
+    """
+    Sends one message and reads the event stream. Returns (time to first token, turn time, tokens, response).
+    """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"session_id": session_id, "message": message}).encode("utf-8")
+    writer.write(
+        f"POST /chat HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+
+    status = await reader.readline()
+    if b" 200 " not in status:
+        raise RuntimeError(f"Unexpected response: {status!r}")
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass # Headers
+
+    first_token, tokens, event = None, 0, None
+    async for line in reader:
+        line = line.decode("utf-8").rstrip("\n")
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            if event == "error":
+                raise RuntimeError(data["error"])
+            if event == "end":
+                writer.close()
+                return first_token, time.perf_counter() - started, tokens, data["response"]
+            tokens += 1
+            if first_token is None:
+                first_token = time.perf_counter() - started
+    raise RuntimeError("Stream ended without an end event")
+
+
+async def run_session(port, session_id, turns, results):
+    for turn in range(turns):
+        try:
+            results.append(await chat_turn(port, session_id, f"Question {turn} from {session_id}"))
+        except Exception as error:
+            results.append(error)
+
+
+async def load_test(args):
+    llm = FakeStreamingLLM(
+        streaming=True,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens
+    )
+    server = await ChatServer(llm, port=0, max_sessions=args.sessions).start()
+
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(server.port, f"session-{index}", args.turns, results)
+        for index in range(args.sessions)
+    ))
+    elapsed = time.perf_counter() - started
+
+    # Every session should remember exactly its own turns
+    memory_ok = sum(
+        len(conversation.memory.chat_memory.messages) == 2 * args.turns
+        for conversation, _, _ in server.sessions._sessions.values()
+    )
+    await server.close()
+    return results, elapsed, memory_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the streaming chat server with a fake LLM")
+    parser.add_argument("--sessions", type=int, default=200, help="Concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session")
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake LLM delay before the first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake LLM token rate per stream")
+    parser.add_argument("--response-tokens", type=int, default=30, help="Tokens in each fake response")
+    args = parser.parse_args()
+
+    results, elapsed, memory_ok = asyncio.run(load_test(args))
+    errors = [result for result in results if isinstance(result, Exception)]
+    turns = [result for result in results if not isinstance(result, Exception)]
+    ttft = [result[0] for result in turns if result[0] is not None]
+    latency = [result[1] for result in turns]
+    tokens = sum(result[2] for result in turns)
+
+    print(f"{args.sessions} sessions x {args.turns} turns in {elapsed:.2f}s, {len(errors)} errors")
+    if errors:
+        print(f"first error: {errors[0]!r}")
+    if turns:
+        print(f"time to first token: mean {mean(ttft) * 1000:.1f}ms, p95 {percentile(ttft, 0.95) * 1000:.1f}ms")
+        print(f"turn latency: mean {mean(latency) * 1000:.1f}ms, p95 {percentile(latency, 0.95) * 1000:.1f}ms")
+    print(f"throughput: {len(turns) / elapsed:.1f} turns/s, {tokens / elapsed:.0f} tokens/s")
+    print(f"sessions with the expected memory: {memory_ok}/{args.sessions}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Deterministic local stand-ins for the OpenAI LLM and chat model, used to benchmark the examples without network calls.
+Responses are built from the prompt, so the same prompt always gives the same response,
+and tokens are streamed with a configurable latency before the first token and a fixed token rate.
+"""
+
+import asyncio
+import time
+import zlib
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import LLM
+from langchain.schema import (
+    AIMessage,
+    BaseMessage,
+    ChatGeneration,
+    ChatResult,
+    get_buffer_string,
+)
+
+WORDS = (
+    "the event plan includes laser tag teams snacks a silly bio pirate treasure "
+    "map ocean ship history humanity artificial intelligence works by learning patterns"
+).split()
+
+
+class FakeModelMixin:
+    """
+    Shared token generation for the fake models.
+    """
+
+    def _response_tokens(self, prompt: str) -> List[str]:
+        start = zlib.crc32(prompt.encode("utf-8"))
+        return [
+            f" {WORDS[(start + i) % len(WORDS)]}" for i in range(self.response_tokens)
+        ]
+
+    def _stream(self, prompt: str, run_manager) -> str:
+        tokens = self._response_tokens(prompt)
+        time.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            if self.streaming and run_manager:
+                run_manager.on_llm_new_token(token)
+        return "".join(tokens)
+
+    async def _astream(self, prompt: str, run_manager) -> str:
+        tokens = self._response_tokens(prompt)
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            if self.streaming and run_manager:
+                await run_manager.on_llm_new_token(token)
+        return "".join(tokens)
+
+    def get_num_tokens(self, text: str) -> int:
+        # Rough word count, so token budgets work without downloading a tokenizer
+        return len(text.split())
+
+
+class FakeStreamingLLM(FakeModelMixin, LLM):
+    """
+    Local LLM with configurable latency & token rate.
+    """
+
+    response_tokens: int = 50
+    tokens_per_second: float = 500.0 # 0 streams as fast as possible
+    latency: float = 0.05 # Seconds before the first token
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self._stream(prompt, run_manager)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return await self._astream(prompt, run_manager)
+
+
+class FakeStreamingChatModel(FakeModelMixin, BaseChatModel):
+    """
+    Local chat model with configurable latency & token rate.
+    """
+
+    response_tokens: int = 50
+    tokens_per_second: float = 500.0 # 0 streams as fast as possible
+    latency: float = 0.05 # Seconds before the first token
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = self._stream(get_buffer_string(messages), run_manager)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = await self._astream(get_buffer_string(messages), run_manager)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
@@ -0,0 +1,99 @@
+"""
+Measures the cost of building each conversation prompt as the history grows, comparing LangChain's
+ConversationBufferMemory (the whole history is rendered on every turn) with IncrementalBufferMemory
+(each turn is rendered once, when it is saved). Covers both prompt styles used by the examples:
+a string prompt (memory.py) and a chat prompt sent to a completion LLM (interactive_chat.py, agents.py).
+No model is called; each turn only saves a fixed exchange and formats the next prompt.
+
+Usage:
+    python -m benchmarks.history_render
+    python -m benchmarks.history_render --turns 20000 --window 50
+"""
+
+import argparse
+import time
+
+from langchain.chains.conversation.prompt import PROMPT
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+
+from utils.memory import IncrementalBufferMemory
+from utils.prompts import CompiledPromptTemplate, IncrementalChatPromptTemplate
+
+QUESTION = "What do octopuses eat, and how do they hunt for it?"
+ANSWER = "Octopuses mostly eat crabs, clams and small fish. They hunt at night, using their arms to search crevices."
+
+
+def chat_prompt(template_class):
+    return template_class.from_messages([
+        SystemMessagePromptTemplate.from_template("You are a helpful and friendly AI."),
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+
+
+# Setup name -> (memory factory, prompt)
+SETUPS = {
+    "string/buffer": (lambda: ConversationBufferMemory(), CompiledPromptTemplate(input_variables=PROMPT.input_variables, template=PROMPT.template)),
+    "string/incremental": (lambda: IncrementalBufferMemory(), CompiledPromptTemplate(input_variables=PROMPT.input_variables, template=PROMPT.template)),
+    "chat/buffer": (lambda: ConversationBufferMemory(return_messages=True), chat_prompt(ChatPromptTemplate)),
+    "chat/incremental": (lambda: IncrementalBufferMemory(return_messages=True), chat_prompt(IncrementalChatPromptTemplate)),
+}
+
+
+def run_turns(memory_factory, prompt, turns, checkpoints, window):
+    """
+    Runs the turns, returning {checkpoint: mean seconds per turn over the `window` turns ending there}.
+    A timed turn is what ConversationChain does around the LLM call: load the history, format the prompt
+    to the text a completion LLM gets, and save the exchange. Turns outside the windows only save the
+    exchange, so the slow setups still reach long histories in reasonable time.
+    """
+    memory = memory_factory()
+    results = {}
+    elapsed = 0.0
+    for turn in range(1, turns + 1):
+        checkpoint = next((checkpoint for checkpoint in checkpoints if checkpoint - window < turn <= checkpoint), None)
+        if checkpoint is None:
+            memory.save_context({"input": QUESTION}, {"output": ANSWER})
+            continue
+
+        started = time.perf_counter()
+        history = memory.load_memory_variables({})
+        prompt.format_prompt(input=QUESTION, **history).to_string()
+        memory.save_context({"input": QUESTION}, {"output": ANSWER})
+        elapsed += time.perf_counter() - started
+        if turn == checkpoint:
+            results[turn] = elapsed / window
+            elapsed = 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn prompt building cost as the conversation history grows")
+    parser.add_argument("--turns", type=int, default=10_000, help="Turns per conversation")
+    parser.add_argument("--window", type=int, default=20, help="Turns timed & averaged per reported row")
+    parser.add_argument("--rows", type=int, default=10, help="Rows to print, evenly spaced")
+    parser.add_argument("--setups", default=",".join(SETUPS), help=f"Comma separated setups ({', '.join(SETUPS)})")
+    args = parser.parse_args()
+
+    names = args.setups.split(",")
+    step = max(args.window, args.turns // args.rows)
+    checkpoints = list(range(step, args.turns + 1, step))
+    results = {
+        name: run_turns(*SETUPS[name], args.turns, checkpoints, args.window)
+        for name in names
+    }
+
+    print(f"ms per turn (mean over {args.window} turns)")
+    print(f"{'turn':>7}  " + "  ".join(f"{name:>18}" for name in names))
+    for turn in checkpoints:
+        print(f"{turn:>7}  " + "  ".join(f"{results[name][turn] * 1000:>18.3f}" for name in names))
+
+
+if __name__ == "__main__":
+    main()
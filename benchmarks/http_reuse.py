@@ -0,0 +1,136 @@
+"""
+Checks that model clients reuse keep-alive connections, using a local stand-in for the OpenAI API that counts
+the TCP connections it accepts. The same batches of completions are sent with the OpenAI client's default
+connection handling and then through the shared pool from utils/http_pool.py.
+
+Usage:
+    python -m benchmarks.http_reuse
+    python -m benchmarks.http_reuse --rounds 5 --items 40 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+from langchain.llms import OpenAI
+
+from utils.batch_runner import run_batch
+from utils.http_pool import async_http_pool, install_http_pool
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers /v1/completions with a fixed completion over HTTP/1.1, so connections are kept alive.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers & body are written separately, so without this Nagle's algorithm stalls kept-alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        body = json.dumps({
+            "id": "cmpl-local",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "local"),
+            "choices": [{"text": " a local response", "index": 0, "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8},
+        }).encode("utf-8")
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.latency = latency
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(server, run):
+    server.connections = 0
+    started = time.perf_counter()
+    run()
+    return server.connections, time.perf_counter() - started
+
+
+def run_sync_batches(llm, args):
+    for round_number in range(args.rounds):
+        prompts = [f"Prompt {round_number}-{item}" for item in range(args.items)]
+        # Each batch gets a fresh set of worker threads, like repeated example runs & batch jobs
+        for _, _, error in run_batch(llm, prompts, concurrency=args.concurrency):
+            if error:
+                raise error
+
+
+async def run_async_batches(llm, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(prompt):
+        async with semaphore:
+            return await llm.agenerate([prompt])
+
+    for round_number in range(args.rounds):
+        await asyncio.gather(*(call(f"Prompt {round_number}-{item}") for item in range(args.items)))
+
+
+async def run_async_pooled(llm, args):
+    async with async_http_pool(args.concurrency):
+        await run_async_batches(llm, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count connections opened by model clients against a local stand-in server")
+    parser.add_argument("--rounds", type=int, default=3, help="Batches sent, each on new worker threads")
+    parser.add_argument("--items", type=int, default=24, help="Requests per batch")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight (and pool size)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Stand-in server delay per request (s)")
+    args = parser.parse_args()
+
+    server = start_server(args.latency)
+    llm = OpenAI(
+        openai_api_key="local",
+        openai_api_base=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        streaming=False,
+        max_retries=0
+    )
+
+    requests_sent = args.rounds * args.items
+    results = {}
+    openai.requestssession = None
+    results["sync default"] = measure(server, lambda: run_sync_batches(llm, args))
+    install_http_pool(args.concurrency)
+    results["sync pooled"] = measure(server, lambda: run_sync_batches(llm, args))
+    results["async default"] = measure(server, lambda: asyncio.run(run_async_batches(llm, args)))
+    results["async pooled"] = measure(server, lambda: asyncio.run(run_async_pooled(llm, args)))
+    server.shutdown()
+
+    print(f"{requests_sent} requests per mode ({args.rounds} batches of {args.items}, {args.concurrency} in flight)")
+    print(f"{'mode':<14}  {'connections':>11}  {'wall_s':>7}")
+    for mode, (connections, elapsed) in results.items():
+        print(f"{mode:<14}  {connections:>11}  {elapsed:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
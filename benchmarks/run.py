@@ -0,0 +1,239 @@
+"""
+Offline benchmark of the example flows, run against the local fake models in fake_models.py.
+It measures the project's own overhead (prompt building, callbacks, console rendering) without paying for API calls:
+- prompt build: time from the (scripted) user input to the LLM call starting
+- time to first token: time from the user input to the first token reaching the console
+- tokens/s: rate tokens are delivered through CustomStreamCallback & ConsoleLogger
+- peak memory: largest traced allocation during a run (measured in a separate run, since tracing slows things down)
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --flows basics,interactive_chat --turns 200 --latency 0 --tokens-per-second 0
+"""
+
+import argparse
+import builtins
+import contextlib
+import importlib
+import json
+import os
+import time
+import tracemalloc
+
+# Benchmarks shouldn't read or write on-disk caches & sessions, so they're disabled before config is loaded
+os.environ["LLM_CACHE_PATH"] = ""
+os.environ["TOOL_CACHE_PATH"] = ""
+os.environ["CHAT_SESSION_DIR"] = ""
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+import config
+from benchmarks.fake_models import FakeStreamingChatModel, FakeStreamingLLM
+
+# Flow name -> (example module, scripted inputs). Inputs may be a function of the number of chat turns.
+FLOWS = {
+    "basics": ("examples.basics", ["", "", ""]),
+    "memory": ("examples.memory", ["", ""]),
+    "chats-single": ("examples.chats", ["0"]),
+    "chats-multi": ("examples.chats", ["1"]),
+    "chats-batch": ("examples.chats", ["2", ""]),
+    "chats-template": ("examples.chats", ["3", "", ""]),
+    "agents-memory": ("examples.agents", ["2"]),
+    "interactive_chat": (
+        "examples.interactive_chat",
+        lambda turns: [f"Tell me fact number {turn} about the ocean." for turn in range(turns)] + ["exit"]
+    ),
+}
+
+
+class FlowRecorder(BaseCallbackHandler):
+    """
+    Records when each LLM call starts and when its tokens arrive. It is attached after CustomStreamCallback,
+    so token times include rendering the token to the console.
+    """
+
+    def __init__(self):
+        self.turn_started = None
+        self.calls = {}
+
+    def reset(self):
+        self.turn_started = None
+        self.calls = {}
+
+    def mark_turn_start(self):
+        self.turn_started = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        now = time.perf_counter()
+        self.calls[kwargs.get("run_id")] = {
+            "turn_started": self.turn_started if self.turn_started is not None else now,
+            "started": now,
+            "first_token": None,
+            "last_token": None,
+            "tokens": 0,
+        }
+
+    def on_llm_new_token(self, token, **kwargs):
+        call = self.calls.get(kwargs.get("run_id"))
+        if call is None:
+            return
+        now = time.perf_counter()
+        if call["first_token"] is None:
+            call["first_token"] = now
+        call["last_token"] = now
+        call["tokens"] += 1
+
+    def on_llm_end(self, response, **kwargs):
+        # Calls made without new input in between (e.g. a follow-up prompt) are timed from the end of this one
+        self.mark_turn_start()
+
+
+class ScriptedInput:
+    """
+    Replaces builtins.input with a fixed list of answers, marking when each answer is given.
+    """
+
+    def __init__(self, answers, recorder):
+        self.answers = iter(answers)
+        self.recorder = recorder
+
+    def __call__(self, prompt=""):
+        try:
+            answer = next(self.answers)
+        except StopIteration:
+            raise EOFError("Scripted input exhausted")
+        self.recorder.mark_turn_start()
+        return answer
+
+
+def install_fake_models(args, recorder):
+    """
+    Registers the fake models in config.py and makes them the defaults.
+    """
+    settings = {
+        "latency": args.latency,
+        "tokens_per_second": args.tokens_per_second,
+        "response_tokens": args.response_tokens,
+    }
+    config.register_llm(
+        "fake",
+        lambda callbacks, streaming=True: FakeStreamingLLM(streaming=streaming, callbacks=callbacks + [recorder], **settings)
+    )
+    config.register_chat_model(
+        "fake",
+        lambda callbacks, streaming=True: FakeStreamingChatModel(streaming=streaming, callbacks=callbacks + [recorder], **settings)
+    )
+    config.DEFAULT_LLM = "fake"
+    config.DEFAULT_CHAT_MODEL = "fake"
+
+
+def run_flow(module, answers, recorder):
+    """
+    Runs an example's main function once with scripted input and console output discarded. Returns wall time.
+    """
+    recorder.reset()
+    original_input = builtins.input
+    builtins.input = ScriptedInput(answers, recorder)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            try:
+                module.main()
+            except EOFError:
+                pass
+            return time.perf_counter() - started
+    finally:
+        builtins.input = original_input
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def summarize(wall_times, calls, peak_bytes):
+    streamed = [call for call in calls if call["first_token"] is not None]
+    prompt_build = [call["started"] - call["turn_started"] for call in calls]
+    ttft = [call["first_token"] - call["turn_started"] for call in streamed]
+    stream_time = sum(call["last_token"] - call["first_token"] for call in streamed)
+    tokens = sum(call["tokens"] for call in streamed)
+    return {
+        "runs": len(wall_times),
+        "wall_s": mean(wall_times),
+        "llm_calls": len(calls) // max(1, len(wall_times)),
+        "prompt_build_ms_mean": mean(prompt_build) * 1000 if prompt_build else None,
+        "prompt_build_ms_last": prompt_build[-1] * 1000 if prompt_build else None,
+        "ttft_ms_mean": mean(ttft) * 1000 if ttft else None,
+        "ttft_ms_p95": percentile(ttft, 0.95) * 1000 if ttft else None,
+        "tokens_per_s": tokens / stream_time if stream_time > 0 else None,
+        "peak_memory_mb": peak_bytes / 1_000_000,
+    }
+
+
+def benchmark(name, args, recorder):
+    module_name, answers = FLOWS[name]
+    if callable(answers):
+        answers = answers(args.turns)
+    module = importlib.import_module(module_name)
+
+    wall_times, calls = [], []
+    for _ in range(args.repeat):
+        wall_times.append(run_flow(module, answers, recorder))
+        calls.extend(recorder.calls.values())
+
+    # Peak memory is measured in its own run, so tracing doesn't skew the timings above
+    tracemalloc.start()
+    run_flow(module, answers, recorder)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return summarize(wall_times, calls, peak_bytes)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def print_table(results):
+    columns = ["flow"] + list(next(iter(results.values())).keys())
+    rows = [[name] + [format_value(value) for value in result.values()] for name, result in results.items()]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the example flows against local fake models")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"Comma separated flows to run ({', '.join(FLOWS)})")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model delay before the first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Fake model token rate (0 = unthrottled)")
+    parser.add_argument("--response-tokens", type=int, default=50, help="Tokens in each fake response")
+    parser.add_argument("--turns", type=int, default=20, help="Scripted turns for interactive_chat")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per flow")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    recorder = FlowRecorder()
+    install_fake_models(args, recorder)
+
+    results = {}
+    for name in args.flows.split(","):
+        results[name] = benchmark(name.strip(), args, recorder)
+    print_table(results)
+
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
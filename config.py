@@ -1,12 +1,10 @@
 # This file sets up the API keys and default language models for the examples.
 # It includes both OpenAI and HuggingFace Language Models.
+# Models are registered by name and only constructed the first time they are used.
 
 from dotenv import load_dotenv
 import os
-
-from langchain.llms import OpenAI, HuggingFaceHub
-
-from utils.custom_stream import CustomStreamCallback
+import threading
 
 load_dotenv()
 
@@ -15,29 +13,434 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 # Free HuggingFace API (https://huggingface.co/settings/tokens)
 HUGGINGFACE_API_KEY = os.environ.get("HUGGINGFACE_API_KEY")
 
-#region Instantiate Language Models
+# Record every model & tool call to a cassette file, or replay them from it without network access or API keys.
+# CASSETTE_MODE is "record", "replay" or empty (off). Replays are instant, or with CASSETTE_TIMING=original
+# they reproduce the recorded latency & token timing. The response & tool caches are skipped while a cassette
+# is in use, so every call is recorded and replays don't depend on what was cached.
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "").lower()
+CASSETTE_PATH = os.environ.get("CASSETTE_PATH", "cassettes/examples.jsonl.gz")
+CASSETTE_TIMING = os.environ.get("CASSETTE_TIMING", "instant").lower()
+if CASSETTE_MODE == "replay":
+    # Models & tools still check for their keys when they're built, though replays never use them
+    for key_name in ("OPENAI_API_KEY", "HUGGINGFACEHUB_API_TOKEN", "SERPAPI_API_KEY"):
+        os.environ.setdefault(key_name, "replay")
+
+# Name of the registered model returned by get_llm() when no name is given
+DEFAULT_LLM = os.environ.get("DEFAULT_LLM", "open_ai")
+# Name of the registered chat model returned by get_chat_model() when no name is given
+DEFAULT_CHAT_MODEL = os.environ.get("DEFAULT_CHAT_MODEL", "open_ai")
+
+# On-disk LLM response cache, keyed on model, parameters & formatted prompt (empty path disables it)
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 60 * 60)) # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10_000))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 50_000_000))
+
+# Agent tool results are cached in memory and in this file (empty keeps them in memory only).
+# TTLs are per tool name in seconds: web searches go stale, math results never do (None).
+TOOL_CACHE_PATH = os.environ.get("TOOL_CACHE_PATH", ".tool_cache.sqlite")
+TOOL_CACHE_TTLS = {
+    "Search": float(os.environ.get("TOOL_CACHE_SEARCH_TTL", 15 * 60)),
+    "Calculator": None,
+}
+
+# Let agents request several independent tool calls in one step and run them concurrently (agents.py)
+AGENT_PARALLEL_TOOLS = os.environ.get("AGENT_PARALLEL_TOOLS", "false").lower() in ("1", "true", "yes")
+AGENT_MAX_PARALLEL_TOOLS = int(os.environ.get("AGENT_MAX_PARALLEL_TOOLS", 4))
+
+# Requests to OpenAI models are sized per call (see utils/sizing.py): max_tokens is taken from the policy of the
+# chain making the call (or "default"), lowered to what the model's context leaves after the prompt, and the
+# oldest history is dropped when the prompt wouldn't leave room for it. False sends max_tokens=1000 every time.
+ADAPTIVE_MAX_TOKENS = os.environ.get("ADAPTIVE_MAX_TOKENS", "true").lower() in ("1", "true", "yes")
+MAX_TOKENS_POLICY = {
+    "default": int(os.environ.get("MAX_TOKENS_DEFAULT", 1000)),
+    "agent": 256, # Tool choices, math expressions & short final answers (agents.py)
+    "bio": 400, # A bio of a paragraph or two (memory.py)
+    "conversation": 500, # Chat replies (interactive_chat.py, chat_server.py)
+    "plan": 1000, # Event plans (basics.py)
+    "chat": 500, # Chat model examples (chats.py)
+}
+
+# Streamed Silly-GPT & Pirate-GPT responses (chats.py) are stopped after about this many characters, at the end
+# of a sentence, instead of running to max_tokens (see utils/stream_guards.py). 0 lets them finish.
+STREAM_GUARD_MAX_CHARS = int(os.environ.get("STREAM_GUARD_MAX_CHARS", 1200))
+
+# Concurrent identical requests (same model, parameters & prompt, e.g. duplicate rows in a batch) share
+# one upstream call, with its tokens streamed to every caller (see utils/single_flight.py)
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+# Maximum number of concurrent requests when running batches of prompts
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+# Rows sent to the model in one request when planning events in bulk (basics.py); OpenAI takes up to 20 prompts
+BATCH_PROMPTS_PER_REQUEST = int(os.environ.get("BATCH_PROMPTS_PER_REQUEST", 8))
+
+# Token budget for the interactive chat history. Older turns are summarized to stay within it (0 keeps everything)
+CHAT_MEMORY_TOKEN_BUDGET = int(os.environ.get("CHAT_MEMORY_TOKEN_BUDGET", 0))
+
+# Semantic response cache for the interactive chat: near-duplicate questions (cosine similarity of their
+# hashed n-gram embeddings at or above the threshold, e.g. 0.9) asked again in the same session reuse
+# the earlier answer. Questions shorter than SEMANTIC_CACHE_MIN_WORDS words
+# ("why?", "yes") always go to the LLM. 0 (the default) disables the cache.
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0))
+SEMANTIC_CACHE_CAPACITY = int(os.environ.get("SEMANTIC_CACHE_CAPACITY", 1000))
+SEMANTIC_CACHE_MIN_WORDS = int(os.environ.get("SEMANTIC_CACHE_MIN_WORDS", 4))
+
+# Folder for persistent interactive chat sessions (empty keeps sessions in memory only),
+# and how many of the latest turns are loaded into the prompt when a session is resumed
+CHAT_SESSION_DIR = os.environ.get("CHAT_SESSION_DIR", "")
+CHAT_SESSION_TAIL_TURNS = int(os.environ.get("CHAT_SESSION_TAIL_TURNS", 20))
+
+# Address of the streaming chat server (chat_server.py), and how many sessions it keeps in memory
+CHAT_SERVER_HOST = os.environ.get("CHAT_SERVER_HOST", "127.0.0.1")
+CHAT_SERVER_PORT = int(os.environ.get("CHAT_SERVER_PORT", 8000))
+CHAT_SERVER_MAX_SESSIONS = int(os.environ.get("CHAT_SERVER_MAX_SESSIONS", 1000))
+
+# The "routed" LLM sends each prompt to one of these models by prompt size & recent latency. With hedging,
+# a request that hasn't streamed a token by the primary's recent p95 time to first token is also sent to the
+# next model, and the slower one is cancelled. ROUTING_HEDGE_DELAY (seconds) is used until there are enough samples.
+ROUTING_BACKENDS = [name.strip() for name in os.environ.get("ROUTING_BACKENDS", "open_ai,hugging_face").split(",") if name.strip()]
+ROUTING_HEDGE = os.environ.get("ROUTING_HEDGE", "true").lower() in ("1", "true", "yes")
+ROUTING_HEDGE_DELAY = float(os.environ.get("ROUTING_HEDGE_DELAY", 2.0))
+
+# How concurrent LLM streams are shown in the console: "" writes the one stream as it comes, "prefix" writes each
+# stream line by line with a label, "regions" also keeps a live row per stream at the bottom (see ConsoleMultiplexer)
+CONSOLE_STREAM_MODE = os.environ.get("CONSOLE_STREAM_MODE", "")
+
+# Keep-alive connections shared by all model clients (see utils/http_pool.py)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 16))
+
+# File the latency histograms are written to after each example (.prom for Prometheus text, otherwise JSON; empty disables)
+METRICS_PATH = os.environ.get("METRICS_PATH", "")
+
+#region Language Model Factories
 # - Different models can be used for different results/use cases
 # - Temperature - 0-1: "randomness/diversity" of output (higher = more random)
+# - Imports happen inside the factories so unused clients cost nothing at startup
+# - Factories take the callbacks to attach and whether tokens should be streamed
+
+def _build_open_ai(callbacks, streaming=True):
+    """
+    Paid OpenAI model (https://openai.com/blog/openai-api)
+    """
+    from langchain.llms import OpenAI
+
+    return OpenAI(
+        temperature=0.9,
+        max_tokens=1000,
+        streaming=streaming,
+        callbacks=callbacks
+    )
+
+def _build_hugging_face(callbacks, streaming=True):
+    """
+    Free HuggingFace model (https://huggingface.co/google/flan-t5-xl)
+    """
+    from langchain.llms import HuggingFaceHub
+
+    return HuggingFaceHub(
+        repo_id="google/flan-t5-xl",
+        model_kwargs={
+            "temperature": 0.6,
+            "max_length": 64
+        },
+        callbacks=callbacks
+    )
+
+def _build_chat_open_ai(callbacks, streaming=True):
+    """
+    Paid OpenAI chat model (https://platform.openai.com/docs/guides/chat)
+    """
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        temperature=0.9,
+        max_tokens=1000,
+        streaming=streaming,
+        callbacks=callbacks
+    )
+
+# Largest prompt (in tokens) each model accepts, leaving room for its response
+_PROMPT_TOKEN_LIMITS = {
+    "open_ai": 4097 - 1000,
+    "hugging_face": 512,
+}
+
+def _build_routed(callbacks, streaming=True):
+    """
+    Routes each prompt between the ROUTING_BACKENDS models (see utils/routing_llm.py)
+    """
+    from utils.routing_llm import RoutingLLM
+
+    # Backends only record metrics; the router streams the winning backend's tokens to the callbacks
+    return RoutingLLM(
+        backends={name: _llm_factories[name](_silent_callbacks(), streaming) for name in ROUTING_BACKENDS},
+        max_prompt_tokens={name: _PROMPT_TOKEN_LIMITS[name] for name in ROUTING_BACKENDS if name in _PROMPT_TOKEN_LIMITS},
+        hedge=ROUTING_HEDGE,
+        hedge_delay=ROUTING_HEDGE_DELAY,
+        callbacks=callbacks
+    )
+
+#endregion
+#region Model Registry
+# - Models are cached per (name, variant). The variant decides which callbacks are attached:
+#   "stream" colors streamed output for the sync APIs, "async_stream" does the same for the async APIs,
+#   "silent" doesn't print or stream, for batch & background work,
+#   "async_headless" streams (async) without printing, to callbacks passed per call (e.g. chat_server.py)
+# - Every variant records latency metrics (see get_metrics)
+
+def _stream_callbacks():
+    from utils.custom_stream import CustomStreamCallback
+    from utils.metrics import MetricsCallback
+    return [CustomStreamCallback(), MetricsCallback(get_metrics())]
+
+def _async_stream_callbacks():
+    from utils.custom_stream import AsyncCustomStreamCallback
+    from utils.metrics import AsyncMetricsCallback
+    return [AsyncCustomStreamCallback(), AsyncMetricsCallback(get_metrics())]
+
+def _silent_callbacks():
+    from utils.metrics import MetricsCallback
+    return [MetricsCallback(get_metrics())]
+
+def _async_headless_callbacks():
+    from utils.metrics import AsyncMetricsCallback
+    return [AsyncMetricsCallback(get_metrics())]
+
+# Variant name -> (callbacks factory, streaming)
+_VARIANTS = {
+    "stream": (_stream_callbacks, True),
+    "async_stream": (_async_stream_callbacks, True),
+    "silent": (_silent_callbacks, False),
+    "async_headless": (_async_headless_callbacks, True),
+}
+
+_llm_factories = {
+    "open_ai": _build_open_ai,
+    "hugging_face": _build_hugging_face,
+    "routed": _build_routed,
+}
+_chat_model_factories = {
+    "open_ai": _build_chat_open_ai,
+}
+_instances = {}
+_instances_lock = threading.Lock()
+
+_llm_cache = None
+_caches_lock = threading.Lock()
+
+def get_llm_cache():
+    """
+    Returns the shared on-disk response cache, or None when LLM_CACHE_PATH is empty.
+    """
+    global _llm_cache
+    if not LLM_CACHE_PATH or CASSETTE_MODE:
+        return None
+
+    with _caches_lock:
+        if _llm_cache is None:
+            from utils.llm_cache import PersistentLLMCache
+
+            _llm_cache = PersistentLLMCache(
+                LLM_CACHE_PATH,
+                ttl=LLM_CACHE_TTL,
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+                max_bytes=LLM_CACHE_MAX_BYTES
+            )
+        return _llm_cache
+
+def llm_cache_stats():
+    """
+    Returns the response cache hit/miss counters, or None if the cache hasn't been used.
+    """
+    return _llm_cache.stats() if _llm_cache is not None else None
+
+_tool_cache = None
+
+def get_tool_cache():
+    """
+    Returns the shared agent tool result cache.
+    """
+    global _tool_cache
+    with _caches_lock:
+        if _tool_cache is None:
+            from utils.tool_cache import ToolResultCache
+
+            _tool_cache = ToolResultCache(path=TOOL_CACHE_PATH or None)
+        return _tool_cache
+
+_cassette = None
+
+def get_cassette():
+    """
+    Returns the shared record/replay cassette, or None when CASSETTE_MODE is empty.
+    """
+    global _cassette
+    if not CASSETTE_MODE:
+        return None
+
+    with _caches_lock:
+        if _cassette is None:
+            import atexit
+            from utils.cassette import Cassette
+
+            _cassette = Cassette(CASSETTE_PATH, mode=CASSETTE_MODE, timing=CASSETTE_TIMING)
+            atexit.register(_cassette.close)
+        return _cassette
+
+def cassette_stats():
+    """
+    Returns how many calls were recorded or replayed, or None if no cassette has been used.
+    """
+    return _cassette.stats() if _cassette is not None else None
+
+_semantic_cache = None
+
+def get_semantic_cache():
+    """
+    Returns the shared semantic response cache, or None when SEMANTIC_CACHE_THRESHOLD is 0.
+    """
+    global _semantic_cache
+    if SEMANTIC_CACHE_THRESHOLD <= 0:
+        return None
+
+    with _caches_lock:
+        if _semantic_cache is None:
+            from utils.semantic_cache import SemanticCache
+
+            _semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, capacity=SEMANTIC_CACHE_CAPACITY)
+        return _semantic_cache
+
+_metrics = None
+
+def get_metrics():
+    """
+    Returns the shared latency histograms recorded by every model built here.
+    """
+    global _metrics
+    with _caches_lock:
+        if _metrics is None:
+            from utils.metrics import LatencyMetrics
+
+            _metrics = LatencyMetrics()
+        return _metrics
+
+def _request_sizer(model):
+    """
+    Returns a RequestSizer for models with a max_tokens setting (OpenAI), or None when they aren't sized.
+    """
+    if not ADAPTIVE_MAX_TOKENS or "max_tokens" not in model.__fields__:
+        return None
+
+    from utils.sizing import CONTEXT_LIMITS, DEFAULT_CONTEXT_LIMIT, RequestSizer
+
+    model_name = getattr(model, "model_name", "")
+    return RequestSizer(model_name, CONTEXT_LIMITS.get(model_name, DEFAULT_CONTEXT_LIMIT), MAX_TOKENS_POLICY)
+
+def _build_llm(factory, callbacks, streaming):
+    # Recording, deduplication, the cache & sizing wrap the model, so the model itself is built without callbacks and
+    # the outermost wrapper streams (or replays cached) tokens to the console
+    model = factory([], streaming)
+    sizer = _request_sizer(model)
+    cache = get_llm_cache()
+    cassette = get_cassette()
+
+    if cassette is not None:
+        from utils.cassette import CassetteLLM
+        model = CassetteLLM(llm=model, cassette=cassette)
+    if SINGLE_FLIGHT:
+        from utils.single_flight import SingleFlightLLM
+        model = SingleFlightLLM(llm=model)
+    if cache is not None:
+        from utils.llm_cache import CachedLLM
+        model = CachedLLM(llm=model, response_cache=cache)
+    if sizer is not None:
+        from utils.sizing import SizedLLM
+        model = SizedLLM(llm=model, sizer=sizer)
+    model.callbacks = callbacks
+    return model
+
+def _build_chat_model(factory, callbacks, streaming):
+    model = factory([], streaming)
+    sizer = _request_sizer(model)
+    cassette = get_cassette()
+
+    if cassette is not None:
+        from utils.cassette import CassetteChatModel
+        model = CassetteChatModel(chat=model, cassette=cassette)
+    if SINGLE_FLIGHT:
+        from utils.single_flight import SingleFlightChatModel
+        model = SingleFlightChatModel(chat=model)
+    if sizer is not None:
+        from utils.sizing import SizedChatModel
+        model = SizedChatModel(chat=model, sizer=sizer)
+    model.callbacks = callbacks
+    return model
+
+def _register(factories, kind, name, factory):
+    with _instances_lock:
+        factories[name] = factory
+        for key in [key for key in _instances if key[:2] == (kind, name)]:
+            del _instances[key]
+
+def _get_instance(factories, kind, name, variant, build):
+    key = (kind, name, variant)
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+
+    with _instances_lock:
+        if key not in _instances:
+            if name not in factories:
+                raise KeyError(f"Unknown {kind} '{name}'. Registered: {', '.join(factories)}")
+            if variant not in _VARIANTS:
+                raise KeyError(f"Unknown variant '{variant}'. Available: {', '.join(_VARIANTS)}")
+
+            # All clients share one keep-alive connection pool, set up before the first one is built
+            if not _instances:
+                from utils.http_pool import install_http_pool
+                install_http_pool(HTTP_MAX_CONNECTIONS)
+
+            # Sets up output stream with colors (unless the variant is silent)
+            callbacks, streaming = _VARIANTS[variant]
+            _instances[key] = build(factories[name], callbacks(), streaming)
+        return _instances[key]
+
+def register_llm(name, factory):
+    """
+    Registers a factory that builds a language model from a list of callbacks and a streaming flag.
+    Any cached instances under the same name are dropped so the new factory is used.
+    """
+    _register(_llm_factories, "llm", name, factory)
+
+def register_chat_model(name, factory):
+    """
+    Registers a factory that builds a chat model from a list of callbacks and a streaming flag.
+    Any cached instances under the same name are dropped so the new factory is used.
+    """
+    _register(_chat_model_factories, "chat model", name, factory)
+
+def get_llm(name=None, variant="stream"):
+    """
+    Returns the registered language model, building and caching it on first use.
+    """
+    return _get_instance(_llm_factories, "llm", name or DEFAULT_LLM, variant, _build_llm)
+
+def get_chat_model(name=None, variant="stream"):
+    """
+    Returns the registered chat model, building and caching it on first use.
+    """
+    return _get_instance(_chat_model_factories, "chat model", name or DEFAULT_CHAT_MODEL, variant, _build_chat_model)
+
+# Module attributes kept for backwards compatibility, resolved lazily on first access
+_LAZY_ATTRIBUTES = {
+    "default_llm": None, # Sets default llm to DEFAULT_LLM (OpenAI unless overridden)
+    "default_llm_open_ai": "open_ai",
+    "default_llm_hugging_face": "hugging_face",
+}
+
+def __getattr__(attribute):
+    if attribute in _LAZY_ATTRIBUTES:
+        return get_llm(_LAZY_ATTRIBUTES[attribute])
+    raise AttributeError(f"module {__name__!r} has no attribute {attribute!r}")
 
-# Paid OpenAI model (https://openai.com/blog/openai-api)
-default_llm_open_ai = OpenAI(
-    temperature=0.9,
-    max_tokens=1000,
-    streaming=True,
-    callbacks=[CustomStreamCallback()] # Sets up output stream with colors
-)
-
-# Free HuggingFace model (https://huggingface.co/google/flan-t5-xl)
-default_llm_hugging_face = HuggingFaceHub(
-    repo_id="google/flan-t5-xl", 
-    model_kwargs={
-        "temperature": 0.6,
-        "max_length": 64
-    },
-    callbacks=[CustomStreamCallback()] # Sets up output stream with colors
-) 
-
-# Sets default llm to OpenAI
-default_llm = default_llm_open_ai
-
-#endregion
\ No newline at end of file
+#endregion
@@ -6,24 +6,56 @@ It shows examples of setting up an Agent with tools and parameters, then running
 """
 
 from langchain.prompts import (
-    ChatPromptTemplate, 
     MessagesPlaceholder, 
     SystemMessagePromptTemplate, 
     HumanMessagePromptTemplate
 )
 from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
 
 from langchain.agents import load_tools
 from langchain.agents import initialize_agent
 from langchain.agents import AgentType
 
-from config import default_llm
+from config import get_cassette, get_llm, get_metrics, get_tool_cache, AGENT_MAX_PARALLEL_TOOLS, AGENT_PARALLEL_TOOLS, TOOL_CACHE_TTLS
+from utils.cassette import record_tools
 from utils.console_logger import ConsoleLogger, COLOR_INPUT, COLOR_ERROR
+from utils.custom_stream import CustomStreamCallback
+from utils.memory import IncrementalBufferMemory
+from utils.metrics import MetricsCallback
+from utils.parallel_agent import initialize_parallel_agent
+from utils.prompts import IncrementalChatPromptTemplate
+from utils.sizing import with_policy
+from utils.tool_cache import cache_tools
+
+def load_cached_tools(tool_names, llm=None):
+    """
+    Loads tools and wraps them so repeated calls with the same input reuse earlier results.
+    See TOOL_CACHE_TTLS in config.py for how long each tool's results are kept.
+    With CASSETTE_MODE set (see config.py), tool calls are recorded or replayed instead of cached.
+    """
+    tools = load_tools(tool_names, llm=llm)
+    # Logs tool calls, noting cached results, and records how long each call takes
+    callbacks = [CustomStreamCallback(), MetricsCallback(get_metrics())]
+    cassette = get_cassette()
+    if cassette is not None:
+        return record_tools(tools, cassette, callbacks=callbacks)
+    return cache_tools(tools, get_tool_cache(), TOOL_CACHE_TTLS, callbacks=callbacks)
+
+def build_agent(tools, llm, agent_type, verbose=True):
+    """
+    Sets up an agent with tools & parameters. With AGENT_PARALLEL_TOOLS (see config.py) the agent may ask
+    for several independent tool calls in one step (e.g. two searches), which then run concurrently.
+    """
+    llm = with_policy(llm, "agent") # Short tool choices & answers, so less is reserved for the response
+    if AGENT_PARALLEL_TOOLS:
+        return initialize_parallel_agent(
+            tools, llm, agent=agent_type, max_workers=AGENT_MAX_PARALLEL_TOOLS, verbose=verbose
+        )
+    return initialize_agent(tools, llm, agent=agent_type, verbose=verbose)
 
 def main(): 
     # See config.py for API key setup and default LLMs
-    llm = default_llm
+    llm = get_llm()
 
     # Get example number from user
     ConsoleLogger.log("""
@@ -40,13 +72,13 @@ Options:
 
     if (example_number == 0):
         # Serpapi enables web search
-        tools = load_tools(["serpapi"])
+        tools = load_cached_tools(["serpapi"])
 
         # Set up agent with tools & parameters
-        agent = initialize_agent(
+        agent = build_agent(
             tools, 
             llm,
-            agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION, 
+            AgentType.ZERO_SHOT_REACT_DESCRIPTION, 
             verbose=True # This logs the agent's actions to the console
         )
 
@@ -68,13 +100,13 @@ Options:
 
     if (example_number == 1):
         # Load tools for the agent. Some tools like llm-math require a LLM as an arg.
-        tools = load_tools(["serpapi", "llm-math"], llm=llm)
+        tools = load_cached_tools(["serpapi", "llm-math"], llm=llm)
 
         # Initialize an agent with the tools, language model, and type of agent
-        agent = initialize_agent(
+        agent = build_agent(
             tools, 
             llm,
-            agent=AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION, # Simple response
+            AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION, # Simple response
             verbose=True
         )
 
@@ -87,20 +119,21 @@ Options:
 
     if (example_number == 2):
         # Define a custom prompt for the conversation
-        prompt = ChatPromptTemplate.from_messages([
+        prompt = IncrementalChatPromptTemplate.from_messages([
             SystemMessagePromptTemplate.from_template("The following is a friendly conversation between a human and an AI. The AI is talkative and provides lots of specific details from its context. If the AI does not know the answer to a question, it truthfully says it does not know."),
             MessagesPlaceholder(variable_name="history"),
             HumanMessagePromptTemplate.from_template("{input}")
         ])
 
         # Set up buffer memory for the conversation, which will retain the last few messages
-        memory = ConversationBufferMemory(return_messages=True)
+        # (each turn is rendered once, when it is saved, instead of on every prompt)
+        memory = IncrementalBufferMemory(return_messages=True)
 
         # Initialize ConversationChain with custom prompt, memory, and language model
         conversation = ConversationChain(
             memory=memory, 
             prompt=prompt, 
-            llm=llm,
+            llm=with_policy(llm, "conversation"),
             verbose=True # Context is logged to console (in green)
         )
 
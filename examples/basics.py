@@ -3,56 +3,170 @@ This script introduces basic LangChain components. It demonstrates how to:
 - Build a prompt with input variables using PromptTemplate
 - Create an LLMChain, which wraps the prompt and language model for easy use
 - Run the chain with input variables taken from user input
+- Run the same chain with the async API (see amain), so several plans can stream on one event loop
+- Run the same chain over a file of inputs without prompting (see build_batch_handler & main.py --example)
+- Plan events in bulk from a CSV, resuming where an interrupted run stopped (see plan_events_from_csv)
 """
 
-from langchain import LLMChain, PromptTemplate
+import itertools
+import time
 
-from config import default_llm
+from langchain import LLMChain
+
+from config import BATCH_CONCURRENCY, BATCH_PROMPTS_PER_REQUEST, get_llm
+from utils.batch_runner import BatchStats, ResultLog, read_csv, run_batch
 from utils.console_logger import ConsoleLogger, COLOR_INPUT
+from utils.prompts import CompiledPromptTemplate
+from utils.sizing import with_policy
 
-def main():
-    # See config.py for API key setup and default LLMs
-    llm = default_llm
+DEFAULT_EVENT = "Laser Tag"
+DEFAULT_TEAM_SIZE = "1 million"
+INSTRUCTIONS = "You are an event planner for corporate team-building events. Plan an event that achieves the given objective for a team of the specified size."
+
+# Questions asked for the plan, with their defaults
+PLAN_QUESTIONS = (
+    ("Event", DEFAULT_EVENT),
+    ("Team Size", DEFAULT_TEAM_SIZE),
+)
 
+def build_chain(llm):
     # Set up a PromptTemplate, which handles input variables much like an fstring. 
     # The 'input_variables' parameter lists the names of the variables that will be used in the template.
-    # This building block approach is helpful as things scale
-    prompt = PromptTemplate(
+    # This building block approach is helpful as things scale.
+    # CompiledPromptTemplate parses the template once here, and remembers its last formatted prompt,
+    # so logging the prompt and then running the chain with the same inputs only formats it once.
+    prompt = CompiledPromptTemplate(
         input_variables=["event_objective", "team_size"],
-        template="You are an event planner for corporate team-building events. Plan an event that achieves the given objective for a team of the specified size.\nEvent objective: {event_objective}\nTeam size: {team_size}"
+        template=INSTRUCTIONS + "\nEvent objective: {event_objective}\nTeam size: {team_size}"
     )
 
     # Create an LLMChain. This is a convenience object that wraps a prompt and an LLM,
     # providing an easy way to use the two together.
-    llm_chain = LLMChain(prompt=prompt, llm=llm)
+    llm_chain = LLMChain(prompt=prompt, llm=with_policy(llm, "plan"))
+    return prompt, llm_chain
+
+def row_inputs(row):
+    # Chain inputs for a batch or CSV row, with the defaults for missing values
+    return {
+        "event_objective": row.get("event_objective", DEFAULT_EVENT),
+        "team_size": row.get("team_size", DEFAULT_TEAM_SIZE)
+    }
+
+def plan_request(prompt, event_objective, team_size):
+    # Format prompt with input variables & log to console, returning the inputs for the chain
+    inputs = {"event_objective": event_objective, "team_size": team_size}
+    formatted_prompt = prompt.format(**inputs)
+    ConsoleLogger.log_input(f"\n\n{formatted_prompt}")
+    return inputs
+
+# Log bulk progress every this many rows
+PROGRESS_EVERY = 100
+
+def main():
+    # A CSV of events plans them all (see plan_events_from_csv), otherwise a single event is planned
+    csv_path = ConsoleLogger.input_with_default(
+        "CSV of events to plan in bulk (leave blank to plan one)",
+        "",
+        show_default=False
+    )
+    if csv_path:
+        output_path = ConsoleLogger.input_with_default("Results file", csv_path.rsplit(".", 1)[0] + ".plans.jsonl")
+        plan_events_from_csv(csv_path, output_path)
+        return
+
+    # See config.py for API key setup and default LLMs
+    llm = get_llm()
+    prompt, llm_chain = build_chain(llm)
 
     # Print start of prompt to console
-    ConsoleLogger.log("Prompt:\nYou are an event planner for corporate team-building events. Plan an event that achieves the given objective for a team of the specified size.\n")
+    ConsoleLogger.log(f"Prompt:\n{INSTRUCTIONS}\n")
 
     # Get task and team size from user
-    event_objective = ConsoleLogger.input_with_default(
-        "Event",
-        "Laser Tag" # default value
-    )
-    team_size = ConsoleLogger.input_with_default(
-        "Team Size",
-        "1 million" # default value
-    )
+    event_objective, team_size = [ConsoleLogger.input_with_default(question, default) for question, default in PLAN_QUESTIONS]
 
-    # Format prompt with input variables for logging
-    formatted_prompt = prompt.format(
-        event_objective=event_objective, 
-        team_size=team_size
-    )
-    # Log formatted prompt
-    ConsoleLogger.log_input(f"\n\n{formatted_prompt}")
+    # Provide input variables to the chain's run method directly
+    # and the chain handles the template formatting (reusing the prompt formatted & logged by plan_request)
+    response = llm_chain.run(**plan_request(prompt, event_objective, team_size)) # Thinking...
+
+def build_batch_handler():
+    """
+    Returns a function that plans one event per input row ({"event_objective": ..., "team_size": ...}),
+    for headless batches (see main.py). The chain is built once and shared by all workers.
+    """
+    prompt, llm_chain = build_chain(get_llm(variant="silent"))
+
+    def handle(row):
+        return {"plan": llm_chain.run(**row_inputs(row))}
+    return handle
+
+def plan_events_from_csv(csv_path, output_path, concurrency=BATCH_CONCURRENCY, batch_size=BATCH_PROMPTS_PER_REQUEST):
+    """
+    Plans an event for every row of a CSV with "event_objective" & "team_size" columns. Rows are sent to the
+    model `batch_size` at a time in one request, with `concurrency` requests in flight. Rows are read as
+    requests free up and each plan is appended to output_path (JSONL, with the row's "index") as soon as its
+    request is done, so neither the CSV nor the plans are held in memory.
+    Rerunning with the same files skips the rows already planned, so an interrupted run carries on where it
+    stopped. Rows that fail are recorded with their error and retried by the next run, which appends their plan.
+    """
+    prompt, llm_chain = build_chain(get_llm(variant="silent"))
+    results = ResultLog(output_path)
+    if len(results):
+        ConsoleLogger.log(f"Resuming: {len(results)} rows already planned in {output_path}")
+
+    def plan(batch):
+        # apply formats every row's prompt and sends them to the model together
+        return llm_chain.apply([row_inputs(row) for _, row in batch])
+
+    # Batches of (index, row) by their position in the run, kept only while they're being planned
+    pending = {}
+    positions = itertools.count()
+
+    def unfinished_batches():
+        rows = ((index, row) for index, row in enumerate(read_csv(csv_path)) if not results.is_done(index))
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            pending[next(positions)] = batch
+            yield batch
+
+    stats = BatchStats() # Rows
+    try:
+        for position, outputs, error in run_batch(plan, unfinished_batches(), concurrency):
+            if position not in pending:
+                # Reading the CSV itself failed, which ends the rows
+                ConsoleLogger.log_error(f"Stopped reading {csv_path}: {error}")
+                continue
+            finished = stats.completed + stats.failed
+            for number, (index, row) in enumerate(pending.pop(position)):
+                result = {"index": index, "event_objective": row.get("event_objective"), "team_size": row.get("team_size")}
+                if error is None:
+                    result["plan"] = outputs[number][llm_chain.output_key]
+                    stats.completed += 1
+                else:
+                    result["error"] = f"{type(error).__name__}: {error}"
+                    stats.failed += 1
+                results.write(result)
+            if (stats.completed + stats.failed) // PROGRESS_EVERY > finished // PROGRESS_EVERY:
+                ConsoleLogger.log(str(stats))
+    finally:
+        stats.finished_at = time.perf_counter()
+        results.close()
+    ConsoleLogger.log(f"Planned {stats}; results in {output_path}")
+    return stats
+
+async def amain():
+    # Same as main, but the LLM uses the async callback handler and the chain is awaited
+    llm = get_llm(variant="async_stream")
+    prompt, llm_chain = build_chain(llm)
+
+    ConsoleLogger.log(f"Prompt:\n{INSTRUCTIONS}\n")
+
+    # Get task and team size from user without blocking the event loop
+    event_objective, team_size = [await ConsoleLogger.ainput_with_default(question, default) for question, default in PLAN_QUESTIONS]
 
-    # Provide input variables to the chain's run method directly 
-    # and the chain handles the template formatting
-    response = llm_chain.run(
-        event_objective=event_objective, 
-        team_size=team_size
-    ) # Thinking...
+    # arun yields to the event loop while waiting on the API, so other chains can run concurrently
+    response = await llm_chain.arun(**plan_request(prompt, event_objective, team_size)) # Thinking...
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+"""
+This script serves the conversation from interactive_chat.py over HTTP, so many users can chat at once.
+It is a small asyncio server (no web framework) where:
+- Each session has its own memory, kept for the most recent CHAT_SERVER_MAX_SESSIONS sessions (see config.py)
+- Responses are streamed token by token as server-sent events, using a callback much like CustomStreamCallback
+- Every session runs on the same event loop, so hundreds of concurrent conversations share one process
+
+Try it with:
+    curl -N -X POST localhost:8000/chat -d '{"session_id": "demo", "message": "Tell me about octopuses"}'
+"""
+
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.chains import ConversationChain
+
+from config import (
+    get_llm,
+    CHAT_SERVER_HOST,
+    CHAT_SERVER_MAX_SESSIONS,
+    CHAT_SERVER_PORT,
+    CHAT_SESSION_DIR,
+)
+from examples.interactive_chat import build_conversation
+from utils.console_logger import ConsoleLogger, COLOR_INPUT
+from utils.memory import TokenBudgetMemory
+from utils.session_store import SESSION_ID_PATTERN, SessionLog
+
+MAX_BODY_BYTES = 64 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+class HTTPError(Exception):
+    """
+    Ends a request with an error status & JSON message.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class SSECallback(AsyncCallbackHandler):
+    """
+    Streams tokens into a queue that the HTTP handler sends as server-sent events.
+    It is passed per request, so each client only receives its own tokens.
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.queue.put_nowait(token)
+
+
+class ChatSession:
+    """
+    One conversation, the lock that runs its turns one at a time, and its log when sessions are persisted.
+    The conversation is built by the session's first turn. `turns` counts the turns running or waiting for
+    the lock, which keep the session from being dropped.
+    """
+
+    def __init__(self):
+        self.conversation: Optional[ConversationChain] = None
+        self.lock = asyncio.Lock()
+        self.session_log: Optional[SessionLog] = None
+        self.turns = 0
+
+
+class ChatSessions:
+    """
+    Conversations by session id. Past max_sessions, the least recently used sessions without a turn in
+    progress are dropped (so a busy server can briefly hold more). Turns within one session are run one
+    at a time, so its memory stays in order.
+    Session logs are opened, read, written & closed by one writer thread, so a slow disk never holds up
+    the event loop, and each log is closed after its last turn has been written.
+    """
+
+    def __init__(self, llm, max_sessions: int = 1000):
+        self.llm = llm
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-log")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @asynccontextmanager
+    async def turn(self, session_id: str) -> AsyncIterator[ConversationChain]:
+        """
+        Yields the session's conversation once its previous turns have finished.
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = ChatSession()
+        self._sessions.move_to_end(session_id)
+        session.turns += 1
+        self._evict()
+
+        try:
+            async with session.lock:
+                if session.conversation is None:
+                    await self._start(session, session_id)
+                yield session.conversation
+        finally:
+            session.turns -= 1
+            self._evict()
+
+    async def _start(self, session: ChatSession, session_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        if CHAT_SESSION_DIR:
+            # Sessions are persisted & resumed just like in interactive_chat.py
+            session.session_log = await loop.run_in_executor(self._log_writer, SessionLog, CHAT_SESSION_DIR, session_id)
+        conversation = build_conversation(self.llm, session.session_log, self._log_writer)
+        if session.session_log is not None:
+            # Reads the resumed turns now, rather than on the event loop when the first prompt is built
+            await loop.run_in_executor(self._log_writer, conversation.memory.load_memory_variables, {})
+        session.conversation = conversation
+
+    def _evict(self) -> None:
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            session = self._sessions[session_id]
+            if not session.turns:
+                del self._sessions[session_id]
+                self._close(session)
+
+    def _close(self, session: ChatSession) -> None:
+        if session.session_log is not None:
+            self._log_writer.submit(session.session_log.close)
+        if session.conversation is not None and isinstance(session.conversation.memory, TokenBudgetMemory):
+            # Lets its background summary thread exit
+            session.conversation.memory.close()
+
+    def close(self) -> None:
+        """
+        Drops every session, closing their logs once the turns still being written are done.
+        """
+        for session in self._sessions.values():
+            self._close(session)
+        self._sessions.clear()
+        self._log_writer.shutdown(wait=True)
+
+
+class ChatServer:
+    """
+    HTTP endpoints:
+        POST /chat {"session_id": "...", "message": "..."} - streams the reply as server-sent events:
+            data: {"token": "..."} for each token, then event: end with {"response": "..."}
+            (or event: error with {"error": "..."})
+        GET /health - {"status": "ok", "sessions": <count>}
+    """
+
+    def __init__(self, llm, host: str = CHAT_SERVER_HOST, port: int = CHAT_SERVER_PORT, max_sessions: int = CHAT_SERVER_MAX_SESSIONS):
+        self.host = host
+        self.port = port
+        self.sessions = ChatSessions(llm, max_sessions)
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> "ChatServer":
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=MAX_BODY_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1] # The real port when 0 was given
+        return self
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.to_thread(self.sessions.close)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # One request per connection, which keeps the server simple & suits long-lived event streams
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+
+            if path == "/health" and method == "GET":
+                await send_json(writer, 200, {"status": "ok", "sessions": len(self.sessions)})
+            elif path == "/chat" and method == "POST":
+                await self.handle_chat(writer, body)
+            elif path in ("/chat", "/health"):
+                await send_json(writer, 405, {"error": f"{method} not allowed on {path}"})
+            else:
+                await send_json(writer, 404, {"error": f"Unknown path {path}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Client went away
+        except HTTPError as error:
+            await send_json(writer, error.status, {"error": str(error)})
+        except ValueError:
+            # StreamReader.readline raises this for lines longer than the read limit
+            await send_json(writer, 400, {"error": "Request line or header too long"})
+        finally:
+            writer.close()
+
+    async def handle_chat(self, writer: asyncio.StreamWriter, body: bytes) -> None:
+        try:
+            payload = json.loads(body or b"{}")
+            session_id, message = str(payload["session_id"]), str(payload["message"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'Expected a JSON body like {"session_id": "...", "message": "..."}')
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise HTTPError(400, "session_id may only contain letters, numbers, '.', '_' or '-'")
+
+        writer.write(response_head(200, "text/event-stream", {"Cache-Control": "no-cache"}))
+
+        async with self.sessions.turn(session_id) as conversation:
+            # Tokens arrive through the callback while the conversation runs, and are sent as they come
+            queue = asyncio.Queue()
+            turn = asyncio.create_task(conversation.apredict(input=message, callbacks=[SSECallback(queue)]))
+            turn.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                finished = False
+                while not finished:
+                    # Tokens that queued up while the last batch was sent go out in one write
+                    tokens = [await queue.get()]
+                    while not queue.empty():
+                        tokens.append(queue.get_nowait())
+                    finished = tokens[-1] is None
+                    writer.write(b"".join(sse_event({"token": token}) for token in tokens if token is not None))
+                    await writer.drain()
+                response = await turn
+            except ConnectionError:
+                turn.cancel()
+                raise
+            except Exception as error:
+                writer.write(sse_event({"error": str(error)}, "error"))
+            else:
+                writer.write(sse_event({"response": response}, "end"))
+        await writer.drain()
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+    """
+    Reads one HTTP/1.1 request, returning (method, path, body), or None if the connection closed first.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Request body too large (max {MAX_BODY_BYTES} bytes)")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def response_head(status: int, content_type: str, headers: Optional[Dict[str, str]] = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", f"Content-Type: {content_type}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> bytes:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(response_head(status, "application/json", {"Content-Length": str(len(body))}) + body)
+    await writer.drain()
+
+
+def main():
+    try:
+        asyncio.run(amain())
+    except KeyboardInterrupt:
+        ConsoleLogger.log("Chat server stopped", COLOR_INPUT)
+
+async def amain():
+    # See config.py for API key setup and default LLMs.
+    # The LLM streams without printing; each request passes its own callback to receive the tokens.
+    server = await ChatServer(get_llm(variant="async_headless")).start()
+    ConsoleLogger.log(f"Chat server listening on http://{server.host}:{server.port} (Ctrl+C to stop)", COLOR_INPUT)
+    ConsoleLogger.log(
+        f"""curl -N -X POST localhost:{server.port}/chat -d '{{"session_id": "demo", "message": "Tell me about octopuses"}}'"""
+    )
+    async with server.server:
+        await server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
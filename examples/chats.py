@@ -2,9 +2,10 @@
 This script demonstrates how the ChatOpenAI class is used to create interactive conversations with AI.
 It presents different ways to communicate with LangChain Chat Models, such as single messages, multi-messages, and batch messages.
 It also illustrates the usage of Chat Prompt Templates and Chat Chains to simplify interaction with LLMs in a chat context.
+The async entry point (amain) runs the same examples with the async chat & chain APIs,
+and build_batch_handler answers message lists from a file without prompting (see main.py --example).
 """
 
-from langchain.chat_models import ChatOpenAI
 from langchain import LLMChain
 from langchain.schema import (
     HumanMessage,
@@ -16,127 +17,156 @@ from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
 )
 
-from config import default_llm
+from config import get_chat_model, BATCH_CONCURRENCY, STREAM_GUARD_MAX_CHARS
+from utils.batch_runner import BatchStats, messages_from_json, read_message_batches, run_batch
 from utils.console_logger import ConsoleLogger, COLOR_INPUT, COLOR_TOOL
-from utils.custom_stream import CustomStreamCallback
+from utils.sizing import with_policy
+from utils.stream_guards import MaxCharsGuard, with_guards
 
-def main():
-    # See config.py for API key setup and default LLMs
-    llm = default_llm
-
-    # Get example number from user
-    ConsoleLogger.log("""
-Novel examples demonstrating how chats streamline LLM interactions.\n
+OPTIONS = """
+Novel examples demonstrating how chats streamline LLM interactions{mode}.\n
 Options:
     0: Single message example (Silly-GPT) 
     1: Multi-message example (Silly-GPT)
     2: Batch messages example (Silly-GPT)
     3: Chat prompt template example (Pirate-GPT)
-    """)
-    example_number = ConsoleLogger.input_int(
-        "Which example would you like to run? (0-4): "
+    """
+CHOOSE_EXAMPLE = "Which example would you like to run? (0-3): "
+
+# Prompts
+SILLY_GPT_PROMPT = "You are Silly-GPT and you only respond in an over-jubilant silly fashion."
+TIRED_PROMPT = "It is 3:30AM and I am hungry. I am tired. But I enjoy late night programming. You get it, right?"
+EXPLAIN_AI_PROMPT = "Explain how AI works"
+EXPLAIN_HISTORY_PROMPT = "encapsulate the history of humanity"
+
+# Chat prompt template for Pirate-GPT, composed of a system message template and a human message template
+PIRATE_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template(
+        "You are now Pirate-GPT and respond grammatically as such. You are living in the year {pirate_year} and will provide detailed information specific to the time and your experience as a seasoned pirate."
+    ),
+    HumanMessagePromptTemplate.from_template("{message}")
+])
+# Questions asked for the template's input variables, with their defaults
+PIRATE_QUESTIONS = (
+    ("Year", "1900"),
+    ("Message", "Where are the most treasurous areas of the world?"),
+)
+
+def guarded(chat):
+    """
+    Stops streamed responses once they've said enough (see STREAM_GUARD_MAX_CHARS in config.py),
+    since Silly-GPT & Pirate-GPT would otherwise go on until max_tokens.
+    """
+    if not STREAM_GUARD_MAX_CHARS:
+        return chat
+    return with_guards(chat, MaxCharsGuard(STREAM_GUARD_MAX_CHARS))
+
+def single_message():
+    # Single message example: the chat model generates a response to a single human message.
+    ConsoleLogger.log_input(TIRED_PROMPT)
+    return [
+        HumanMessage(content=TIRED_PROMPT)
+    ]
+
+def multi_message():
+    # Multi-message example: the chat model generates a response considering multiple messages as context
+    ConsoleLogger.log_input(
+        f"\nSystem Message: {SILLY_GPT_PROMPT}\nHuman Message: {TIRED_PROMPT}"
     )
-    ConsoleLogger.log(f"Running Example {example_number}\n", COLOR_TOOL)
+    return [
+        SystemMessage(content=SILLY_GPT_PROMPT),
+        HumanMessage(content=TIRED_PROMPT)
+    ]
+
+def silly_batch():
+    # Several sets of messages, each answered separately
+    ConsoleLogger.log_input(
+        f"{SILLY_GPT_PROMPT} Respond to the the following:\n1. {EXPLAIN_AI_PROMPT}\n2. {EXPLAIN_HISTORY_PROMPT}\n"
+    )
+    return [
+        [
+            SystemMessage(content=SILLY_GPT_PROMPT), # You are Silly-GPT
+            HumanMessage(content=EXPLAIN_AI_PROMPT)
+        ],
+        [
+            SystemMessage(content=SILLY_GPT_PROMPT), # You are Silly-GPT
+            HumanMessage(content=EXPLAIN_HISTORY_PROMPT)
+        ],
+    ]
+
+def log_batch_response(index, message, response, silly=True):
+    ConsoleLogger.log(
+        f"Input {index + 1} - (in a silly manner) {message}:" if silly else f"Input {index + 1} - {message}:",
+        COLOR_INPUT
+    )
+    ConsoleLogger.log_response(response)
 
-    # Initialize chat 
-    chat = ChatOpenAI(
-        temperature=0.9, max_tokens=1000,
-        streaming=True,
-        callbacks=[CustomStreamCallback()] # Sets up output stream with colors
+def pirate_intro():
+    ConsoleLogger.log(
+        "Enter a year and a message to send to Pirate-GPT for a time-travelling response.\n",
+        COLOR_INPUT
     )
 
-    # Prepare prompts
-    silly_gpt_prompt = "You are Silly-GPT and you only respond in an over-jubilant silly fashion."
-    tired_prompt = "It is 3:30AM and I am hungry. I am tired. But I enjoy late night programming. You get it, right?"
+def pirate_prompt(pirate_year, message):
+    # Format the prompt, passing the arguments for each template in directly to the format_prompt method
+    formatted_prompt = PIRATE_PROMPT.format_prompt(
+        pirate_year=pirate_year,
+        message=message
+    )
+    # Log prompt to console
+    ConsoleLogger.log_input(formatted_prompt.to_string())
+    return formatted_prompt
+
+def main():
+    # Get example number from user
+    ConsoleLogger.log(OPTIONS.format(mode=""))
+    example_number = ConsoleLogger.input_int(CHOOSE_EXAMPLE)
+    ConsoleLogger.log(f"Running Example {example_number}\n", COLOR_TOOL)
+
+    # Initialize chat (see config.py, the chat model is built once and reused across runs)
+    chat = guarded(with_policy(get_chat_model(), "chat"))
 
-    # Single message example: the chat model generates a response to a single human message.
     if example_number == 0:
-        ConsoleLogger.log_input(tired_prompt)
-        result = chat([
-            HumanMessage(content=tired_prompt)
-        ]) # Thinking...
+        result = chat(single_message()) # Thinking...
 
-    # Multi-message example: the chat model generates a response considering multiple messages as context
     if example_number == 1:
-        ConsoleLogger.log_input(
-            f"\nSystem Message: {silly_gpt_prompt}\nHuman Message: {tired_prompt}"
-        )
-        result = chat([
-            SystemMessage(content=silly_gpt_prompt),
-            HumanMessage(content=tired_prompt)
-        ]) # Thinking...
+        result = chat(multi_message()) # Thinking...
 
     # Batch messages example: the chat model generates responses for several sets of messages in parallel.
     if example_number == 2:
-        # Prepare prompts & log to console
-        explain_ai_prompt = "Explain how AI works"
-        explain_history_prompt = "encapsulate the history of humanity"
-        ConsoleLogger.log_input(
-            f"{silly_gpt_prompt} Respond to the the following:\n1. {explain_ai_prompt}\n2. {explain_history_prompt}\n"
-        )
-        
-        batch_messages = [
-            [
-                SystemMessage(content=silly_gpt_prompt), # You are Silly-GPT
-                HumanMessage(content=explain_ai_prompt)
-            ],
-            [
-                SystemMessage(content=silly_gpt_prompt), # You are Silly-GPT
-                HumanMessage(content=explain_history_prompt)
-            ],
-        ]
-
-        result = chat.generate(batch_messages) # Thinking...
-
-        # Log responses to console
-        ConsoleLogger.log(
-            f"Input 1 - (in a silly manner) {explain_ai_prompt}:",
-            COLOR_INPUT
-        )
-        ConsoleLogger.log_response(result.generations[0][0].text)
-        ConsoleLogger.log(
-            f"Input 2 - (in a silly manner) {explain_history_prompt}:", 
-            COLOR_INPUT
+        # Message lists can come from a JSONL file, one {"messages": [{"role": ..., "content": ...}]} per line
+        batch_path = ConsoleLogger.input_with_default(
+            "JSONL file of message lists (leave blank for the Silly-GPT example)",
+            "", # default value, use the built-in batch
+            show_default=False
         )
-        ConsoleLogger.log_response(result.generations[1][0].text)
+        # A file is read lazily, so large files are streamed through the batch rather than loaded up front
+        batch_messages = read_message_batches(batch_path) if batch_path else silly_batch()
+
+        # Batches use a chat model that doesn't stream, since concurrent streams would interleave in the console.
+        # Up to BATCH_CONCURRENCY requests run at once (see config.py), and each response is logged as it finishes.
+        batch_chat = with_policy(get_chat_model(variant="silent"), "chat")
+        stats = BatchStats()
+        for index, result, error in run_batch(
+            lambda messages: (messages[-1].content, batch_chat(messages).content),
+            batch_messages,
+            concurrency=BATCH_CONCURRENCY,
+            stats=stats
+        ): # Thinking...
+            if error:
+                ConsoleLogger.log_error(f"Input {index + 1} failed: {error}")
+                continue
+            message, response = result
+            log_batch_response(index, message, response, silly=not batch_path)
+
+        ConsoleLogger.log(f"Batch finished: {stats}", COLOR_TOOL)
 
     # Chat prompt template example: the chat model generates a response based on a formatted prompt.
     if example_number == 3:
-        # Generate prompt template for system message
-        template = "You are now Pirate-GPT and respond grammatically as such. You are living in the year {pirate_year} and will provide detailed information specific to the time and your experience as a seasoned pirate."
-        system_message_prompt = SystemMessagePromptTemplate.from_template(template)
-
-        # Generate prompt template for human message
-        human_template = "{message}"
-        human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
-
         # Get user input for pirate year and message
-        ConsoleLogger.log(
-            "Enter a year and a message to send to Pirate-GPT for a time-travelling response.\n",
-            COLOR_INPUT
-        )
-        pirate_year = ConsoleLogger.input_with_default(
-            "Year",
-            "1900" # default value
-        )
-        message = ConsoleLogger.input_with_default(
-            "Message",
-            "Where are the most treasurous areas of the world?" # default value
-        )
-
-        # Compose chat prompt template from the templates 
-        chat_prompt = ChatPromptTemplate.from_messages([
-            system_message_prompt,
-            human_message_prompt
-        ])
-        # Format the prompt, passing the arguments for each template in directly to the format_prompt method
-        formatted_prompt = chat_prompt.format_prompt(
-            pirate_year=pirate_year, 
-            message=message
-        )
-
-        # Log prompt to console
-        ConsoleLogger.log_input(formatted_prompt.to_string())
+        pirate_intro()
+        pirate_year, message = [ConsoleLogger.input_with_default(question, default) for question, default in PIRATE_QUESTIONS]
+        formatted_prompt = pirate_prompt(pirate_year, message)
 
         # There are several ways to run chat prompt templates
         use_chat_chain = False
@@ -147,13 +177,56 @@ Options:
             ) # Thinking...
         else:
             # Create chat chain
-            chain = LLMChain(llm=chat, prompt=chat_prompt)
+            chain = LLMChain(llm=chat, prompt=PIRATE_PROMPT)
             # Run chain with input variables
             result = chain.run(
                 pirate_year=pirate_year, 
                 message=message
             ) # Thinking...
 
+def build_batch_handler():
+    """
+    Returns a function that answers one message list per input row ({"messages": [{"role": ..., "content": ...}, ...]}),
+    for headless batches (see main.py).
+    """
+    batch_chat = with_policy(get_chat_model(variant="silent"), "chat")
+
+    def handle(row):
+        return {"response": batch_chat(messages_from_json(row["messages"])).content}
+    return handle
+
+async def amain():
+    # Same options as main, but the chat model uses the async callback handler and every call is awaited
+    ConsoleLogger.log(OPTIONS.format(mode=" (async)"))
+    example_number = await ConsoleLogger.ainput_int(CHOOSE_EXAMPLE)
+    ConsoleLogger.log(f"Running Example {example_number}\n", COLOR_TOOL)
+
+    chat = guarded(with_policy(get_chat_model(variant="async_stream"), "chat"))
+
+    if example_number == 0:
+        result = await chat.agenerate([single_message()]) # Thinking...
+
+    if example_number == 1:
+        result = await chat.agenerate([multi_message()]) # Thinking...
+
+    if example_number == 2:
+        # agenerate sends every message list concurrently instead of one after another
+        batch_messages = silly_batch()
+        result = await chat.agenerate(batch_messages) # Thinking...
+
+        for index, (messages, generations) in enumerate(zip(batch_messages, result.generations)):
+            log_batch_response(index, messages[-1].content, generations[0].text)
+
+    if example_number == 3:
+        pirate_intro()
+        pirate_year, message = [await ConsoleLogger.ainput_with_default(question, default) for question, default in PIRATE_QUESTIONS]
+        pirate_prompt(pirate_year, message)
+
+        chain = LLMChain(llm=chat, prompt=PIRATE_PROMPT)
+        result = await chain.arun(
+            pirate_year=pirate_year,
+            message=message
+        ) # Thinking...
 
 if __name__ == "__main__":
     main()
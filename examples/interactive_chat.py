@@ -2,40 +2,139 @@
 This script demonstrates a simple interactive conversation loop with a user.
 It uses LangChain components to handle conversation management, memory, 
 and language model interactions.
+The async entry point (amain) runs the same loop with the async chain API,
+and build_batch_handler replays scripted conversations from a file (see main.py --example).
 """
 
+import asyncio
+import threading
+import time
+import uuid
+
 from langchain.prompts import (
-    ChatPromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate
 )
 from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
 
-from config import default_llm
-from utils.console_logger import ConsoleLogger, COLOR_INPUT
+from config import (
+    get_llm,
+    get_semantic_cache,
+    CHAT_MEMORY_TOKEN_BUDGET,
+    CHAT_SESSION_DIR,
+    CHAT_SESSION_TAIL_TURNS,
+    SEMANTIC_CACHE_MIN_WORDS
+)
+from utils.console_logger import ConsoleLogger, COLOR_INPUT, COLOR_TOOL
+from utils.memory import IncrementalBufferMemory, TokenBudgetMemory
+from utils.prompts import IncrementalChatPromptTemplate
+from utils.session_store import SessionLog, SessionMemory
+from utils.sizing import with_policy
 
-def main():
-    # See config.py for API key setup and default LLMs
-    llm = default_llm
+def choose_session():
+    """
+    Asks for a session to resume when persistent sessions are enabled (see config.py).
+    Returns the session log, or None when sessions are kept in memory only.
+    """
+    if not CHAT_SESSION_DIR:
+        return None
 
+    session_id = ConsoleLogger.input_with_default(
+        "Session name (enter an existing one to resume)",
+        time.strftime("session-%Y%m%d-%H%M%S") # default value, a new session
+    )
+    session_log = SessionLog(CHAT_SESSION_DIR, session_id)
+    if len(session_log):
+        ConsoleLogger.log(f"Resuming session '{session_id}' ({len(session_log)} turns)", COLOR_INPUT)
+    return session_log
+
+SYSTEM_PROMPT = "You are a helpful and friendly AI, trained to answer questions about the world and the creatures, places, and things that inhabit it."
+
+def build_conversation(llm, session_log=None, log_writer=None):
     # Prepare the Chat Prompt Template that will be passed to the ConversationChain.
     # It includes a system message, a placeholder for the conversation history,
-    # and a human message for user input.
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(
-            "You are a helpful and friendly AI, trained to answer questions about the world and the creatures, places, and things that inhabit it."
-        ),
+    # and a human message for user input. The history is used as text already rendered by the memory when it can be.
+    prompt = IncrementalChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT),
         MessagesPlaceholder(variable_name="history"),
         HumanMessagePromptTemplate.from_template("{input}")
     ])
 
-    # Set up simple memory for the conversation
-    memory = ConversationBufferMemory(return_messages=True)
+    # Set up memory for the conversation.
+    # - A persistent session appends each turn to disk and only loads the latest turns into the prompt.
+    # - With a token budget (see config.py), older turns are summarized in the background so the
+    #   prompt stays roughly the same size however long the chat gets.
+    if session_log is not None:
+        memory = SessionMemory(
+            session_log=session_log,
+            writer=log_writer, # Turns are written by this executor when given (see chat_server.py)
+            k=CHAT_SESSION_TAIL_TURNS,
+            return_messages=True
+        )
+    elif CHAT_MEMORY_TOKEN_BUDGET > 0:
+        memory = TokenBudgetMemory(
+            llm=get_llm(variant="silent"), # Summaries are made in the background without printing
+            max_token_limit=CHAT_MEMORY_TOKEN_BUDGET,
+            return_messages=True
+        )
+    else:
+        # Simple memory that keeps (and resends) the whole conversation, rendering each turn only once
+        memory = IncrementalBufferMemory(return_messages=True)
 
     # Wrap everything in a ConversationChain
-    conversation = ConversationChain(memory=memory, prompt=prompt, llm=llm)
+    conversation = ConversationChain(memory=memory, prompt=prompt, llm=with_policy(llm, "conversation"))
+    return conversation
+
+def cache_context(conversation, session_id, user_input):
+    """
+    Returns the semantic cache context for a question: the session it's asked in, the system prompt and,
+    with a token budget, the running summary. These stay the same from turn to turn, so asking a question
+    again in the same session reuses the answer, while other sessions (and a conversation whose older turns
+    have been summarized differently) don't share it.
+    Returns None for questions too short to mean much on their own ("why?", "tell me more"), which skip the cache.
+    """
+    if len(user_input.split()) < SEMANTIC_CACHE_MIN_WORDS:
+        return None
+    summary = getattr(conversation.memory, "summary", "")
+    return f"{session_id}\0{SYSTEM_PROMPT}\0{summary}"
+
+def cached_response(conversation, semantic_cache, user_input, context):
+    """
+    Returns an earlier answer to a near-identical question in the same context from the semantic cache
+    (see config.py), or None. A hit is logged and saved to memory like a normal turn, so the conversation
+    continues from it.
+    """
+    if semantic_cache is None or context is None:
+        return None
+    hit = semantic_cache.lookup(user_input, context)
+    if hit is None:
+        return None
+
+    response, similarity = hit
+    ConsoleLogger.log(f"(Answered before - {similarity:.0%} similar question)", COLOR_TOOL)
+    ConsoleLogger.log_response(response)
+    conversation.memory.save_context({"input": user_input}, {"response": response})
+    return response
+
+def answer(conversation, session_id, semantic_cache, user_input):
+    """
+    Answers one turn, from the semantic cache when a near-duplicate question was asked before in the same context.
+    """
+    context = cache_context(conversation, session_id, user_input) if semantic_cache is not None else None
+    response = cached_response(conversation, semantic_cache, user_input, context)
+    if response is None:
+        response = conversation.predict(input=user_input) # Thinking...
+        if context is not None:
+            semantic_cache.update(user_input, response, context)
+    return response
+
+def main():
+    # See config.py for API key setup and default LLMs
+    llm = get_llm()
+    conversation = build_conversation(llm, choose_session())
+    semantic_cache = get_semantic_cache()
+    session_id = uuid.uuid4().hex # Keeps cached answers to this conversation
 
     # Interactive chat loop
     print("Welcome to the interactive chat! Type 'exit' to end the conversation.", COLOR_INPUT)
@@ -45,8 +144,51 @@ def main():
         if user_input.lower() == "exit":
             break
 
+        # Run the conversation with user input; near-duplicate questions are answered from the semantic cache
+        answer(conversation, session_id, semantic_cache, user_input)
+
+def build_batch_handler():
+    """
+    Returns a function that runs one scripted conversation per input row ({"turns": ["...", ...]}),
+    for headless batches (see main.py). Each worker thread builds its conversation once and clears
+    its memory between rows.
+    """
+    llm = get_llm(variant="silent")
+    local = threading.local()
+
+    def handle(row):
+        conversation = getattr(local, "conversation", None)
+        if conversation is None:
+            conversation = local.conversation = build_conversation(llm)
+        conversation.memory.clear()
+        return {"replies": [conversation.predict(input=turn) for turn in row["turns"]]}
+    return handle
+
+async def amain():
+    # Same as main, but the LLM uses the async callback handler and each turn is awaited
+    llm = get_llm(variant="async_stream")
+    session_log = await asyncio.to_thread(choose_session)
+    conversation = build_conversation(llm, session_log)
+    semantic_cache = get_semantic_cache()
+    session_id = uuid.uuid4().hex # Keeps cached answers to this conversation
+
+    # Interactive chat loop
+    print("Welcome to the interactive chat! Type 'exit' to end the conversation.", COLOR_INPUT)
+    while True:
+        # Get user input without blocking the event loop
+        user_input = await ConsoleLogger.ainput("\nYou: ")
+        if user_input.lower() == "exit":
+            break
+
+        # Near-duplicate questions are answered from the semantic cache without calling the LLM
+        context = cache_context(conversation, session_id, user_input) if semantic_cache is not None else None
+        if cached_response(conversation, semantic_cache, user_input, context) is not None:
+            continue
+
         # Run the conversation with user input
-        response = conversation.predict(input=user_input) # Thinking...
+        response = await conversation.apredict(input=user_input) # Thinking...
+        if context is not None:
+            semantic_cache.update(user_input, response, context)
 
 
 if __name__ == "__main__":
@@ -1,60 +1,116 @@
 """
 This script introduces the use of the `ConversationChain` in LangChain for memory retention and contextualized conversations.
 It demonstrates how to use the `ConversationChain` to maintain context across multiple calls to the language model.
+The async entry point (amain) runs the same conversation with the async chain API,
+and build_batch_handler runs it over a file of inputs without prompting (see main.py --example).
 """
 
-from langchain import ConversationChain, PromptTemplate
+import threading
 
-from config import default_llm
+from langchain import ConversationChain
+from langchain.chains.conversation.prompt import PROMPT
+
+from config import get_llm
 from utils.console_logger import ConsoleLogger, COLOR_INPUT
+from utils.memory import IncrementalBufferMemory
+from utils.prompts import CompiledPromptTemplate
+from utils.sizing import with_policy
 
-def main():
-    # See config.py for API key setup and default LLMs
-    llm = default_llm
+DEFAULT_NAME = "Justin"
+DEFAULT_BIO = "playing guitar, making music, and adventuring with my partner & our two small dogs. I enjoy writing software and keeping up with AI developments."
+BIO_INTRO = "Provide a name and some details about yourself to generate a silly bio, followed by a sensible one."
+BIO_REQUEST_FOLLOWUP = "This is great! Can you now generate me a sensible one based on my original input? Thanks again :)"
 
-    # Initialize ConversationChain with the LLM. 
-    # The ConversationChain is used to maintain context across multiple calls to the language model.
-    conversation = ConversationChain(
-        llm=llm,
-        verbose=False # True to log LLM's context to console
-    )
+# Templates are parsed once here instead of on every call (see utils/prompts.py).
+# BIO_PROMPT builds the first message, CONVERSATION_PROMPT is ConversationChain's default prompt
+# (history + input) which is formatted on every predict. IncrementalBufferMemory renders each turn into the
+# history once, so formatting doesn't re-render the whole conversation every time.
+BIO_PROMPT = CompiledPromptTemplate(
+    input_variables=["name", "bio"],
+    template="Hi! I'm {name}. {bio}. Could you write a bio for me, making it silly and exaggerative? Thanks!"
+)
+CONVERSATION_PROMPT = CompiledPromptTemplate(
+    input_variables=PROMPT.input_variables,
+    template=PROMPT.template
+)
 
-    # Prepare prompt template
-    prompt = PromptTemplate(
-        input_variables=["name", "bio"],
-        template="Hi! I'm {name}. {bio}. Could you write a bio for me, making it silly and exaggerative? Thanks!"
-    )
+# Questions asked for the bio, with their defaults
+BIO_QUESTIONS = (
+    ("Name", DEFAULT_NAME),
+    ("Bio details (I like...)", DEFAULT_BIO),
+)
 
-    # Get name and bio from user
-    ConsoleLogger.log("Provide a name and some details about yourself to generate a silly bio, followed by a sensible one.")
-    name = ConsoleLogger.input_with_default(
-        "Name",
-        "Justin", # default value
-        show_default=False # don't show default value in prompt
-    )
-    bio = ConsoleLogger.input_with_default(
-        "Bio details (I like...)",
-        "playing guitar, making music, and adventuring with my partner & our two small dogs. I enjoy writing software and keeping up with AI developments.", # default value
-        show_default=False # don't show default value in prompt
+def build_conversation(llm):
+    # Initialize ConversationChain with the LLM.
+    # The ConversationChain is used to maintain context across multiple calls to the language model.
+    return ConversationChain(
+        llm=with_policy(llm, "bio"),
+        prompt=CONVERSATION_PROMPT,
+        memory=IncrementalBufferMemory(),
+        verbose=False # True to log LLM's context to console
     )
 
-    # Format prompt with input variables
-    formatted_prompt = prompt.format(
+def bio_request(name, bio):
+    # Format prompt with input variables & log to console
+    formatted_prompt = BIO_PROMPT.format(
         name=name,
         bio=bio
     )
-    # Log formatted prompt
     ConsoleLogger.log_input(formatted_prompt)
+    return formatted_prompt
+
+def main():
+    # See config.py for API key setup and default LLMs
+    conversation = build_conversation(get_llm())
+
+    # Get name and bio from user (default values aren't shown in the prompt)
+    ConsoleLogger.log(BIO_INTRO)
+    name, bio = [ConsoleLogger.input_with_default(question, default, show_default=False) for question, default in BIO_QUESTIONS]
 
     # First ask for a silly bio with specific details
-    output = conversation.predict(input=formatted_prompt) # Thinking...
+    output = conversation.predict(input=bio_request(name, bio)) # Thinking...
+
+    # Log the follow-up, then ask for a serious bio with the same details to demonstrate recall
+    ConsoleLogger.log_input(BIO_REQUEST_FOLLOWUP)
+    response = conversation.predict(input=BIO_REQUEST_FOLLOWUP) # Thinking...
+
+def build_batch_handler():
+    """
+    Returns a function that writes a silly then a sensible bio per input row ({"name": ..., "bio": ...}),
+    for headless batches (see main.py). Each worker thread builds its ConversationChain once and clears
+    its memory between rows, so conversations don't leak into each other.
+    """
+    llm = get_llm(variant="silent")
+    local = threading.local()
+
+    def handle(row):
+        conversation = getattr(local, "conversation", None)
+        if conversation is None:
+            conversation = local.conversation = build_conversation(llm)
+        conversation.memory.clear()
+
+        formatted_prompt = BIO_PROMPT.format(
+            name=row.get("name", DEFAULT_NAME),
+            bio=row.get("bio", DEFAULT_BIO)
+        )
+        return {
+            "silly_bio": conversation.predict(input=formatted_prompt),
+            "sensible_bio": conversation.predict(input=BIO_REQUEST_FOLLOWUP),
+        }
+    return handle
+
+async def amain():
+    # Same as main, but the LLM uses the async callback handler, input doesn't block the event loop
+    # and the conversation is awaited
+    conversation = build_conversation(get_llm(variant="async_stream"))
+
+    ConsoleLogger.log(BIO_INTRO)
+    name, bio = [await ConsoleLogger.ainput_with_default(question, default, show_default=False) for question, default in BIO_QUESTIONS]
 
-    # Create prompt & log to console
-    bio_request_followup = "This is great! Can you now generate me a sensible one based on my original input? Thanks again :)"
-    ConsoleLogger.log_input(bio_request_followup)
+    output = await conversation.apredict(input=bio_request(name, bio)) # Thinking...
 
-    # Now ask for a serious bio with the same details to demonstrate recall
-    response = conversation.predict(input=bio_request_followup) # Thinking...
+    ConsoleLogger.log_input(BIO_REQUEST_FOLLOWUP)
+    response = await conversation.apredict(input=BIO_REQUEST_FOLLOWUP) # Thinking...
 
 
 if __name__ == "__main__":
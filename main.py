@@ -1,11 +1,118 @@
-from utils.console_logger import ConsoleLogger, COLOR_INPUT, COLOR_RESET, COLOR_ERROR
-from examples.interactive_chat import main as interactive_chat
-from examples.basics import main as basics
-from examples.memory import main as memory
-from examples.agents import main as agents
-from examples.chats import main as chats
-
-def main():
+import argparse
+import asyncio
+import importlib
+import json
+import sys
+
+from config import cassette_stats, get_metrics, llm_cache_stats, BATCH_CONCURRENCY, CONSOLE_STREAM_MODE, HTTP_MAX_CONNECTIONS, METRICS_PATH
+from utils.console_logger import ConsoleLogger, COLOR_INPUT, COLOR_RESET, COLOR_ERROR, COLOR_TOOL
+from utils.profiler import profiled
+
+# Example modules by menu number. Each module is only imported once it is selected,
+# so startup doesn't pay for LangChain imports and model clients that are never used.
+EXAMPLES = {
+    0: "examples.interactive_chat",
+    1: "examples.basics",
+    2: "examples.memory",
+    3: "examples.agents",
+    4: "examples.chats",
+    5: "examples.chat_server",
+}
+
+async def run_async(module):
+    """
+    Runs an example's amain with one aiohttp connection pool shared by all of its async model calls.
+    """
+    from utils.http_pool import async_http_pool
+
+    async with async_http_pool(HTTP_MAX_CONNECTIONS):
+        await module.amain()
+
+def run_example(example_number, use_async=False, metrics_path=METRICS_PATH, profile_path=None):
+    """
+    Imports the selected example module on demand and runs its main function.
+    With use_async, the example's async entry point (amain) is run on an event loop when it has one.
+    Latency metrics recorded during the run are labelled with the example and written to metrics_path.
+    With profile_path, the import & run are profiled (see utils/profiler.py): folded stacks are written there
+    and the time per phase is logged.
+    """
+    with profiled(profile_path) as profiler:
+        module = importlib.import_module(EXAMPLES[example_number])
+        get_metrics().example = EXAMPLES[example_number].rsplit(".", 1)[-1]
+        if use_async and hasattr(module, "amain"):
+            asyncio.run(run_async(module))
+        else:
+            module.main()
+
+    if profiler:
+        ConsoleLogger.log(profiler.report(), COLOR_TOOL)
+        ConsoleLogger.log(f"Folded stacks written to {profile_path} (e.g. flamegraph.pl {profile_path} > profile.svg)", COLOR_TOOL)
+
+    # Report how many responses were served from the on-disk cache (see config.py)
+    stats = llm_cache_stats()
+    if stats:
+        ConsoleLogger.log(
+            f"LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries",
+            COLOR_TOOL
+        )
+
+    stats = cassette_stats()
+    if stats:
+        action = "recorded" if stats["mode"] == "record" else "replayed"
+        ConsoleLogger.log(f"Cassette: {stats[action]} calls {action}", COLOR_TOOL)
+
+    if metrics_path:
+        get_metrics().write(metrics_path)
+        ConsoleLogger.log(f"Latency metrics written to {metrics_path}", COLOR_TOOL)
+
+def resolve_example(example):
+    """
+    Returns the module path of an example given its menu number or name (e.g. "1" or "basics").
+    """
+    if example.isdigit() and int(example) in EXAMPLES:
+        return EXAMPLES[int(example)]
+    for module_path in EXAMPLES.values():
+        if module_path.rsplit(".", 1)[-1] == example:
+            return module_path
+    raise ValueError(f"Unknown example '{example}'. Use 0-{len(EXAMPLES) - 1} or one of: {', '.join(name.rsplit('.', 1)[-1] for name in EXAMPLES.values())}")
+
+def load_batch_handler(example):
+    """
+    Imports an example (by menu number or name) and builds its headless batch handler.
+    The handler, and the chains it uses, are built once for the whole batch.
+    """
+    module_path = resolve_example(example)
+    module = importlib.import_module(module_path)
+    if not hasattr(module, "build_batch_handler"):
+        raise ValueError(f"Example '{module_path}' doesn't support headless mode")
+    get_metrics().example = module_path.rsplit(".", 1)[-1]
+    return module.build_batch_handler()
+
+def run_headless(handle, input_path, output_path=None, workers=BATCH_CONCURRENCY, metrics_path=METRICS_PATH):
+    """
+    Runs a batch handler over a JSONL file of inputs without prompting, with `workers` rows processed at once.
+    Each result is written as a JSON line ({"index", "output"} or {"index", "error"}) as soon as it finishes,
+    to stdout unless output_path is given; lines that can't be read are error rows too. Stats go to stderr, uncolored.
+    """
+    from utils.batch_runner import BatchStats, read_jsonl, run_batch
+
+    stats = BatchStats()
+    output = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        for index, result, error in run_batch(handle, read_jsonl(input_path), concurrency=workers, stats=stats):
+            line = {"index": index, "output": result} if error is None else {"index": index, "error": repr(error)}
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"Batch finished: {stats}", file=sys.stderr)
+    if metrics_path:
+        get_metrics().write(metrics_path)
+    return stats
+
+def main(use_async=False, metrics_path=METRICS_PATH, profile_path=None):
     # Display intro message
     ConsoleLogger.log("Welcome to the LangChain Examples playground!", COLOR_INPUT)
     ConsoleLogger.log("""
@@ -14,31 +121,71 @@ Available examples:
     1. basics.py: Prompt Templates and LLM Chains used in an event planning example.
     2. memory.py: ConversationChain used for memory retention in a bio generation example.
     3. agents.py: Agents with access to web search & calculator tools.
-    4. chats.py: More advanced usage of chats, including Chat Models, Chat Prompt Templates, and Chat Chains.\n
+    4. chats.py: More advanced usage of chats, including Chat Models, Chat Prompt Templates, and Chat Chains.
+    5. chat_server.py: The interactive chat served over HTTP, streaming replies to many sessions at once.\n
     """)
     
     # Ask user for the example they want to run
     example_number = ConsoleLogger.input_int(
-        "Choose an example (0-4): "
+        "Choose an example (0-5): "
     )
 
     # Run the selected example
-    if example_number == 0:
-        interactive_chat()
-    elif example_number == 1:
-        basics()
-    elif example_number == 2:
-        memory()
-    elif example_number == 3:
-        agents()
-    elif example_number == 4:
-        chats()
+    if example_number in EXAMPLES:
+        run_example(example_number, use_async, metrics_path, profile_path)
     else:
         ConsoleLogger.log(
-            "Invalid selection. Please enter a number between 1 and 4.", 
+            "Invalid selection. Please enter a number between 0 and 5.", 
             COLOR_ERROR
         )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LangChain Examples playground")
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="Run the async version of examples that provide one (interactive_chat, basics, memory, chats)"
+    )
+    parser.add_argument(
+        "--metrics", dest="metrics_path", default=METRICS_PATH,
+        help="Write latency histograms to this file after each example (.prom for Prometheus text, otherwise JSON)"
+    )
+    parser.add_argument(
+        "--streams", dest="stream_mode", choices=("prefix", "regions"), default=CONSOLE_STREAM_MODE or None,
+        help="Show concurrent LLM streams line by line with a label (prefix), plus a live row per stream (regions)"
+    )
+    parser.add_argument(
+        "--profile", dest="profile_path", nargs="?", const="profile.folded",
+        help="Profile the example (CPU samples & allocations): write folded stacks for a flamegraph to this file "
+             "(default profile.folded) and log the time spent importing, building chains, formatting prompts, "
+             "waiting on the network and rendering output"
+    )
+    headless = parser.add_argument_group(
+        "headless batch mode",
+        "Run one example over a JSONL file of inputs without the menu, writing JSONL results as they finish"
+    )
+    headless.add_argument("--example", help="Example number or name (interactive_chat, basics, memory, chats)")
+    headless.add_argument("--input", dest="input_path", help="JSONL file of inputs, or - for stdin")
+    headless.add_argument("--output", dest="output_path", help="JSONL file for results (default: stdout)")
+    headless.add_argument("--workers", type=int, default=BATCH_CONCURRENCY, help="Rows processed concurrently")
+    args = parser.parse_args()
+
+    if args.example is not None:
+        if not args.input_path:
+            parser.error("--example requires --input")
+        with profiled(args.profile_path) as profiler:
+            try:
+                handle = load_batch_handler(args.example)
+            except ValueError as error:
+                parser.error(str(error))
+            stats = run_headless(handle, args.input_path, args.output_path, args.workers, args.metrics_path)
+        if profiler:
+            print(profiler.report(), file=sys.stderr)
+            print(f"Folded stacks written to {args.profile_path}", file=sys.stderr)
+        # Non-zero when any row failed, so scripts & CI notice partial batches
+        sys.exit(1 if stats.failed else 0)
+
+    if args.stream_mode:
+        ConsoleLogger.multiplex(args.stream_mode)
+
     while True:
-        main()
+        main(args.use_async, args.metrics_path, args.profile_path)
@@ -0,0 +1,45 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from utils.console_logger import COLOR_REPSONSE, StreamBuffer
+
+
+class StreamBufferTest(unittest.TestCase):
+    def test_tokens_are_coalesced(self):
+        buffer = StreamBuffer(max_chars=10, max_delay=60)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            buffer.flush() # Starts the delay now
+            for token in ("one ", "two ", "three"):
+                buffer.write(token, COLOR_REPSONSE)
+            self.assertEqual(output.getvalue(), "one two three") # Written at once, without color codes off a TTY
+            buffer.write(" four", COLOR_REPSONSE)
+            self.assertEqual(output.getvalue(), "one two three")
+            buffer.end()
+        self.assertEqual(output.getvalue(), "one two three four")
+
+    def test_token_written_during_a_flush_is_not_lost(self):
+        buffer = StreamBuffer(max_chars=1000, max_delay=60)
+        late_writer = threading.Thread(target=buffer.write, args=(" late", COLOR_REPSONSE))
+
+        class SlowOutput(io.StringIO):
+            def write(self, text):
+                # Another thread streams a token while this flush is writing
+                if late_writer.ident is None:
+                    late_writer.start()
+                    late_writer.join(0.2)
+                return super().write(text)
+
+        output = SlowOutput()
+        with contextlib.redirect_stdout(output):
+            buffer.write("early", COLOR_REPSONSE)
+            buffer.flush()
+            late_writer.join()
+            buffer.end()
+        self.assertEqual(output.getvalue(), "early late")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from benchmarks.fake_models import FakeStreamingLLM
+from utils.memory import TokenBudgetMemory
+
+
+class GatedSummarizer(FakeStreamingLLM):
+    """
+    Returns "summary N" for the Nth summary, once `release` is set, or raises `error` when it's given.
+    """
+
+    release: threading.Event
+    error: Exception = None
+    summaries: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.summaries += 1
+        return f"summary {self.summaries}"
+
+
+def turn(number):
+    # 6 tokens per message as the fake model counts them ("Human: question 0 one two three")
+    return {"input": f"question {number} one two three"}, {"response": f"answer {number} one two three"}
+
+
+def texts(*numbers):
+    return [text for number in numbers for text in (turn(number)[0]["input"], turn(number)[1]["response"])]
+
+
+class TokenBudgetMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.summarizer = GatedSummarizer(release=self.release, streaming=False)
+        self.memory = TokenBudgetMemory(llm=self.summarizer, max_token_limit=36, return_messages=True)
+        self.addCleanup(self.release.set)
+
+    def history(self):
+        return [message.content for message in self.memory.load_memory_variables({})["history"]]
+
+    def save_turns(self, count):
+        for number in range(count):
+            self.memory.save_context(*turn(number))
+
+    def test_evicted_turns_stay_in_the_history_until_their_summary_is_applied(self):
+        self.save_turns(4) # 48 tokens, so the oldest turn is evicted
+        self.assertEqual(self.history(), texts(0, 1, 2, 3)) # Summary still in progress
+        self.assertEqual(self.memory.token_count, 48)
+
+        self.release.set()
+        self.memory.wait_for_summary()
+        self.assertEqual(self.history(), ["summary 1"] + texts(1, 2, 3))
+        self.assertEqual(self.memory.token_count, 3 + 36) # "System: summary 1"
+
+    def test_turns_evicted_during_a_summary_wait_for_the_next_one(self):
+        self.save_turns(4)
+        self.memory.save_context(*turn(4)) # Evicted while the first summary is still being made
+        self.release.set()
+        self.memory.wait_for_summary()
+
+        history = self.history()
+        self.assertRegex(history[0], r"^summary \d$") # The first summary may already cover both evicted turns
+        self.assertEqual(history[1:], texts(2, 3, 4))
+
+    def test_failed_summary_keeps_the_turns(self):
+        self.summarizer.error = RuntimeError("rate limited")
+        self.save_turns(4)
+        self.release.set()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.memory.wait_for_summary()
+
+        self.assertEqual(self.history(), texts(0, 1, 2, 3))
+        self.assertEqual(self.memory.token_count, 48)
+
+    def test_clear_forgets_evicted_turns(self):
+        self.save_turns(4)
+        self.release.set()
+        self.memory.clear()
+        self.assertEqual(self.history(), [])
+        self.assertEqual(self.memory.token_count, 0)
+
+    def test_close_lets_the_summary_thread_exit(self):
+        self.save_turns(4)
+        summary_thread = next(thread for thread in threading.enumerate() if thread.name.startswith("memory-summary"))
+        self.memory.close()
+        self.release.set()
+        summary_thread.join(5)
+        self.assertFalse(summary_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
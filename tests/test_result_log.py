@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+
+from utils.batch_runner import ResultLog
+
+
+class ResultLogTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "results.jsonl")
+
+    def open_log(self):
+        log = ResultLog(self.path)
+        self.addCleanup(log.close)
+        return log
+
+    def read_lines(self):
+        with open(self.path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def test_new_log_has_nothing_done(self):
+        log = self.open_log()
+        self.assertEqual(len(log), 0)
+        self.assertFalse(log.is_done(0))
+
+    def test_rows_done_out_of_order(self):
+        log = self.open_log()
+        for index in (1, 3, 0):
+            log.write({"index": index})
+
+        self.assertEqual(len(log), 3)
+        self.assertEqual(log.watermark, 2)
+        self.assertEqual([log.is_done(index) for index in range(5)], [True, True, False, True, False])
+
+    def test_resumed_log_skips_the_rows_already_done(self):
+        log = self.open_log()
+        for index in (0, 1, 4):
+            log.write({"index": index, "plan": f"plan {index}"})
+        log.close()
+
+        resumed = self.open_log()
+        self.assertEqual(len(resumed), 3)
+        self.assertEqual([resumed.is_done(index) for index in range(5)], [True, True, False, False, True])
+        resumed.write({"index": 2})
+        self.assertEqual([line["index"] for line in self.read_lines()], [0, 1, 4, 2]) # Appended, not overwritten
+
+    def test_failed_rows_are_not_done_until_a_retry_succeeds(self):
+        log = self.open_log()
+        log.write({"index": 0})
+        log.write({"index": 1, "error": "RateLimitError: slow down"})
+        self.assertFalse(log.is_done(1))
+        log.close()
+
+        resumed = self.open_log()
+        self.assertEqual(len(resumed), 1)
+        self.assertFalse(resumed.is_done(1))
+        resumed.write({"index": 1, "plan": "retried"})
+        self.assertTrue(resumed.is_done(1))
+
+    def test_torn_last_line_is_dropped(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write('{"index": 0}\n\n{"index": 1}\n{"index": 2, "pl')
+
+        log = self.open_log()
+        self.assertEqual(len(log), 2)
+        self.assertFalse(log.is_done(2))
+        log.write({"index": 2})
+        self.assertEqual(self.read_lines()[-2:], [{"index": 1}, {"index": 2}]) # Carries on from a clean line
+
+
+if __name__ == "__main__":
+    unittest.main()
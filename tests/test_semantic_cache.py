@@ -0,0 +1,55 @@
+import contextlib
+import io
+import unittest
+
+from benchmarks.fake_models import FakeStreamingLLM
+from examples.interactive_chat import answer, build_conversation
+from utils.semantic_cache import SemanticCache
+
+
+class CountingLLM(FakeStreamingLLM):
+    calls: int = 0
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        return super()._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+
+class InteractiveChatCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.llm = CountingLLM(latency=0, tokens_per_second=0, streaming=False)
+        self.cache = SemanticCache(threshold=0.9, capacity=10)
+        quiet = contextlib.redirect_stdout(io.StringIO()) # Cache hits are printed like streamed responses
+        quiet.__enter__()
+        self.addCleanup(quiet.__exit__, None, None, None)
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        conversation = build_conversation(self.llm)
+        question = "What is the tallest mountain in the world?"
+        first = answer(conversation, "session", self.cache, question)
+        answer(conversation, "session", self.cache, "And which ocean is the deepest one?")
+        again = answer(conversation, "session", self.cache, question)
+        third = answer(conversation, "session", self.cache, "what is the tallest mountain in the world")
+
+        self.assertEqual(again, first)
+        self.assertEqual(third, first)
+        self.assertEqual(self.llm.calls, 2)
+        self.assertEqual(self.cache.stats(), {"hits": 2, "misses": 2, "entries": 2})
+        self.assertEqual(len(conversation.memory.chat_memory.messages), 8) # Cached answers are still saved as turns
+
+    def test_other_sessions_dont_share_answers(self):
+        question = "What is the tallest mountain in the world?"
+        answer(build_conversation(self.llm), "first", self.cache, question)
+        answer(build_conversation(self.llm), "second", self.cache, question)
+        self.assertEqual(self.llm.calls, 2)
+
+    def test_short_questions_skip_the_cache(self):
+        conversation = build_conversation(self.llm)
+        answer(conversation, "session", self.cache, "Why?")
+        answer(conversation, "session", self.cache, "Why?")
+        self.assertEqual(self.llm.calls, 2)
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+
+from utils.single_flight import SingleFlight
+
+
+class Stop(Exception):
+    pass
+
+
+class TokenRecorder(BaseCallbackHandler):
+    """
+    Records streamed tokens, raising Stop after `stop_after` of them (like a stream guard firing).
+    """
+
+    raise_error = True
+
+    def __init__(self, stop_after=None):
+        self.tokens = []
+        self.stop_after = stop_after
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+        if self.stop_after and len(self.tokens) >= self.stop_after:
+            raise Stop()
+
+
+class AsyncTokenRecorder(AsyncCallbackHandler):
+    raise_error = True
+
+    def __init__(self, stop_after=None):
+        self.tokens = []
+        self.stop_after = stop_after
+
+    async def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+        if self.stop_after and len(self.tokens) >= self.stop_after:
+            raise Stop()
+
+
+def run_manager(handler):
+    return CallbackManagerForLLMRun(run_id=None, handlers=[handler], inheritable_handlers=[], tags=[], inheritable_tags=[])
+
+
+def async_run_manager(handler):
+    return AsyncCallbackManagerForLLMRun(run_id=None, handlers=[handler], inheritable_handlers=[], tags=[], inheritable_tags=[])
+
+
+TOKENS = [f"t{number}" for number in range(10)]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.001)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.upstream_calls = 0
+        self.sent = 0
+        # The leader streams its first tokens, then waits until the follower has joined
+        self.joined = threading.Event()
+
+    def request(self, callbacks):
+        self.upstream_calls += 1
+        for number, token in enumerate(TOKENS):
+            if number == 3:
+                self.joined.wait(5)
+            for callback in callbacks:
+                callback.on_llm_new_token(token)
+            self.sent += 1
+        return "".join(TOKENS)
+
+    def run_pair(self, leader_handler, follower_handler):
+        results = {}
+
+        def call(name, handler):
+            try:
+                results[name] = self.flights.run("key", run_manager(handler), self.request)
+            except Exception as error:
+                results[name] = error
+
+        leader = threading.Thread(target=call, args=("leader", leader_handler))
+        leader.start()
+        wait_until(lambda: self.flights._flights) # The leader has started its flight
+        follower = threading.Thread(target=call, args=("follower", follower_handler))
+        follower.start()
+        wait_until(lambda: self.flights.stats()["shared"])
+        self.joined.set()
+        leader.join(5)
+        follower.join(5)
+        return results
+
+    def test_concurrent_callers_share_one_call_and_the_whole_stream(self):
+        leader, follower = TokenRecorder(), TokenRecorder()
+        results = self.run_pair(leader, follower)
+
+        self.assertEqual(results, {"leader": "".join(TOKENS), "follower": "".join(TOKENS)})
+        self.assertEqual(self.upstream_calls, 1)
+        self.assertEqual(leader.tokens, TOKENS)
+        self.assertEqual(follower.tokens, TOKENS) # Replayed from the start, then live
+        self.assertEqual(self.flights.stats(), {"calls": 2, "shared": 1})
+
+    def test_followers_error_only_stops_the_follower(self):
+        leader, follower = TokenRecorder(), TokenRecorder(stop_after=2)
+        results = self.run_pair(leader, follower)
+
+        self.assertEqual(results["leader"], "".join(TOKENS))
+        self.assertIsInstance(results["follower"], Stop)
+        self.assertEqual(leader.tokens, TOKENS)
+
+    def test_leaders_error_only_stops_the_leader(self):
+        leader, follower = TokenRecorder(stop_after=5), TokenRecorder() # Stops after the follower has joined
+        results = self.run_pair(leader, follower)
+
+        self.assertIsInstance(results["leader"], Stop)
+        self.assertEqual(results["follower"], "".join(TOKENS))
+        self.assertEqual(follower.tokens, TOKENS)
+
+    def test_upstream_stops_once_every_caller_has_stopped(self):
+        self.joined.set()
+        with self.assertRaises(Stop):
+            self.flights.run("key", run_manager(TokenRecorder(stop_after=2)), self.request)
+        self.assertEqual(self.sent, 1) # The second token stopped the call before it was counted as sent
+
+    def test_finished_flights_are_forgotten(self):
+        self.joined.set()
+        self.flights.run("key", None, self.request)
+        self.flights.run("key", None, self.request)
+        self.assertEqual(self.upstream_calls, 2)
+
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    def run_callers(self, *handlers):
+        flights = SingleFlight()
+        upstream = {"calls": 0, "cancelled": False}
+
+        async def request(callbacks):
+            upstream["calls"] += 1
+            try:
+                for token in TOKENS:
+                    await asyncio.sleep(0)
+                    for callback in callbacks:
+                        await callback.on_llm_new_token(token)
+                return "".join(TOKENS)
+            except asyncio.CancelledError:
+                upstream["cancelled"] = True
+                raise
+
+        async def call(handler):
+            try:
+                return await flights.arun("key", async_run_manager(handler), request)
+            except Stop as error:
+                return error
+
+        async def main():
+            return await asyncio.gather(*(call(handler) for handler in handlers))
+
+        return asyncio.run(main()), upstream
+
+    def test_callers_share_one_call_and_the_whole_stream(self):
+        first, second = AsyncTokenRecorder(), AsyncTokenRecorder()
+        results, upstream = self.run_callers(first, second)
+
+        self.assertEqual(results, ["".join(TOKENS)] * 2)
+        self.assertEqual(upstream["calls"], 1)
+        self.assertEqual(first.tokens, TOKENS)
+        self.assertEqual(second.tokens, TOKENS)
+
+    def test_one_callers_error_doesnt_stop_the_others(self):
+        stopping, listening = AsyncTokenRecorder(stop_after=3), AsyncTokenRecorder()
+        results, upstream = self.run_callers(stopping, listening)
+
+        self.assertIsInstance(results[0], Stop)
+        self.assertEqual(results[1], "".join(TOKENS))
+        self.assertEqual(listening.tokens, TOKENS)
+        self.assertFalse(upstream["cancelled"])
+
+    def test_upstream_is_cancelled_once_every_caller_has_stopped(self):
+        results, upstream = self.run_callers(AsyncTokenRecorder(stop_after=2), AsyncTokenRecorder(stop_after=4))
+
+        self.assertTrue(all(isinstance(result, Stop) for result in results))
+        self.assertTrue(upstream["cancelled"])
+
+    def test_newer_flight_is_kept_when_the_finished_one_is_forgotten(self):
+        flights = SingleFlight()
+        calls = []
+        first_done = asyncio.Event()
+
+        async def request(callbacks):
+            calls.append(len(calls))
+            if len(calls) == 1:
+                first_done.set() # Wakes the second caller before this flight's done callbacks run
+                return "first"
+            await asyncio.sleep(0.05)
+            return "second"
+
+        async def second():
+            await first_done.wait()
+            # Starts a new flight in the same loop iteration, while the first one's task is done but not yet forgotten
+            return await flights.arun("key", None, request)
+
+        async def third():
+            await asyncio.sleep(0.01)
+            return await flights.arun("key", None, request)
+
+        async def main():
+            return await asyncio.gather(flights.arun("key", None, request), second(), third())
+
+        self.assertEqual(asyncio.run(main()), ["first", "second", "second"])
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
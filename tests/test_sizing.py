@@ -0,0 +1,146 @@
+import math
+import unittest
+from unittest import mock
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AIMessage, HumanMessage, SystemMessage, get_buffer_string
+
+from benchmarks.fake_models import FakeStreamingLLM
+from utils import sizing
+from utils.sizing import HEURISTIC_CHARS_PER_TOKEN, TOKENS_PER_MESSAGE, RequestSizer, SizedLLM, TokenEstimator, with_policy
+
+
+class WordEstimator:
+    """
+    One token per word, so the tests don't depend on tiktoken being installed.
+    """
+
+    def count(self, text):
+        return len(text.split())
+
+    def count_messages(self, messages):
+        return sum(self.count(get_buffer_string([message])) + TOKENS_PER_MESSAGE for message in messages) + 3
+
+
+def make_sizer(context_limit=100, policies=None, min_tokens=16):
+    return RequestSizer("gpt-3.5-turbo", context_limit, policies or {"default": 20, "agent": 40}, min_tokens, WordEstimator())
+
+
+class OfflineTiktoken:
+    """
+    Stands in for tiktoken when its encodings can't be downloaded.
+    """
+
+    def __init__(self):
+        self.loads = 0
+
+    def encoding_for_model(self, model_name):
+        self.loads += 1
+        raise ConnectionError("offline")
+
+
+class TokenEstimatorTest(unittest.TestCase):
+    def test_encoding_is_loaded_on_first_count_and_falls_back_to_the_length_estimate(self):
+        offline = OfflineTiktoken()
+        with mock.patch.object(sizing, "tiktoken", offline), mock.patch.dict(TokenEstimator._encodings, clear=True):
+            estimator = TokenEstimator("gpt-3.5-turbo")
+            self.assertEqual(offline.loads, 0)
+            with self.assertWarns(UserWarning):
+                self.assertEqual(estimator.count("x" * 36), math.ceil(36 / HEURISTIC_CHARS_PER_TOKEN))
+            estimator.count("again")
+            TokenEstimator("gpt-3.5-turbo").count("another estimator")
+            self.assertEqual(offline.loads, 1) # The failure is remembered, not retried on every count
+
+
+class PolicyTokensTest(unittest.TestCase):
+    def test_named_policy(self):
+        self.assertEqual(make_sizer().policy_tokens("agent"), 40)
+
+    def test_unknown_policy_falls_back_to_default(self):
+        self.assertEqual(make_sizer().policy_tokens("missing"), 20)
+
+    def test_last_tag_naming_a_policy_wins(self):
+        self.assertEqual(make_sizer().policy_tokens("default", ["agent", "other", "default"]), 20)
+        self.assertEqual(make_sizer().policy_tokens("default", ["default", "agent", "other"]), 40)
+
+
+class MaxTokensTest(unittest.TestCase):
+    def test_policy_tokens_when_the_prompt_leaves_room(self):
+        self.assertEqual(make_sizer().max_tokens(prompt_tokens=50, wanted=20), 20)
+
+    def test_lowered_to_the_room_left_in_the_context(self):
+        self.assertEqual(make_sizer().max_tokens(prompt_tokens=70, wanted=40), 30)
+
+    def test_never_below_min_tokens(self):
+        self.assertEqual(make_sizer(min_tokens=16).max_tokens(prompt_tokens=99, wanted=20), 16)
+
+
+class FitTextTest(unittest.TestCase):
+    def test_prompt_that_fits_is_unchanged(self):
+        text = "Instructions here.\n\nHuman: hi\nAI: hello"
+        self.assertIs(make_sizer().fit_text(text, 20), text)
+
+    def test_oldest_lines_after_the_instructions_are_dropped(self):
+        lines = [f"line {number} " + "word " * 8 for number in range(10)] # 10 words each
+        text = "Keep these instructions.\n\n" + "\n".join(lines)
+        fitted = make_sizer(context_limit=60).fit_text(text, 20) # 40 tokens of room
+
+        head, _, body = fitted.partition("\n\n")
+        self.assertEqual(head, "Keep these instructions.")
+        self.assertEqual(body.split("\n"), lines[-3:])
+
+    def test_last_line_is_always_kept(self):
+        text = "Instructions.\n\nold line\n" + "word " * 200
+        fitted = make_sizer().fit_text(text, 20)
+        self.assertEqual(fitted, "Instructions.\n\n" + "word " * 200)
+
+    def test_text_without_instructions_drops_from_the_start(self):
+        text = "\n".join(f"line {number} " + "word " * 8 for number in range(10))
+        fitted = make_sizer(context_limit=45).fit_text(text, 20) # 25 tokens of room, 11 per line
+        self.assertEqual(fitted, "\n".join(text.split("\n")[-2:]))
+
+
+class FitMessagesTest(unittest.TestCase):
+    def test_messages_that_fit_are_unchanged(self):
+        messages = [SystemMessage(content="Be brief."), HumanMessage(content="hi")]
+        self.assertIs(make_sizer().fit_messages(messages, 20), messages)
+
+    def test_oldest_messages_after_the_system_messages_are_dropped(self):
+        system = [SystemMessage(content="You are helpful."), SystemMessage(content="Be brief.")]
+        turns = [
+            message
+            for number in range(6)
+            for message in (HumanMessage(content=f"question {number} " + "word " * 6), AIMessage(content=f"answer {number} " + "word " * 6))
+        ]
+        fitted = make_sizer(context_limit=80).fit_messages(system + turns, 20)
+
+        self.assertEqual(fitted[:2], system)
+        self.assertEqual(fitted[2:], turns[-len(fitted) + 2:])
+        self.assertLess(len(fitted), len(system) + len(turns))
+        self.assertLessEqual(WordEstimator().count_messages(fitted), 80 - 20)
+
+    def test_last_message_is_always_kept(self):
+        messages = [SystemMessage(content="Be brief."), HumanMessage(content="old"), HumanMessage(content="word " * 200)]
+        fitted = make_sizer().fit_messages(messages, 20)
+        self.assertEqual(fitted, [messages[0], messages[-1]])
+
+
+class WithPolicyTest(unittest.TestCase):
+    def test_copy_has_the_policy_and_shares_the_rest(self):
+        callbacks = [BaseCallbackHandler()]
+        model = SizedLLM(llm=FakeStreamingLLM(), sizer=make_sizer(), callbacks=callbacks)
+        agent = with_policy(model, "agent")
+
+        self.assertEqual(agent.policy, "agent")
+        self.assertEqual(model.policy, "default") # The shared model is left as it was
+        self.assertIs(agent.llm, model.llm)
+        self.assertIs(agent.callbacks, model.callbacks)
+        self.assertEqual(model.callbacks, callbacks)
+
+    def test_unsized_models_are_returned_as_is(self):
+        model = FakeStreamingLLM()
+        self.assertIs(with_policy(model, "agent"), model)
+
+
+if __name__ == "__main__":
+    unittest.main()
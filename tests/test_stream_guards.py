@@ -0,0 +1,130 @@
+import unittest
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from benchmarks.fake_models import FakeStreamingLLM
+from utils.stream_guards import (
+    GuardedLLM,
+    JsonObjectGuard,
+    MaxCharsGuard,
+    RegexGuard,
+    StopSequenceGuard,
+    StreamGuardTriggered,
+    _GuardedStream,
+    with_guards,
+)
+
+
+def stream(guard, tokens):
+    """
+    Feeds the tokens through the guard, returning the text kept when it fires and how many tokens that took,
+    or None if it never fires.
+    """
+    guarded = _GuardedStream([guard])
+    for number, token in enumerate(tokens, 1):
+        try:
+            guarded.feed(token)
+        except StreamGuardTriggered as triggered:
+            return triggered.text, number
+    return None
+
+
+class StopSequenceGuardTest(unittest.TestCase):
+    def test_stop_sequence_is_left_out(self):
+        self.assertEqual(stream(StopSequenceGuard(["\nHuman:"]), ["Hi", " there", "\nHuman:", " more"]), ("Hi there", 3))
+
+    def test_sequence_split_across_tokens(self):
+        self.assertEqual(stream(StopSequenceGuard(["STOP"]), ["hello ", "ST", "OP more"]), ("hello ", 3))
+
+    def test_earliest_of_several_sequences(self):
+        self.assertEqual(stream(StopSequenceGuard(["b", "a"]), ["xxab"]), ("xx", 1))
+
+    def test_no_sequence_never_fires(self):
+        self.assertIsNone(stream(StopSequenceGuard(["STOP"]), ["stop", " it"]))
+
+
+class MaxCharsGuardTest(unittest.TestCase):
+    def test_short_response_never_fires(self):
+        self.assertIsNone(stream(MaxCharsGuard(20), ["exactly twenty chars"]))
+
+    def test_cut_after_the_last_sentence_that_fits(self):
+        tokens = ["First sentence here.", " And more", " words follow"]
+        self.assertEqual(stream(MaxCharsGuard(30), tokens), ("First sentence here.", 3))
+
+    def test_cut_at_max_chars_when_the_sentence_would_keep_too_little(self):
+        tokens = ["One two. Three", " four five six"]
+        self.assertEqual(stream(MaxCharsGuard(20), tokens), ("One two. Three four ", 2))
+
+
+class RegexGuardTest(unittest.TestCase):
+    def test_kept_up_to_the_end_of_the_match(self):
+        self.assertEqual(stream(RegexGuard(r"Answer: \w+\."), ["Thinking... Ans", "wer: 42.", " done"]), ("Thinking... Answer: 42.", 2))
+
+    def test_matches_before_the_window_are_not_searched(self):
+        self.assertIsNone(stream(RegexGuard(r"\d\d", window=2), ["1", "x" * 5, "2"]))
+
+
+class JsonObjectGuardTest(unittest.TestCase):
+    def test_text_before_the_object_is_kept(self):
+        tokens = ["Here you go: {", '"a": 1', "} and", " more"]
+        self.assertEqual(stream(JsonObjectGuard(), tokens), ('Here you go: {"a": 1}', 3))
+
+    def test_braces_inside_strings_and_escapes(self):
+        tokens = ['{"a": "}', '", "b": {"c": "\\"}', '"}}', " trailing"]
+        self.assertEqual(stream(JsonObjectGuard(), tokens), ('{"a": "}", "b": {"c": "\\"}"}}', 3))
+
+    def test_unfinished_object_never_fires(self):
+        self.assertIsNone(stream(JsonObjectGuard(), ['{"a": {"b": 1}', ', "c": "}"']))
+
+    def test_each_response_starts_fresh(self):
+        guard = JsonObjectGuard()
+        self.assertIsNone(stream(guard, ['{"a": 1']))
+        self.assertEqual(stream(guard, ['{"b": 2}']), ('{"b": 2}', 1))
+
+
+class GuardedStreamTest(unittest.TestCase):
+    def test_finish_applies_the_guards_to_a_response_that_was_not_streamed(self):
+        self.assertEqual(_GuardedStream([StopSequenceGuard(["STOP"])]).finish("keep STOP drop"), "keep ")
+
+    def test_finish_leaves_a_streamed_response_alone(self):
+        guarded = _GuardedStream([StopSequenceGuard(["STOP"])])
+        guarded.feed("keep")
+        self.assertEqual(guarded.finish("keep STOP drop"), "keep STOP drop")
+
+
+class TokenRecorder(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+
+
+class GuardedLLMTest(unittest.TestCase):
+    def make_llm(self, **kwargs):
+        return FakeStreamingLLM(latency=0, tokens_per_second=0, response_tokens=10, **kwargs)
+
+    def test_streamed_response_is_cut_and_only_printed_up_to_the_cut(self):
+        full = self.make_llm()("prompt")
+        words = full.split(" ")
+        stop = " " + words[4]
+        recorder = TokenRecorder()
+        guarded = with_guards(self.make_llm(callbacks=[recorder]), StopSequenceGuard([stop]))
+
+        self.assertIsInstance(guarded, GuardedLLM)
+        expected = full[:full.index(stop)]
+        self.assertEqual(guarded("prompt"), expected)
+        self.assertEqual("".join(recorder.tokens), expected)
+
+    def test_response_that_was_not_streamed_is_cut_once_it_arrives(self):
+        full = self.make_llm()("prompt")
+        guarded = with_guards(self.make_llm(streaming=False), MaxCharsGuard(len(full) // 2))
+        self.assertEqual(guarded("prompt"), full[:len(full) // 2])
+
+    def test_without_guards_the_model_is_returned_as_is(self):
+        model = self.make_llm()
+        self.assertIs(with_guards(model), model)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any, List
+
+from langchain.llms.base import BaseLLM
+from langchain.schema import Generation, LLMResult
+
+from tests.test_sizing import WordEstimator
+from utils.cassette import Cassette, CassetteLLM
+from utils.llm_cache import CachedLLM, PersistentLLMCache
+from utils.single_flight import SingleFlightLLM
+from utils.sizing import RequestSizer, SizedLLM
+from utils.wrapped_llm import merge_llm_outputs
+
+
+class BatchRecordingLLM(BaseLLM):
+    """
+    Answers every prompt of a request at once, recording the prompts & options of each request,
+    and reports one completion token per prompt like OpenAI's token usage.
+    """
+
+    requests: List[Any] = []
+    max_tokens: int = 100
+
+    @property
+    def _llm_type(self) -> str:
+        return "batch-recording"
+
+    def _result(self, prompts, kwargs):
+        self.requests.append((list(prompts), kwargs.get("max_tokens")))
+        return LLMResult(
+            generations=[[Generation(text=f"answer to {prompt}")] for prompt in prompts],
+            llm_output={"token_usage": {"prompt_tokens": 10 * len(prompts), "completion_tokens": len(prompts)}, "model_name": "fake"},
+        )
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        return self._result(prompts, kwargs)
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        return self._result(prompts, kwargs)
+
+
+class WrappedBatchTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.model = BatchRecordingLLM()
+        self.cache = PersistentLLMCache(os.path.join(self.directory, "cache.sqlite"))
+
+    def build(self, cassette_mode="record"):
+        # Wrapped the way config.py wraps the registered LLMs
+        cassette = Cassette(os.path.join(self.directory, "cassette.jsonl.gz"), mode=cassette_mode)
+        self.addCleanup(cassette.close)
+        model = CassetteLLM(llm=self.model, cassette=cassette)
+        model = SingleFlightLLM(llm=model)
+        model = CachedLLM(llm=model, response_cache=self.cache)
+        sizer = RequestSizer("gpt-3.5-turbo", 100, {"default": 20}, estimator=WordEstimator())
+        return SizedLLM(llm=model, sizer=sizer), cassette
+
+    def test_prompts_are_sent_in_one_request_with_token_usage(self):
+        llm, _ = self.build()
+        result = llm.generate(["one", "two", "three"])
+
+        self.assertEqual(self.model.requests, [(["one", "two", "three"], 20)])
+        self.assertEqual([generation[0].text for generation in result.generations], ["answer to one", "answer to two", "answer to three"])
+        self.assertEqual(result.llm_output["token_usage"], {"prompt_tokens": 30, "completion_tokens": 3})
+
+    def test_only_prompts_not_cached_are_sent(self):
+        llm, _ = self.build()
+        llm.generate(["one", "two"])
+        result = llm.generate(["zero", "one", "two", "three"])
+
+        self.assertEqual(self.model.requests[1], (["zero", "three"], 20))
+        self.assertEqual([generation[0].text for generation in result.generations], [f"answer to {prompt}" for prompt in ("zero", "one", "two", "three")])
+        self.assertEqual(result.llm_output["token_usage"], {"prompt_tokens": 20, "completion_tokens": 2})
+
+    def test_prompts_needing_different_max_tokens_are_sent_separately(self):
+        llm, _ = self.build()
+        long_prompt = "word " * 90 # Leaves room for 10 of the policy's 20 tokens, so min_tokens (16) is asked for
+        result = asyncio.run(llm.agenerate(["short", long_prompt, "also short"]))
+
+        self.assertEqual(sorted(self.model.requests, key=lambda request: request[1]), [([long_prompt], 16), (["short", "also short"], 20)])
+        self.assertEqual(result.generations[1][0].text, f"answer to {long_prompt}")
+        self.assertEqual(result.llm_output["token_usage"], {"prompt_tokens": 30, "completion_tokens": 3})
+
+    def test_recorded_batch_replays_prompt_by_prompt(self):
+        llm, cassette = self.build()
+        llm.generate(["one", "two"])
+        cassette.close()
+        self.cache.clear()
+
+        replaying, _ = self.build(cassette_mode="replay")
+        result = replaying.generate(["two", "one"])
+        self.assertEqual([generation[0].text for generation in result.generations], ["answer to two", "answer to one"])
+        self.assertEqual(len(self.model.requests), 1)
+
+
+class MergeLLMOutputsTest(unittest.TestCase):
+    def test_token_usage_is_added_up(self):
+        merged = merge_llm_outputs([
+            {"token_usage": {"total_tokens": 5}, "model_name": "a"},
+            None,
+            {"token_usage": {"total_tokens": 7, "prompt_tokens": 3}, "model_name": "a"},
+        ])
+        self.assertEqual(merged, {"token_usage": {"total_tokens": 12, "prompt_tokens": 3}, "model_name": "a"})
+
+    def test_nothing_to_merge(self):
+        self.assertIsNone(merge_llm_outputs([None, {}]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, List
+
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# One finished item: its position in the input, and either its result or the exception it raised
+BatchResult = namedtuple("BatchResult", ["index", "result", "error"])
+
+
+class InvalidInput(ValueError):
+    """
+    Yielded in place of an input that couldn't be read (e.g. a line that isn't valid JSON),
+    so run_batch reports it as a failed item and carries on with the rest.
+    """
+
+MESSAGE_TYPES = {
+    "system": SystemMessage,
+    "human": HumanMessage,
+    "user": HumanMessage,
+    "ai": AIMessage,
+    "assistant": AIMessage,
+}
+
+
+class BatchStats:
+    """
+    Counts finished items and measures throughput while a batch runs.
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """
+        Finished items per second.
+        """
+        elapsed = self.elapsed
+        return (self.completed + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.completed} completed, {self.failed} failed in {self.elapsed:.2f}s "
+            f"({self.throughput:.2f} items/s)"
+        )
+
+
+def run_batch(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    concurrency: int = 8,
+    stats: BatchStats = None,
+) -> Iterator[BatchResult]:
+    """
+    Calls func on every item with at most `concurrency` calls in flight, yielding results in completion order.
+    Items are pulled from the iterable only as slots free up, so very large inputs are never fully loaded.
+    A failing item is yielded with its exception instead of stopping the batch. So are items that are
+    InvalidInput errors, and errors raised by the iterable itself (a generator that raises ends there).
+    """
+    stats = stats if stats is not None else BatchStats()
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    in_flight = {}
+    rejected = [] # (index, error) of items that couldn't be read, reported without calling func
+    pulled = 0
+
+    def submit_next():
+        nonlocal pulled
+        index = pulled
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        except Exception as error:
+            item = error if isinstance(error, InvalidInput) else InvalidInput(f"Couldn't read input: {error!r}")
+        pulled += 1
+        if isinstance(item, InvalidInput):
+            rejected.append((index, item))
+        else:
+            in_flight[executor.submit(func, item)] = index
+
+    try:
+        for _ in range(concurrency):
+            submit_next()
+
+        while in_flight or rejected:
+            while rejected:
+                index, error = rejected.pop(0)
+                stats.failed += 1
+                yield BatchResult(index, None, error)
+                submit_next()
+            if not in_flight:
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                submit_next()
+                try:
+                    result = BatchResult(index, future.result(), None)
+                    stats.completed += 1
+                except Exception as error:
+                    result = BatchResult(index, None, error)
+                    stats.failed += 1
+                yield result
+    finally:
+        stats.finished_at = time.perf_counter()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def messages_from_json(messages: List[dict]) -> List[BaseMessage]:
+    """
+    Converts [{"role": "system", "content": "..."}, ...] into LangChain messages.
+    """
+    return [MESSAGE_TYPES[message["role"]](content=message["content"]) for message in messages]
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    """
+    Yields each non-empty line of a JSONL file (or stdin for "-") as a dict, one line at a time.
+    Lines that aren't valid JSON are yielded as InvalidInput errors, which run_batch reports as failed items.
+    """
+    if path == "-":
+        yield from _parse_jsonl(sys.stdin)
+        return
+    with open(path, encoding="utf-8") as file:
+        yield from _parse_jsonl(file)
+
+
+def _parse_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                yield InvalidInput(f"Line {number}: {error}")
+
+
+def read_csv(path: str) -> Iterator[dict]:
+    """
+    Yields each row of a CSV file with a header line as a dict, one row at a time.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        yield from csv.DictReader(file)
+
+
+class ResultLog:
+    """
+    Appends batch results to a JSONL file as they finish, each with the "index" of its input row,
+    so a run that stopped part way can be resumed by skipping the rows already done.
+    Results with an "error" are written but don't count as done, so a resumed run retries them
+    (and appends a newer line for the row). Done rows are tracked as a watermark (every row below it
+    is done) plus those done out of order above it, so memory stays small however long the input is,
+    unless many rows fail.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = 0
+        self._done_above = set()
+
+        if os.path.exists(path):
+            # A line cut short by a crash is dropped, so appending carries on from a clean line
+            complete = 0
+            with open(path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    complete += len(line)
+                    if line.strip():
+                        result = json.loads(line)
+                        if "error" not in result:
+                            self._mark(result["index"])
+            if complete < os.path.getsize(path):
+                os.truncate(path, complete)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __len__(self) -> int:
+        return self.watermark + len(self._done_above)
+
+    def _mark(self, index: int) -> None:
+        self._done_above.add(index)
+        while self.watermark in self._done_above:
+            self._done_above.remove(self.watermark)
+            self.watermark += 1
+
+    def is_done(self, index: int) -> bool:
+        return index < self.watermark or index in self._done_above
+
+    def write(self, result: dict) -> None:
+        """
+        Appends a result ({"index": ..., ...}) and flushes it, so it survives the process stopping.
+        """
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if "error" not in result:
+            self._mark(result["index"])
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_message_batches(path: str) -> Iterator[List[BaseMessage]]:
+    """
+    Yields message lists from a JSONL file where each line is {"messages": [{"role": ..., "content": ...}, ...]}.
+    Lines that can't be read as one (bad JSON, an unknown role) are yielded as InvalidInput errors.
+    """
+    for row in read_jsonl(path):
+        if isinstance(row, InvalidInput):
+            yield row
+            continue
+        try:
+            yield messages_from_json(row["messages"])
+        except (KeyError, TypeError) as error:
+            yield InvalidInput(f"Not a message list ({error!r}): {row}")
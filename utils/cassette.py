@@ -0,0 +1,437 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import signature
+from typing import Any, Dict, List, Mapping, Optional, Union
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForLLMRun,
+    CallbackManagerForToolRun,
+    Callbacks,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import BaseLLM
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, Generation, LLMResult
+from langchain.tools.base import BaseTool
+
+from utils.llm_cache import REPLAY_TOKEN_PATTERN
+from utils.wrapped_llm import WrappedLLM
+
+# Input of the tool call being run by RecordedTool.run/arun, for the _run/_arun call that follows
+_pending_input = ContextVar("pending_cassette_input")
+
+
+class CassetteMiss(LookupError):
+    """
+    Raised in replay mode for a request that isn't on the cassette.
+    """
+
+
+class Cassette:
+    """
+    Recorded model & tool traffic in a gzipped JSON lines file, one interaction per line:
+        {"kind": "llm" | "chat" | "tool", "key": ..., "duration": seconds, "response": ...,
+         "tokens": [...], "delays": [seconds before each token]}
+    Tokens & delays are only kept for streamed responses, and the response only when it isn't the tokens joined.
+    In "record" mode interactions are appended as they finish, so several runs can go on one cassette.
+    In "replay" mode the file is loaded once and each request gets the recorded responses for its key in order,
+    the last one repeating. With timing="original", responses are delayed (and streamed) as they were recorded;
+    with "instant" they are returned straight away.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", timing: str = "instant"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}' (expected 'record' or 'replay')")
+        if timing not in ("instant", "original"):
+            raise ValueError(f"Unknown cassette timing '{timing}' (expected 'instant' or 'original')")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.recorded = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._interactions: Dict[str, List[dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+
+        if mode == "record":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions[interaction["key"]].append(interaction)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @staticmethod
+    def key(kind: str, model_string: str, request: str) -> str:
+        return hashlib.sha256(f"{kind}\0{model_string}\0{request}".encode("utf-8")).hexdigest()
+
+    def record(self, interaction: dict) -> None:
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def replay(self, key: str, description: str) -> dict:
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                raise CassetteMiss(f"No recording of {description} on {self.path}; record it with CASSETTE_MODE=record")
+            position = self._positions[key]
+            self._positions[key] = position + 1
+            self.replayed += 1
+            return interactions[min(position, len(interactions) - 1)]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "recorded": self.recorded, "replayed": self.replayed}
+
+
+class _Recorder:
+    """
+    Times a call and the tokens it streams, building the cassette interaction.
+    """
+
+    def __init__(self, kind: str, key: str):
+        self.kind = kind
+        self.key = key
+        self.tokens: List[str] = []
+        self.delays: List[float] = []
+        self.started = self.last = time.perf_counter()
+
+    def token(self, token: str) -> None:
+        now = time.perf_counter()
+        self.tokens.append(token)
+        self.delays.append(round(now - self.last, 4))
+        self.last = now
+
+    def interaction(self, response: str) -> dict:
+        interaction = {
+            "kind": self.kind,
+            "key": self.key,
+            "duration": round(time.perf_counter() - self.started, 4),
+        }
+        if self.tokens:
+            interaction["tokens"] = self.tokens
+            interaction["delays"] = self.delays
+        if "".join(self.tokens) != response:
+            # Streamed responses are usually just their tokens, so they aren't stored twice
+            interaction["response"] = response
+        return interaction
+
+
+class _RecordingForwarder(BaseCallbackHandler):
+    """
+    Records each streamed token and forwards it to the wrapper's run manager. Errors raised by the wrapper's
+    callbacks (e.g. a stream guard) are passed on, and the tokens streamed until then are still recorded.
+    """
+
+    raise_error = True
+
+    def __init__(self, recorder: _Recorder, run_manager: Optional[CallbackManagerForLLMRun]):
+        self.recorder = recorder
+        self.run_manager = run_manager
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.recorder.token(token)
+        if self.run_manager:
+            self.run_manager.on_llm_new_token(token)
+
+
+class _AsyncRecordingForwarder(AsyncCallbackHandler):
+    """
+    Async counterpart of _RecordingForwarder.
+    """
+
+    raise_error = True
+
+    def __init__(self, recorder: _Recorder, run_manager: Optional[AsyncCallbackManagerForLLMRun]):
+        self.recorder = recorder
+        self.run_manager = run_manager
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.recorder.token(token)
+        if self.run_manager:
+            await self.run_manager.on_llm_new_token(token)
+
+
+@contextmanager
+def _partial_recording(cassette: Cassette, recorder: _Recorder):
+    # A response stopped part way (e.g. by a stream guard) is recorded as far as it got,
+    # so replays stop at the same point
+    try:
+        yield
+    except BaseException:
+        if recorder.tokens:
+            cassette.record(recorder.interaction("".join(recorder.tokens)))
+        raise
+
+
+def _model_string(model: Union[BaseLLM, BaseChatModel], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+    # Streaming only changes how the response arrives, so recordings from the streaming examples
+    # also serve the silent (batch) ones. ChatOpenAI's parameters carry the flag as "stream"
+    params = model.dict()
+    params.pop("streaming", None)
+    params.pop("stream", None)
+    params.update(kwargs)
+    params["stop"] = stop
+    return str(sorted(params.items()))
+
+
+def _messages_string(messages: List[BaseMessage]) -> str:
+    return "\0".join(f"{message.type}:{message.content}" for message in messages)
+
+
+def _response(interaction: dict) -> str:
+    return interaction["response"] if "response" in interaction else "".join(interaction.get("tokens", []))
+
+
+def _replayed_tokens(interaction: dict) -> List[tuple]:
+    """
+    (delay, token) pairs to stream; responses recorded without streaming are split into words,
+    streamed once the recorded duration has passed.
+    """
+    if "tokens" in interaction:
+        return list(zip(interaction["delays"], interaction["tokens"]))
+    tokens = REPLAY_TOKEN_PATTERN.findall(_response(interaction))
+    return [(interaction["duration"] if index == 0 else 0.0, token) for index, token in enumerate(tokens)]
+
+
+def _replay(cassette: Cassette, interaction: dict, run_manager) -> str:
+    original = cassette.timing == "original"
+    if not run_manager:
+        if original:
+            time.sleep(interaction["duration"])
+        return _response(interaction)
+    for delay, token in _replayed_tokens(interaction):
+        if original and delay:
+            time.sleep(delay)
+        run_manager.on_llm_new_token(token)
+    return _response(interaction)
+
+
+async def _areplay(cassette: Cassette, interaction: dict, run_manager) -> str:
+    original = cassette.timing == "original"
+    if not run_manager:
+        if original:
+            await asyncio.sleep(interaction["duration"])
+        return _response(interaction)
+    for delay, token in _replayed_tokens(interaction):
+        if original and delay:
+            await asyncio.sleep(delay)
+        await run_manager.on_llm_new_token(token)
+    return _response(interaction)
+
+
+class CassetteLLM(WrappedLLM):
+    """
+    LLM wrapper that records every call to a Cassette, or replays them from it without calling the wrapped LLM.
+    Streamed tokens are recorded with their timing, and replayed through the wrapper's callbacks.
+    Each prompt of a request is recorded on its own (with the time the whole request took), so a batch
+    replays the same as the prompts sent one by one.
+    """
+
+    cassette: Cassette
+
+    def _keys(self, prompts: List[str], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> List[str]:
+        model_string = _model_string(self.llm, stop, kwargs)
+        return [Cassette.key("llm", model_string, prompt) for prompt in prompts]
+
+    def _replayed(self, key: str, prompt: str) -> dict:
+        return self.cassette.replay(key, f"{self._llm_type} prompt {prompt[:40]!r}")
+
+    def _record(self, recorders: List[_Recorder], result: LLMResult) -> LLMResult:
+        for recorder, generation in zip(recorders, result.generations):
+            self.cassette.record(recorder.interaction(generation[0].text))
+        return LLMResult(generations=result.generations, llm_output=result.llm_output)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        keys = self._keys(prompts, stop, kwargs)
+        if not self.cassette.recording:
+            return LLMResult(generations=[
+                [Generation(text=_replay(self.cassette, self._replayed(key, prompt), run_manager))]
+                for key, prompt in zip(keys, prompts)
+            ])
+
+        recorders = [_Recorder("llm", key) for key in keys]
+        if len(prompts) > 1:
+            # Responses to several prompts aren't streamed one by one, so only their text is recorded
+            return self._record(recorders, self._generate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs))
+        with _partial_recording(self.cassette, recorders[0]):
+            result = self.llm.generate(prompts, stop=stop, callbacks=[_RecordingForwarder(recorders[0], run_manager)], **kwargs)
+        return self._record(recorders, result)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        keys = self._keys(prompts, stop, kwargs)
+        if not self.cassette.recording:
+            return LLMResult(generations=[
+                [Generation(text=await _areplay(self.cassette, self._replayed(key, prompt), run_manager))]
+                for key, prompt in zip(keys, prompts)
+            ])
+
+        recorders = [_Recorder("llm", key) for key in keys]
+        if len(prompts) > 1:
+            return self._record(recorders, await self._agenerate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs))
+        with _partial_recording(self.cassette, recorders[0]):
+            result = await self.llm.agenerate(prompts, stop=stop, callbacks=[_AsyncRecordingForwarder(recorders[0], run_manager)], **kwargs)
+        return self._record(recorders, result)
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model counterpart of CassetteLLM. Replayed responses are plain AI messages.
+    Like WrappedLLM, the wrapped chat model should be built without callbacks.
+    """
+
+    chat: BaseChatModel
+    cassette: Cassette
+
+    @property
+    def _llm_type(self) -> str:
+        return self.chat._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.chat._identifying_params
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.chat.get_num_tokens(text)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = Cassette.key("chat", _model_string(self.chat, stop, kwargs), _messages_string(messages))
+        if not self.cassette.recording:
+            interaction = self.cassette.replay(key, f"{self._llm_type} messages {messages[-1].content[:40]!r}")
+            text = _replay(self.cassette, interaction, run_manager)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+        recorder = _Recorder("chat", key)
+        with _partial_recording(self.cassette, recorder):
+            result = self.chat.generate([messages], stop=stop, callbacks=[_RecordingForwarder(recorder, run_manager)], **kwargs)
+        self.cassette.record(recorder.interaction(result.generations[0][0].text))
+        return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = Cassette.key("chat", _model_string(self.chat, stop, kwargs), _messages_string(messages))
+        if not self.cassette.recording:
+            interaction = self.cassette.replay(key, f"{self._llm_type} messages {messages[-1].content[:40]!r}")
+            text = await _areplay(self.cassette, interaction, run_manager)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+        recorder = _Recorder("chat", key)
+        with _partial_recording(self.cassette, recorder):
+            result = await self.chat.agenerate([messages], stop=stop, callbacks=[_AsyncRecordingForwarder(recorder, run_manager)], **kwargs)
+        self.cassette.record(recorder.interaction(result.generations[0][0].text))
+        return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+
+class RecordedTool(BaseTool):
+    """
+    Wraps an agent tool (e.g. serpapi's Search) so its calls are recorded to, or replayed from, a Cassette.
+    """
+
+    tool: BaseTool
+    cassette: Cassette
+
+    @staticmethod
+    def _input_key(tool_input: Union[str, Dict]) -> str:
+        return tool_input if isinstance(tool_input, str) else json.dumps(tool_input, sort_keys=True)
+
+    def run(self, tool_input: Union[str, Dict], *args: Any, **kwargs: Any) -> Any:
+        # The raw input is only seen here; _run gets it parsed, so it's passed on for the key
+        _pending_input.set(self._input_key(tool_input))
+        return super().run(tool_input, *args, **kwargs)
+
+    async def arun(self, tool_input: Union[str, Dict], *args: Any, **kwargs: Any) -> Any:
+        _pending_input.set(self._input_key(tool_input))
+        return await super().arun(tool_input, *args, **kwargs)
+
+    def _key(self) -> str:
+        return Cassette.key("tool", self.name, _pending_input.get())
+
+    def _run(self, *args: Any, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        key = self._key()
+        if not self.cassette.recording:
+            return _replay(self.cassette, self.cassette.replay(key, f"{self.name} call"), None)
+
+        if signature(self.tool._run).parameters.get("run_manager"):
+            kwargs["run_manager"] = run_manager
+        recorder = _Recorder("tool", key)
+        output = self.tool._run(*args, **kwargs)
+        self.cassette.record(recorder.interaction(str(output)))
+        return output
+
+    async def _arun(self, *args: Any, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        key = self._key()
+        if not self.cassette.recording:
+            return await _areplay(self.cassette, self.cassette.replay(key, f"{self.name} call"), None)
+
+        if signature(self.tool._arun).parameters.get("run_manager"):
+            kwargs["run_manager"] = run_manager
+        recorder = _Recorder("tool", key)
+        output = await self.tool._arun(*args, **kwargs)
+        self.cassette.record(recorder.interaction(str(output)))
+        return output
+
+
+def record_tools(tools: List[BaseTool], cassette: Cassette, callbacks: Callbacks = None) -> List[BaseTool]:
+    """
+    Wraps each tool in a RecordedTool.
+    """
+    return [
+        RecordedTool(
+            tool=tool,
+            cassette=cassette,
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            return_direct=tool.return_direct,
+            callbacks=callbacks,
+        )
+        for tool in tools
+    ]
@@ -1,4 +1,11 @@
+import asyncio
+import atexit
+import itertools
+import queue
+import shutil
 import sys
+import threading
+import time
 
 # ANSI color codes
 COLOR_CYAN = "\033[96m"
@@ -14,6 +21,248 @@ COLOR_TOOL = COLOR_MAGENTA
 COLOR_ERROR = COLOR_RED
 
 
+class StreamBuffer:
+    """
+    Coalesces streamed tokens and writes them to stdout in chunks instead of one write & flush per token.
+    Color codes are only written when the color changes, and are dropped entirely when stdout is not a TTY.
+    Tokens arrive on the model's callback thread while other threads may flush, so all of it runs under a lock.
+    """
+
+    def __init__(self, max_chars=256, max_delay=0.05):
+        self.max_chars = max_chars # Flush once this many characters are pending
+        self.max_delay = max_delay # Flush if this many seconds have passed since the last flush
+        self._pending = []
+        self._pending_chars = 0
+        self._color = None # Color last written to the terminal, None when unknown/reset
+        self._last_flush = 0.0
+        self._stream = None
+        self._stream_is_tty = False
+        self._lock = threading.RLock() # Reentrant, as write() & end() flush while holding it
+
+    def write(self, token: str, color: str):
+        """
+        Queues a token to be written in the given color, flushing when a threshold is reached.
+        """
+        with self._lock:
+            if color != self._color and self._use_color():
+                self._pending.append(color)
+                self._color = color
+            self._pending.append(token)
+            self._pending_chars += len(token)
+
+            now = time.monotonic()
+            if self._pending_chars >= self.max_chars or now - self._last_flush >= self.max_delay:
+                self.flush(now)
+
+    def flush(self, now=None):
+        """
+        Writes all pending tokens to stdout in a single write.
+        """
+        with self._lock:
+            if self._pending:
+                stream = sys.stdout
+                stream.write("".join(self._pending))
+                stream.flush()
+                self._pending.clear()
+                self._pending_chars = 0
+            self._last_flush = now if now is not None else time.monotonic()
+
+    def end(self):
+        """
+        Flushes pending tokens and resets the terminal color so following output is unaffected.
+        """
+        with self._lock:
+            if self._color is not None and self._color != COLOR_RESET:
+                self._pending.append(COLOR_RESET)
+            self.flush()
+            self._color = None
+
+    def _use_color(self):
+        # isatty() is a syscall, so only check it again when stdout has been swapped out
+        if sys.stdout is not self._stream:
+            self._stream = sys.stdout
+            try:
+                self._stream_is_tty = self._stream.isatty()
+            except (AttributeError, ValueError):
+                self._stream_is_tty = False
+        return self._stream_is_tty
+
+
+def _is_tty(stream) -> bool:
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+class StreamChannel:
+    """
+    Output handle for one of several concurrent streams, see ConsoleMultiplexer.
+    Writing only puts the token on the multiplexer's queue, so it never waits on a lock or on stdout.
+    """
+
+    def __init__(self, multiplexer: "ConsoleMultiplexer", label: str, color: str):
+        self.label = label
+        self.color = color
+        self._put = multiplexer._queue.put
+        # Only used by the writer thread
+        self._partial = []
+        self._partial_chars = 0
+
+    def write(self, token: str):
+        self._put((self, token))
+
+    def end(self):
+        """
+        Writes the rest of the stream. The channel shouldn't be written to afterwards.
+        """
+        self._put((self, None))
+
+
+class ConsoleMultiplexer:
+    """
+    Renders several concurrent streams to stdout from one writer thread, so their tokens & colors don't interleave.
+    Each stream writes to its own StreamChannel; the writer thread drains the shared queue in batches and writes
+    each batch at once. Modes:
+    - "prefix": streams are written line by line, each line prefixed with its stream's label
+      (long lines are wrapped at the terminal width)
+    - "regions": the same lines, plus one live row per open stream at the bottom of the terminal showing the
+      line it is writing. Falls back to "prefix" when stdout is not a TTY
+    """
+
+    MODES = ("prefix", "regions")
+
+    def __init__(self, mode: str = "prefix", max_batch: int = 1024):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown console stream mode '{mode}'. Available: {', '.join(self.MODES)}")
+        self.mode = mode
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._counter = itertools.count(1)
+        self._open = {} # Channels with unfinished output, in the order they were opened (writer thread only)
+        self._region_rows = 0 # Live rows currently drawn at the bottom of the terminal (writer thread only)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="console-multiplexer")
+        self._thread.start()
+
+    def open(self, label: str = None, color: str = COLOR_REPSONSE) -> StreamChannel:
+        """
+        Returns a new channel. Labels default to #1, #2, ...
+        """
+        return StreamChannel(self, label or f"#{next(self._counter)}", color)
+
+    def print(self, text: str):
+        """
+        Queues a whole line (e.g. a ConsoleLogger message), written between the streams' lines.
+        """
+        self._queue.put((None, text))
+
+    def flush(self, timeout: float = None):
+        """
+        Waits until everything queued so far has been written.
+        """
+        if threading.current_thread() is self._thread:
+            return
+        written = threading.Event()
+        self._queue.put((None, written))
+        written.wait(timeout)
+
+    def close(self):
+        """
+        Writes everything queued, including unfinished lines, and stops the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            stream = sys.stdout
+            use_color = _is_tty(stream)
+            regions = self.mode == "regions" and use_color
+            width = shutil.get_terminal_size().columns
+
+            output, done, stop = [], [], False
+            for item in batch:
+                if item is None:
+                    stop = True
+                    break
+                channel, token = item
+                if channel is None:
+                    if isinstance(token, threading.Event):
+                        done.append(token)
+                    else:
+                        output.append(f"{token}\n")
+                elif token is None:
+                    self._end_channel(channel, output, use_color)
+                else:
+                    self._open.setdefault(channel, True)
+                    self._add_token(channel, token, output, use_color, width)
+            if stop:
+                for channel in list(self._open):
+                    self._end_channel(channel, output, use_color)
+
+            if regions:
+                # Move to the first live row and clear, so committed lines replace the rows before they're redrawn
+                clear = f"\033[{self._region_rows}F\033[J" if self._region_rows else ""
+                rows = [self._region_row(channel, width) for channel in self._open]
+                self._region_rows = len(rows)
+                output = [clear, *output, *rows]
+
+            text = "".join(output)
+            if text:
+                stream.write(text)
+                stream.flush()
+            for event in done:
+                event.set()
+            if stop:
+                return
+
+    def _add_token(self, channel: StreamChannel, token: str, output: list, use_color: bool, width: int):
+        lines = token.split("\n")
+        for line in lines[:-1]:
+            channel._partial.append(line)
+            self._commit_line(channel, output, use_color)
+        # Tokens usually start with a space, which isn't needed after the label
+        last = lines[-1] if channel._partial_chars else lines[-1].lstrip(" ")
+        if last:
+            channel._partial.append(last)
+            channel._partial_chars += len(last)
+
+        # Wrap long lines at the last space that fits
+        limit = max(20, width - len(channel.label) - 3)
+        while channel._partial_chars > limit:
+            pending = "".join(channel._partial)
+            cut = pending.rfind(" ", 0, limit)
+            cut = limit if cut <= 0 else cut
+            channel._partial = [pending[:cut]]
+            self._commit_line(channel, output, use_color)
+            rest = pending[cut:].lstrip(" ")
+            channel._partial = [rest] if rest else []
+            channel._partial_chars = len(rest)
+
+    def _commit_line(self, channel: StreamChannel, output: list, use_color: bool):
+        line = "".join(channel._partial)
+        channel._partial.clear()
+        channel._partial_chars = 0
+        if use_color:
+            output.append(f"{channel.color}[{channel.label}] {line}{COLOR_RESET}\n")
+        else:
+            output.append(f"[{channel.label}] {line}\n")
+
+    def _end_channel(self, channel: StreamChannel, output: list, use_color: bool):
+        if channel._partial_chars:
+            self._commit_line(channel, output, use_color)
+        self._open.pop(channel, None)
+
+    def _region_row(self, channel: StreamChannel, width: int) -> str:
+        line = "".join(channel._partial)[-max(0, width - len(channel.label) - 4):]
+        return f"{channel.color}[{channel.label}] {line}{COLOR_RESET}\n"
+
+
 class ConsoleLogger:
     """
     This class handles console logging in various colors consistently across the project.
@@ -21,6 +270,8 @@ class ConsoleLogger:
     """
 
     current_stream_color = COLOR_REPSONSE
+    stream_buffer = StreamBuffer()
+    multiplexer = None # ConsoleMultiplexer while concurrent streams are multiplexed, see multiplex()
 
     # region Input
 
@@ -29,6 +280,7 @@ class ConsoleLogger:
         """
         Prints a colored message to the console and captures user input.
         """
+        ConsoleLogger.end_streaming()
         return input(f"{color}{message}{COLOR_RESET}")
 
     @staticmethod
@@ -37,6 +289,7 @@ class ConsoleLogger:
         Prints a colored message to the console and captures user input with a default value.
         """
         prompt = f"{color}{message} (default - {default}): " if show_default else f"{color}{message}: "
+        ConsoleLogger.end_streaming()
         user_input = input(prompt)
         return default if user_input == "" else user_input
 
@@ -45,12 +298,33 @@ class ConsoleLogger:
         """
         Prints a colored message to the console and captures an integer user input.
         """
+        ConsoleLogger.end_streaming()
         while True:
             try:
                 return int(input(f"{color}{message}{COLOR_RESET}"))
             except ValueError:
                 print(f"{COLOR_ERROR}Invalid input! Please enter an integer.{COLOR_RESET}")
 
+    @staticmethod
+    async def ainput(message, color=COLOR_INPUT):
+        """
+        Async version of input. Waits for user input in a worker thread so the event loop keeps running.
+        """
+        return await asyncio.to_thread(ConsoleLogger.input, message, color)
+
+    @staticmethod
+    async def ainput_with_default(message, default, show_default=True, color=COLOR_INPUT):
+        """
+        Async version of input_with_default. Waits for user input in a worker thread so the event loop keeps running.
+        """
+        return await asyncio.to_thread(ConsoleLogger.input_with_default, message, default, show_default, color)
+
+    @staticmethod
+    async def ainput_int(message, color=COLOR_INPUT):
+        """
+        Async version of input_int. Waits for user input in a worker thread so the event loop keeps running.
+        """
+        return await asyncio.to_thread(ConsoleLogger.input_int, message, color)
 
     # endregion
     # region Logging
@@ -61,53 +335,100 @@ class ConsoleLogger:
         Logs to console with color & an optional prefix.
         """
         ConsoleLogger.current_stream_color = COLOR_RESET
-        print(f"{color}{prefix}: {message}{COLOR_RESET}" if prefix else f"{color}{message}{COLOR_RESET}")
+        ConsoleLogger._print(f"{color}{prefix}: {message}{COLOR_RESET}" if prefix else f"{color}{message}{COLOR_RESET}")
 
     @staticmethod
     def log_input(input_text):
         """
         Logs with the 'INPUT: ' prefix and input color.
         """
-        print(f"{COLOR_INPUT}INPUT: {input_text}{COLOR_RESET}")
+        ConsoleLogger._print(f"{COLOR_INPUT}INPUT: {input_text}{COLOR_RESET}")
 
     @staticmethod
     def log_thinking():
         """
         Logs the 'Thinking...' message to the console
         """
-        print(f"\n{COLOR_THINKING}Thinking...{COLOR_RESET}")
+        ConsoleLogger._print(f"\n{COLOR_THINKING}Thinking...{COLOR_RESET}")
 
     @staticmethod
     def log_response(response_text):
         """
         Logs with the 'RESPONSE: ' prefix and response color.
         """
-        print(f"{COLOR_REPSONSE}RESPONSE: {response_text}{COLOR_RESET}")
+        ConsoleLogger._print(f"{COLOR_REPSONSE}RESPONSE: {response_text}{COLOR_RESET}")
 
     @staticmethod
     def log_tool(tool_text):
         """
         Logs with the 'TOOL: ' prefix and tool color.
         """
-        print(f"{COLOR_TOOL}TOOL: {tool_text}{COLOR_RESET}")
+        ConsoleLogger._print(f"{COLOR_TOOL}TOOL: {tool_text}{COLOR_RESET}")
 
     @staticmethod
     def log_error(error_text):
         """
         Logs with the 'ERROR: ' prefix and error color.
         """
-        print(f"{COLOR_ERROR}ERROR: {error_text}{COLOR_RESET}")
+        ConsoleLogger._print(f"{COLOR_ERROR}ERROR: {error_text}{COLOR_RESET}")
+
+    @staticmethod
+    def _print(text):
+        # While streams are multiplexed, lines go through its writer thread so they don't split a stream's line
+        if ConsoleLogger.multiplexer is not None:
+            ConsoleLogger.multiplexer.print(text)
+        else:
+            ConsoleLogger.stream_buffer.end()
+            print(text)
 
     # endregion
     # region Streaming
 
+    @staticmethod
+    def multiplex(mode="prefix"):
+        """
+        Starts rendering concurrent streams through a ConsoleMultiplexer ("prefix" or "regions" mode).
+        Streams then write to their own channel from open_stream() instead of the shared stream buffer.
+        """
+        if ConsoleLogger.multiplexer is None or ConsoleLogger.multiplexer.mode != mode:
+            ConsoleLogger.stop_multiplexing()
+            ConsoleLogger.stream_buffer.end()
+            ConsoleLogger.multiplexer = ConsoleMultiplexer(mode)
+        return ConsoleLogger.multiplexer
+
+    @staticmethod
+    def stop_multiplexing():
+        """
+        Writes all multiplexed output and goes back to the shared stream buffer.
+        """
+        multiplexer, ConsoleLogger.multiplexer = ConsoleLogger.multiplexer, None
+        if multiplexer is not None:
+            multiplexer.close()
+
+    @staticmethod
+    def open_stream(label=None, color=COLOR_REPSONSE):
+        """
+        Returns a StreamChannel for one stream while multiplexing, otherwise None (use log_streaming).
+        """
+        multiplexer = ConsoleLogger.multiplexer
+        return multiplexer.open(label, color) if multiplexer is not None else None
+
     @staticmethod
     def log_streaming(token: str):
         """
-        Prints a token in the stream with the response color.
+        Buffers a token in the stream with the response color. Output is written in chunks, see StreamBuffer.
         """
-        sys.stdout.write(COLOR_REPSONSE + token)
-        sys.stdout.flush()
+        ConsoleLogger.stream_buffer.write(token, COLOR_REPSONSE)
+
+    @staticmethod
+    def end_streaming():
+        """
+        Writes any buffered stream output and resets the stream color in the terminal.
+        While multiplexing, waits until everything queued so far has been written.
+        """
+        ConsoleLogger.stream_buffer.end()
+        if ConsoleLogger.multiplexer is not None:
+            ConsoleLogger.multiplexer.flush()
 
     @staticmethod
     def set_stream_color(color: str):
@@ -131,3 +452,6 @@ class ConsoleLogger:
         ConsoleLogger.set_stream_color(COLOR_RESET)
 
     # endregion
+
+
+atexit.register(ConsoleLogger.stop_multiplexing)
@@ -1,35 +1,86 @@
 from typing import Any, Dict, List, Union
+from uuid import UUID
 
 from langchain.schema import AgentAction, LLMResult
+from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 
 from utils.console_logger import ConsoleLogger
 
 
+class StreamChannels:
+    """
+    The ConsoleLogger stream channel of each LLM run, while concurrent streams are multiplexed
+    (see ConsoleLogger.multiplex). Without multiplexing no channels are opened and tokens go to log_streaming.
+    Runs only ever touch their own entry, so no lock is needed.
+    """
+
+    def __init__(self):
+        self._channels = {}
+
+    def start(self, run_id: UUID) -> None:
+        channel = ConsoleLogger.open_stream()
+        if channel is not None:
+            self._channels[run_id] = channel
+
+    def write(self, token: str, run_id: UUID) -> None:
+        channel = self._channels.get(run_id)
+        if channel is not None:
+            channel.write(token)
+        else:
+            ConsoleLogger.log_streaming(token)
+
+    def end(self, run_id: UUID) -> bool:
+        """
+        Ends the run's channel, returning False if it didn't have one.
+        """
+        channel = self._channels.pop(run_id, None)
+        if channel is None:
+            return False
+        channel.end()
+        return True
+
+
 class CustomStreamCallback(StreamingStdOutCallbackHandler):
     """
     Custom callback handler that uses ConsoleLogger log output & color streamed output from current_stream_color
     """
 
+    def __init__(self):
+        self.channels = StreamChannels()
+
     def on_llm_start(
-        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
     ) -> None:
         """
         Automatically logs "Thinking..." when LLM starts.
         """
         ConsoleLogger.log_thinking()
+        self.channels.start(run_id)
 
-    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
         """Run on new LLM token. Only available when streaming is enabled."""
-        ConsoleLogger.log_streaming(token)
+        self.channels.write(token, run_id)
 
-    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
         """
-        Resets stream color and prints an empty line on LLM stream end.
+        Flushes buffered output, resets stream color and prints an empty line on LLM stream end.
         """
+        if self.channels.end(run_id):
+            return
+        ConsoleLogger.end_streaming()
         print("\n")
         ConsoleLogger.set_default_stream_color()
 
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """
+        Flushes buffered output so a partial stream is still shown when the LLM fails.
+        """
+        if not self.channels.end(run_id):
+            ConsoleLogger.end_streaming()
+
     def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
         """
         Log agents action in magenta
@@ -40,15 +91,17 @@ class CustomStreamCallback(StreamingStdOutCallbackHandler):
         self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
     ) -> None:
         """
-        Log tool start and input in magenta
+        Log tool start and input in magenta, noting when the result will come from the tool cache
         """
-        ConsoleLogger.log_tool(f"Tool started. input_str: {input_str}")
+        cached = " (cached)" if kwargs.get("cache_hit") else ""
+        ConsoleLogger.log_tool(f"Tool started{cached}. input_str: {input_str}")
 
     def on_tool_end(self, output: str, **kwargs: Any) -> None:
         """
-        Log tool end and output in magenta
+        Log tool end and output in magenta, noting when the output came from the tool cache
         """
-        ConsoleLogger.log_tool(f"Tool ended. output: {output}")
+        cached = " (cached)" if kwargs.get("cache_hit") else ""
+        ConsoleLogger.log_tool(f"Tool ended{cached}. output: {output}")
 
     def on_tool_error(
         self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
@@ -57,3 +110,75 @@ class CustomStreamCallback(StreamingStdOutCallbackHandler):
         Log tool error in magenta
         """
         ConsoleLogger.log_error(f"Tool error: {error}")
+
+
+class AsyncCustomStreamCallback(AsyncCallbackHandler):
+    """
+    Async counterpart of CustomStreamCallback for the async LLM & chain APIs (agenerate, apredict, arun).
+    Handlers run directly on the event loop instead of being dispatched to a thread pool per event.
+    """
+
+    def __init__(self):
+        self.channels = StreamChannels()
+
+    async def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """
+        Automatically logs "Thinking..." when LLM starts.
+        """
+        ConsoleLogger.log_thinking()
+        self.channels.start(run_id)
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        self.channels.write(token, run_id)
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        """
+        Flushes buffered output, resets stream color and prints an empty line on LLM stream end.
+        """
+        if self.channels.end(run_id):
+            return
+        ConsoleLogger.end_streaming()
+        print("\n")
+        ConsoleLogger.set_default_stream_color()
+
+    async def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        """
+        Flushes buffered output so a partial stream is still shown when the LLM fails.
+        """
+        if not self.channels.end(run_id):
+            ConsoleLogger.end_streaming()
+
+    async def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        """
+        Log agents action in magenta
+        """
+        ConsoleLogger.log_tool(f"Agent action: {action}")
+
+    async def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+    ) -> None:
+        """
+        Log tool start and input in magenta, noting when the result will come from the tool cache
+        """
+        cached = " (cached)" if kwargs.get("cache_hit") else ""
+        ConsoleLogger.log_tool(f"Tool started{cached}. input_str: {input_str}")
+
+    async def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        """
+        Log tool end and output in magenta, noting when the output came from the tool cache
+        """
+        cached = " (cached)" if kwargs.get("cache_hit") else ""
+        ConsoleLogger.log_tool(f"Tool ended{cached}. output: {output}")
+
+    async def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> None:
+        """
+        Log tool error in magenta
+        """
+        ConsoleLogger.log_error(f"Tool error: {error}")
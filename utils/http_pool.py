@@ -0,0 +1,94 @@
+import threading
+import warnings
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+def pooled_session(max_connections: int = 16) -> requests.Session:
+    """
+    Returns the process-wide requests.Session, creating it on first use.
+    Its keep-alive pool holds up to `max_connections` connections per host, and requests beyond that
+    wait for a free connection instead of opening (and handshaking) a throwaway one.
+    Connections that fail to open are retried twice. urllib3 doesn't retry a POST once it has been sent,
+    so a completion is never requested twice by the pool; the clients' own retries still apply on top.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4, # Distinct hosts kept (OpenAI, HuggingFace, ...)
+                pool_maxsize=max_connections,
+                pool_block=True,
+                max_retries=2 # Connection errors only, see above
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def install_http_pool(max_connections: int = 16) -> requests.Session:
+    """
+    Makes the OpenAI and HuggingFace clients send their requests through the shared pooled session.
+    Without it, OpenAI keeps one session per thread, so every new batch worker thread opens its own
+    connections, and HuggingFace keeps a separate pool of its own.
+    """
+    session = pooled_session(max_connections)
+
+    try:
+        import openai
+    except ImportError:
+        pass
+    else:
+        if hasattr(openai, "requestssession"):
+            openai.requestssession = session
+            if openai.proxy:
+                session.proxies = {"https": openai.proxy, "http": openai.proxy} if isinstance(openai.proxy, str) else openai.proxy
+        else:
+            # openai 1.x has no module-level session (see requirements.txt for the supported versions)
+            warnings.warn("This openai version doesn't support a shared requests session; OpenAI calls won't use the pool")
+
+    try:
+        # huggingface_hub 0.x uses requests (0.16+ allows swapping its session); newer versions already
+        # share a single client of their own
+        from huggingface_hub import configure_http_backend
+    except ImportError:
+        pass
+    else:
+        try:
+            configure_http_backend(backend_factory=lambda: session)
+        except TypeError:
+            pass
+
+    return session
+
+
+@asynccontextmanager
+async def async_http_pool(max_connections: int = 16) -> AsyncIterator[object]:
+    """
+    Shares one aiohttp session (and its keep-alive pool) between the async OpenAI calls made inside the block.
+    By default the OpenAI client opens a new aiohttp session, and so a new connection, for every request.
+    The session is set in a context variable, so tasks started inside the block use it too.
+    """
+    import aiohttp
+    import openai
+
+    if not hasattr(openai, "aiosession"):
+        warnings.warn("This openai version doesn't support a shared aiohttp session; async OpenAI calls won't use the pool")
+        yield None
+        return
+
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
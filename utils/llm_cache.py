@@ -0,0 +1,208 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.schema import Generation, LLMResult
+
+from utils.wrapped_llm import WrappedLLM, combine_results
+
+# Splits cached text into word-sized tokens (with their leading whitespace) for replaying
+REPLAY_TOKEN_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+class PersistentLLMCache:
+    """
+    On-disk LLM response cache backed by SQLite.
+    Entries expire after `ttl` seconds, and the least recently used entries are evicted
+    once the cache holds more than `max_entries` responses or `max_bytes` of text.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=10_000, max_bytes=50_000_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+        # Running totals so eviction doesn't need to scan the table on every insert
+        self._entries, self._bytes = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def key(llm_string: str, prompt: str) -> str:
+        """
+        Builds the cache key from the model id & parameters and the fully formatted prompt.
+        """
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, llm_string: str, prompt: str) -> Optional[str]:
+        """
+        Returns the cached response, or None when it is missing or expired.
+        """
+        key = self.key(llm_string, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, size, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._entries -= 1
+                self._bytes -= row[1]
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def update(self, llm_string: str, prompt: str, response: str) -> None:
+        """
+        Stores a response, evicting the least recently used entries when over capacity.
+        """
+        key = self.key(llm_string, prompt)
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            previous = self._connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            if previous is None:
+                self._entries += 1
+            else:
+                self._bytes -= previous[0]
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries > self.max_entries or (self._bytes > self.max_bytes and self._entries > 1):
+            # Remove in small batches, oldest access first
+            batch = max(1, min(64, self._entries - self.max_entries))
+            rows = self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", [(row[0],) for row in rows])
+            self._entries -= len(rows)
+            self._bytes -= sum(row[1] for row in rows)
+
+    def clear(self) -> None:
+        """
+        Removes every cached response.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._entries = 0
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and the current size of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": self._entries,
+            "bytes": self._bytes,
+        }
+
+
+class CachedLLM(WrappedLLM):
+    """
+    LLM wrapper that serves responses from a PersistentLLMCache.
+    Cached responses are replayed through the stream callbacks, so output looks the same as a live response.
+    The prompts that aren't cached are sent to the wrapped LLM together, in one request.
+    """
+
+    response_cache: PersistentLLMCache
+
+    def _lookup(self, llm_string: str, prompts: List[str]) -> Tuple[List[Tuple[List[int], LLMResult]], List[int]]:
+        """
+        Returns the cached part of the result, as combine_results takes it, and the indices of the prompts missed.
+        """
+        hits, generations, missing = [], [], []
+        for index, prompt in enumerate(prompts):
+            response = self.response_cache.lookup(llm_string, prompt)
+            if response is None:
+                missing.append(index)
+            else:
+                hits.append(index)
+                generations.append([Generation(text=response)])
+        return [(hits, LLMResult(generations=generations))], missing
+
+    def _update(self, llm_string: str, prompts: List[str], result: LLMResult) -> None:
+        for prompt, generation in zip(prompts, result.generations):
+            self.response_cache.update(llm_string, prompt, generation[0].text)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        llm_string = self.llm_string(stop, **kwargs)
+        parts, missing = self._lookup(llm_string, prompts)
+        if run_manager:
+            for generation in parts[0][1].generations:
+                for token in REPLAY_TOKEN_PATTERN.findall(generation[0].text):
+                    run_manager.on_llm_new_token(token)
+
+        if missing:
+            missed = [prompts[index] for index in missing]
+            result = self._generate_llm(missed, stop=stop, run_manager=run_manager, **kwargs)
+            self._update(llm_string, missed, result)
+            parts.append((missing, result))
+        return combine_results(len(prompts), parts)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        llm_string = self.llm_string(stop, **kwargs)
+        parts, missing = self._lookup(llm_string, prompts)
+        if run_manager:
+            for generation in parts[0][1].generations:
+                for token in REPLAY_TOKEN_PATTERN.findall(generation[0].text):
+                    await run_manager.on_llm_new_token(token)
+
+        if missing:
+            missed = [prompts[index] for index in missing]
+            result = await self._agenerate_llm(missed, stop=stop, run_manager=run_manager, **kwargs)
+            self._update(llm_string, missed, result)
+            parts.append((missing, result))
+        return combine_results(len(prompts), parts)
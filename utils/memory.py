@@ -0,0 +1,225 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from pydantic import PrivateAttr
+
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
+from langchain.schema import BaseMessage, get_buffer_string
+
+from utils.console_logger import ConsoleLogger
+
+
+class RenderedHistory(list):
+    """
+    Conversation messages together with their text, as get_buffer_string renders them.
+    Built by IncrementalBufferMemory, which appends to both as turns are saved instead of re-rendering.
+    """
+
+    def __init__(self, messages=(), text=""):
+        super().__init__(messages)
+        self.text = text
+
+
+class IncrementalBufferMemory(ConversationBufferMemory):
+    """
+    ConversationBufferMemory that renders each message once, when it is saved, instead of rendering the whole
+    history again for every prompt. The history is returned as text (or, with return_messages, as a
+    RenderedHistory that IncrementalChatPromptTemplate turns into text without rendering it again),
+    so the work per turn stays the same however long the conversation gets.
+    Like ConversationBufferMemory, the returned history is the memory's own and grows as turns are saved.
+    """
+
+    _history: RenderedHistory = PrivateAttr(default_factory=RenderedHistory)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def buffer(self) -> Any:
+        with self._lock:
+            messages = self.chat_memory.messages
+            if len(self._history) != len(messages):
+                # Messages were added to (or removed from) chat_memory directly, so everything is rendered again
+                self._history = RenderedHistory()
+                self._append(messages)
+            return self._history if self.return_messages else self._history.text
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """
+        Saves the turn and appends only its messages to the rendered history.
+        """
+        with self._lock:
+            previous_length = len(self.chat_memory.messages)
+            in_sync = len(self._history) == previous_length
+            super().save_context(inputs, outputs)
+            if in_sync:
+                self._append(self.chat_memory.messages[previous_length:])
+
+    def _append(self, messages: List[BaseMessage]) -> None:
+        if not messages:
+            return
+        text = get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        history = self._history
+        history.extend(messages)
+        # Detached first, so when nothing else holds the old text CPython grows it in place instead of copying it
+        rendered, history.text = history.text, ""
+        if rendered:
+            rendered += "\n"
+        rendered += text
+        history.text = rendered
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._history = RenderedHistory()
+
+
+class TokenBudgetMemory(BaseChatMemory, SummarizerMixin):
+    """
+    Conversation memory that keeps the history sent with each prompt within a token budget.
+    The most recent turns are kept word for word. Once they exceed the budget, the oldest turns are moved out
+    of the window and folded into a running summary by a background thread, so turns don't wait on summarizing.
+    Until their summary is applied (or if summarizing fails, which is logged), those turns are still sent
+    word for word after the summary, and are folded in with the next ones. Token counts are kept per message as turns are saved,
+    so the history is never re-counted.
+    """
+
+    max_token_limit: int = 2000
+    memory_key: str = "history"
+
+    _token_counts: deque = PrivateAttr(default_factory=deque)
+    _window_tokens: int = PrivateAttr(default=0)
+    _summary: str = PrivateAttr(default="")
+    _summary_tokens: int = PrivateAttr(default=0)
+    _unsummarized: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _unsummarized_tokens: int = PrivateAttr(default=0)
+    _unsummarized_counts: List[int] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _executor: Any = PrivateAttr(default=None)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        return self.chat_memory.messages
+
+    @property
+    def summary(self) -> str:
+        """
+        The running summary of the turns moved out of the window ("" until the first one is summarized).
+        """
+        return self._summary
+
+    @property
+    def token_count(self) -> int:
+        """
+        Tokens currently sent as history (summary + turns not summarized yet + window).
+        """
+        return self._summary_tokens + self._unsummarized_tokens + self._window_tokens
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the running summary (if any) followed by the recent turns.
+        """
+        with self._lock:
+            buffer = self._unsummarized + list(self.buffer)
+            if self._summary:
+                buffer.insert(0, self.summary_message_cls(content=self._summary))
+
+        if self.return_messages:
+            return {self.memory_key: buffer}
+        return {
+            self.memory_key: get_buffer_string(
+                buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        }
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """
+        Saves the turn, counting only its new messages, and moves old turns out of the window if over budget.
+        """
+        with self._lock:
+            previous_length = len(self.buffer)
+            super().save_context(inputs, outputs)
+            for message in self.buffer[previous_length:]:
+                tokens = self._count_tokens([message])
+                self._token_counts.append(tokens)
+                self._window_tokens += tokens
+
+            evicted = False
+            # Always keep the latest turn, even if it alone is over budget. Evicted turns stay in the history,
+            # after the summary, until a summary covering them is applied (so they don't count against the window)
+            while self._summary_tokens + self._window_tokens > self.max_token_limit and len(self.buffer) > 2:
+                tokens = self._token_counts.popleft()
+                self._unsummarized.append(self.buffer.pop(0))
+                self._unsummarized_counts.append(tokens)
+                self._unsummarized_tokens += tokens
+                self._window_tokens -= tokens
+                evicted = True
+
+        if evicted:
+            if self._executor is None:
+                # A single worker keeps summaries applied in the order turns were evicted
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+            self._executor.submit(self._summarize)
+
+    def _summarize(self) -> None:
+        with self._lock:
+            messages = list(self._unsummarized)
+        if not messages:
+            return # Covered by an earlier summary
+        try:
+            summary = self.predict_new_summary(messages, self._summary)
+        except Exception as error:
+            ConsoleLogger.log_error(f"Couldn't summarize {len(messages)} messages, keeping them as they are: {error}")
+            return
+
+        tokens = self._count_tokens([self.summary_message_cls(content=summary)])
+        with self._lock:
+            # Turns evicted while this summary was made are left for the next one
+            covered = len(messages)
+            self._summary = summary
+            self._summary_tokens = tokens
+            self._unsummarized_tokens -= sum(self._unsummarized_counts[:covered])
+            del self._unsummarized[:covered]
+            del self._unsummarized_counts[:covered]
+
+    def _count_tokens(self, messages: List[BaseMessage]) -> int:
+        return self.llm.get_num_tokens(
+            get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        )
+
+    def wait_for_summary(self) -> None:
+        """
+        Blocks until every pending background summary has been applied.
+        """
+        if self._executor is not None:
+            self._executor.submit(lambda: None).result()
+
+    def close(self) -> None:
+        """
+        Lets the background summary thread finish the pending summaries and exit, for a memory that's
+        no longer used (a new summary starts another thread).
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def clear(self) -> None:
+        """
+        Clears the window and the running summary.
+        """
+        self.wait_for_summary()
+        with self._lock:
+            super().clear()
+            self._token_counts.clear()
+            self._window_tokens = 0
+            self._summary = ""
+            self._summary_tokens = 0
+            self._unsummarized = []
+            self._unsummarized_tokens = 0
+            self._unsummarized_counts = []
@@ -0,0 +1,301 @@
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.schema import BaseMessage, LLMResult
+
+# Histogram bucket upper bounds, in seconds for latencies and in tokens for token counts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 4000)
+
+# Metric name -> (help text, bucket bounds, label names)
+METRICS = {
+    "llm_time_to_first_token_seconds": (
+        "Time from the LLM call starting to its first streamed token", LATENCY_BUCKETS, ("model", "example")
+    ),
+    "llm_inter_token_latency_seconds": (
+        "Time between consecutive streamed tokens", LATENCY_BUCKETS, ("model", "example")
+    ),
+    "llm_generation_seconds": (
+        "Total time of an LLM call", LATENCY_BUCKETS, ("model", "example")
+    ),
+    "llm_completion_tokens": (
+        "Tokens generated per LLM call", TOKEN_BUCKETS, ("model", "example")
+    ),
+    "tool_duration_seconds": (
+        "Time from a tool starting to it returning", LATENCY_BUCKETS, ("tool", "example", "cached")
+    ),
+}
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, Prometheus style. Quantiles are estimated from the buckets.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        Returns (upper bound, observations <= bound) pairs, ending with +Inf.
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """
+        Estimates a quantile by interpolating inside the bucket it falls in. The +Inf bucket reports the max seen.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        lower = 0.0
+        previous = 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if math.isinf(bound):
+                    return self.max
+                in_bucket = total - previous
+                position = (rank - previous) / in_bucket if in_bucket else 1.0
+                return min(self.max, lower + (bound - lower) * position)
+            lower, previous = bound, total
+        return self.max
+
+
+class LatencyMetrics:
+    """
+    Thread-safe set of histograms, one per metric & label values, exportable as JSON or Prometheus text.
+    `example` labels everything recorded while an example runs (set by main.py).
+    """
+
+    def __init__(self):
+        self.example = "none"
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Tuple[str, ...]], Histogram] = {}
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        _, bounds, label_names = METRICS[name]
+        key = (name, tuple(str(labels.get(label, "")) for label in label_names))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def _sorted_items(self):
+        with self._lock:
+            return sorted(
+                ((name, labels, histogram) for (name, labels), histogram in self._histograms.items()),
+                key=lambda item: (item[0], item[1])
+            )
+
+    def to_dict(self) -> Dict[str, List[dict]]:
+        """
+        Returns {metric: [{"labels", "count", "sum", "max", "p50", "p95", "p99", "buckets"}, ...]}.
+        """
+        result = {}
+        for name, labels, histogram in self._sorted_items():
+            result.setdefault(name, []).append({
+                "labels": dict(zip(METRICS[name][2], labels)),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "max": histogram.max,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+                "buckets": {_format_bound(bound): total for bound, total in histogram.cumulative()},
+            })
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the histograms in the Prometheus text exposition format.
+        """
+        lines = []
+        current = None
+        for name, labels, histogram in self._sorted_items():
+            if name != current:
+                current = name
+                lines.append(f"# HELP {name} {METRICS[name][0]}")
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(
+                f'{label}="{_escape(value)}"' for label, value in zip(METRICS[name][2], labels)
+            )
+            for bound, total in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{label_text},le="{_format_bound(bound)}"}} {total}')
+            lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to a file, as Prometheus text for .prom/.txt files and JSON otherwise.
+        """
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _model_name(serialized: Dict[str, Any], invocation_params: Optional[dict]) -> str:
+    params = invocation_params or {}
+    return (
+        params.get("model_name") or params.get("model") or params.get("repo_id")
+        or params.get("_type") or (serialized.get("id") or ["unknown"])[-1]
+    )
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """
+    Records LLM & tool timings into a LatencyMetrics: time to first token, time between tokens,
+    total generation time & tokens per call, and tool durations. Runs are told apart by run_id,
+    so one handler can serve concurrent calls.
+    """
+
+    def __init__(self, metrics: LatencyMetrics):
+        self.metrics = metrics
+        self._runs: Dict[UUID, dict] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, **labels: str) -> None:
+        with self._lock:
+            self._runs[run_id] = {
+                "labels": dict(labels, example=self.metrics.example),
+                "started": time.perf_counter(),
+                "last_token": None,
+                "tokens": 0,
+            }
+
+    def _finish(self, run_id: UUID) -> Optional[dict]:
+        with self._lock:
+            return self._runs.pop(run_id, None)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(run_id, model=_model_name(serialized, kwargs.get("invocation_params")))
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(run_id, model=_model_name(serialized, kwargs.get("invocation_params")))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+
+        now = time.perf_counter()
+        if run["last_token"] is None:
+            self.metrics.observe("llm_time_to_first_token_seconds", now - run["started"], **run["labels"])
+        else:
+            self.metrics.observe("llm_inter_token_latency_seconds", now - run["last_token"], **run["labels"])
+        run["last_token"] = now
+        run["tokens"] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._finish(run_id)
+        if run is None:
+            return
+
+        self.metrics.observe("llm_generation_seconds", time.perf_counter() - run["started"], **run["labels"])
+        # Non-streaming calls have no token callbacks, so fall back to the usage reported by the API
+        tokens = run["tokens"] or ((response.llm_output or {}).get("token_usage") or {}).get("completion_tokens")
+        if tokens:
+            self.metrics.observe("llm_completion_tokens", tokens, **run["labels"])
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._finish(run_id)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(
+            run_id,
+            tool=serialized.get("name", "unknown"),
+            cached="true" if kwargs.get("cache_hit") else "false"
+        )
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._finish(run_id)
+        if run is not None:
+            self.metrics.observe("tool_duration_seconds", time.perf_counter() - run["started"], **run["labels"])
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._finish(run_id)
+
+
+class AsyncMetricsCallback(AsyncCallbackHandler):
+    """
+    Async version of MetricsCallback. Recording is cheap, so it's done inline on the event loop
+    instead of in an executor, which would delay the timestamps.
+    """
+
+    def __init__(self, metrics: LatencyMetrics):
+        self._recorder = MetricsCallback(metrics)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._recorder.on_llm_start(serialized, prompts, **kwargs)
+
+    async def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], **kwargs: Any
+    ) -> None:
+        self._recorder.on_chat_model_start(serialized, messages, **kwargs)
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._recorder.on_llm_new_token(token, **kwargs)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self._recorder.on_llm_end(response, **kwargs)
+
+    async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self._recorder.on_llm_error(error, **kwargs)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self._recorder.on_tool_start(serialized, input_str, **kwargs)
+
+    async def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self._recorder.on_tool_end(output, **kwargs)
+
+    async def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self._recorder.on_tool_error(error, **kwargs)
@@ -0,0 +1,243 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from langchain.agents import AgentExecutor, AgentType
+from langchain.agents.agent import ExceptionTool
+from langchain.agents.chat.base import ChatAgent
+from langchain.agents.chat.output_parser import ChatOutputParser
+from langchain.agents.chat.prompt import FORMAT_INSTRUCTIONS as CHAT_FORMAT_INSTRUCTIONS
+from langchain.agents.mrkl.base import ZeroShotAgent
+from langchain.agents.mrkl.output_parser import FINAL_ANSWER_ACTION, MRKLOutputParser
+from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS as MRKL_FORMAT_INSTRUCTIONS
+from langchain.agents.tools import InvalidTool
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.schema import AgentAction, AgentFinish, OutputParserException
+from langchain.tools.base import BaseTool
+
+PARALLEL_INSTRUCTIONS = (
+    "If you need several results that don't depend on each other, you may ask for them in one step. "
+    "They will be run at the same time and you will get one Observation per action, in the same order."
+)
+
+MRKL_PARALLEL_FORMAT_INSTRUCTIONS = (
+    f"{MRKL_FORMAT_INSTRUCTIONS}\n\n{PARALLEL_INSTRUCTIONS} "
+    "To do so, write several Action/Action Input pairs in a row before the Observation."
+)
+
+CHAT_PARALLEL_FORMAT_INSTRUCTIONS = CHAT_FORMAT_INSTRUCTIONS.replace(
+    "The $JSON_BLOB should only contain a SINGLE action, do NOT return a list of multiple actions.",
+    f"{PARALLEL_INSTRUCTIONS} To do so, the $JSON_BLOB can be a list of actions.",
+)
+
+# "Action: ... Action Input: ..." pairs, each input running until the next action or the end of the output
+ACTION_PATTERN = re.compile(
+    r"Action\s*\d*\s*:[\s]*(.*?)[\s]*Action\s*\d*\s*Input\s*\d*\s*:[\s]*(.*?)(?=\n\s*Action\s*\d*\s*:|$)",
+    re.DOTALL
+)
+JSON_BLOB_PATTERN = re.compile(r"```(?:json)?(.*?)```", re.DOTALL)
+
+
+def _clean_tool_input(tool_input: str) -> str:
+    # Same clean up as MRKLOutputParser
+    tool_input = tool_input.strip()
+    return tool_input if tool_input.startswith("SELECT ") else tool_input.strip('"')
+
+
+class MultiActionMRKLOutputParser(MRKLOutputParser):
+    """
+    MRKL (zero shot react) output parser that also accepts several Action/Action Input pairs in one output.
+    The first action's log holds the thought before it; the others only log their own action,
+    so the agent's scratchpad lists each action next to its own observation.
+    """
+
+    def get_format_instructions(self) -> str:
+        return MRKL_PARALLEL_FORMAT_INSTRUCTIONS
+
+    def parse(self, text: str) -> Union[AgentAction, List[AgentAction], AgentFinish]:
+        matches = list(ACTION_PATTERN.finditer(text))
+        if len(matches) < 2 or FINAL_ANSWER_ACTION in text:
+            return super().parse(text)
+
+        return [
+            AgentAction(
+                match.group(1).strip(),
+                _clean_tool_input(match.group(2)),
+                text[:match.end()] if index == 0 else f" {text[match.start():match.end()]}"
+            )
+            for index, match in enumerate(matches)
+        ]
+
+
+class MultiActionChatOutputParser(ChatOutputParser):
+    """
+    Chat zero shot react output parser that also accepts a list of actions in the JSON blob
+    (or several JSON blobs) in one output.
+    """
+
+    def get_format_instructions(self) -> str:
+        return CHAT_PARALLEL_FORMAT_INSTRUCTIONS
+
+    def parse(self, text: str) -> Union[AgentAction, List[AgentAction], AgentFinish]:
+        actions = []
+        for match in JSON_BLOB_PATTERN.finditer(text):
+            try:
+                blob = json.loads(match.group(1).strip())
+            except json.JSONDecodeError:
+                continue
+            for response in blob if isinstance(blob, list) else [blob]:
+                if isinstance(response, dict) and "action" in response and "action_input" in response:
+                    actions.append((response, match))
+
+        if len(actions) < 2:
+            return super().parse(text)
+        if FINAL_ANSWER_ACTION in text:
+            raise OutputParserException(f"Parsing LLM output produced a final answer and a parse-able action: {text}")
+
+        # Each action logs only its own blob, the first one after the thought that came before it
+        thought = text[:actions[0][1].start()]
+        return [
+            AgentAction(
+                response["action"],
+                response["action_input"],
+                (thought if index == 0 else "\nAction:\n") + f"```\n{json.dumps(response)}\n```"
+            )
+            for index, (response, _) in enumerate(actions)
+        ]
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor that runs the tool calls of one step concurrently in a thread pool, when the agent asks for
+    several at once (see the multi-action output parsers above). Observations are returned in the order the
+    actions were given. The async API already runs them concurrently.
+    """
+
+    max_workers: int = 4
+
+    def _take_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        try:
+            output = self.agent.plan(
+                intermediate_steps,
+                callbacks=run_manager.get_child() if run_manager else None,
+                **inputs,
+            )
+        except OutputParserException as e:
+            return [self._handle_parsing_error(e, run_manager)]
+
+        if isinstance(output, AgentFinish):
+            return output
+        actions = [output] if isinstance(output, AgentAction) else output
+        for agent_action in actions:
+            if run_manager:
+                run_manager.on_agent_action(agent_action, color="green")
+
+        if len(actions) == 1:
+            return [(actions[0], self._run_tool(actions[0], name_to_tool_map, color_mapping, run_manager))]
+
+        with ThreadPoolExecutor(max_workers=min(len(actions), self.max_workers), thread_name_prefix="agent-tool") as pool:
+            observations = pool.map(
+                lambda agent_action: self._run_tool(agent_action, name_to_tool_map, color_mapping, run_manager),
+                actions
+            )
+            return list(zip(actions, observations))
+
+    def _handle_parsing_error(
+        self,
+        e: OutputParserException,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Tuple[AgentAction, str]:
+        # Same handling as AgentExecutor._take_next_step, so handle_parsing_errors behaves as usual
+        if isinstance(self.handle_parsing_errors, bool):
+            if not self.handle_parsing_errors:
+                raise e
+            if e.send_to_llm:
+                observation, text = str(e.observation), str(e.llm_output)
+            else:
+                observation, text = "Invalid or incomplete response", str(e)
+        elif isinstance(self.handle_parsing_errors, str):
+            observation, text = self.handle_parsing_errors, str(e)
+        elif callable(self.handle_parsing_errors):
+            observation, text = self.handle_parsing_errors(e), str(e)
+        else:
+            raise ValueError("Got unexpected type of `handle_parsing_errors`")
+
+        output = AgentAction("_Exception", observation, text)
+        if run_manager:
+            run_manager.on_agent_action(output, color="green")
+        observation = ExceptionTool().run(
+            output.tool_input,
+            verbose=self.verbose,
+            color=None,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **self.agent.tool_run_logging_kwargs(),
+        )
+        return output, observation
+
+    def _run_tool(
+        self,
+        agent_action: AgentAction,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> str:
+        tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+        callbacks = run_manager.get_child() if run_manager else None
+        if agent_action.tool not in name_to_tool_map:
+            return InvalidTool().run(
+                agent_action.tool, verbose=self.verbose, color=None, callbacks=callbacks, **tool_run_kwargs
+            )
+
+        tool = name_to_tool_map[agent_action.tool]
+        if tool.return_direct:
+            tool_run_kwargs["llm_prefix"] = ""
+        return tool.run(
+            agent_action.tool_input,
+            verbose=self.verbose,
+            color=color_mapping[agent_action.tool],
+            callbacks=callbacks,
+            **tool_run_kwargs,
+        )
+
+
+# Agent type -> (agent class, multi-action output parser)
+PARALLEL_AGENTS = {
+    AgentType.ZERO_SHOT_REACT_DESCRIPTION: (ZeroShotAgent, MultiActionMRKLOutputParser),
+    AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION: (ChatAgent, MultiActionChatOutputParser),
+}
+
+
+def initialize_parallel_agent(
+    tools: Sequence[BaseTool],
+    llm: BaseLanguageModel,
+    agent: AgentType = AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+    max_workers: int = 4,
+    **kwargs: Any,
+) -> ParallelAgentExecutor:
+    """
+    Like langchain's initialize_agent, but the agent is told it may request several independent tool calls
+    in one step, and they are run concurrently by a ParallelAgentExecutor.
+    """
+    if agent not in PARALLEL_AGENTS:
+        raise ValueError(f"Parallel tool calls aren't supported for {agent}. Supported: {', '.join(PARALLEL_AGENTS)}")
+
+    agent_class, output_parser_class = PARALLEL_AGENTS[agent]
+    output_parser = output_parser_class()
+    agent_obj = agent_class.from_llm_and_tools(
+        llm,
+        tools,
+        output_parser=output_parser,
+        format_instructions=output_parser.get_format_instructions()
+    )
+    return ParallelAgentExecutor.from_agent_and_tools(
+        agent=agent_obj, tools=tools, max_workers=max_workers, **kwargs
+    )
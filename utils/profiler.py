@@ -0,0 +1,209 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Phases a sample can be attributed to, in report order
+PHASES = (
+    "import",
+    "construction",
+    "prompt formatting",
+    "network wait",
+    "callbacks & console",
+    "langchain glue",
+    "other",
+    "user input",
+    "waiting",
+)
+
+# Modules (by top level package) whose frames mean the thread is sending or waiting on a request
+NETWORK_PACKAGES = {"socket", "ssl", "selectors", "http", "urllib3", "requests", "aiohttp", "httpx", "serpapi"}
+# Modules rendering output or running callbacks, rather than doing the example's work
+CONSOLE_MODULES = {"utils.console_logger", "utils.custom_stream", "utils.metrics"}
+PROMPT_MODULES = {"utils.prompts", "utils.memory", "utils.session_store"}
+
+# A thread using less CPU than this fraction of the interval between samples is counted as waiting
+ON_CPU_FRACTION = 0.2
+
+
+def _frame_phase(module: str, function: str) -> Optional[str]:
+    """
+    Returns the phase a frame belongs to, or None when it doesn't decide one.
+    """
+    package = module.split(".", 1)[0]
+    if package == "importlib":
+        return "import"
+    if module == "utils.console_logger" and function.startswith("input"):
+        return "user input"
+    if package in NETWORK_PACKAGES:
+        return "network wait"
+    if module in CONSOLE_MODULES or module.startswith("langchain.callbacks"):
+        return "callbacks & console"
+    if module in PROMPT_MODULES or module.startswith(("langchain.prompts", "langchain.memory")):
+        return "prompt formatting"
+    if module == "config" or module.startswith("langchain.agents.load_tools") or function == "initialize_agent":
+        return "construction"
+    if module.startswith("examples.") and function.startswith(("build_", "load_")):
+        return "construction"
+    return None
+
+
+def classify(frames: List[Tuple[str, str]], on_cpu: bool = True) -> str:
+    """
+    Attributes a stack (root first, as (module, function) pairs) to a phase. Any stack running the import
+    system is import time, whatever module body it is running. Otherwise the frame nearest the top of the
+    stack that decides a phase wins, so e.g. a callback printing tokens while a response streams in counts as
+    console time rather than network wait. Stacks that aren't on the CPU only count as import, network or input
+    time; otherwise the thread is waiting (on a lock, another thread or a queue).
+    """
+    if any(module.startswith("importlib._bootstrap") for module, _ in frames):
+        return "import"
+    phase = None
+    for module, function in reversed(frames):
+        phase = _frame_phase(module, function)
+        if phase is not None:
+            break
+    if not on_cpu and phase not in ("import", "network wait", "user input"):
+        return "waiting"
+    if phase is not None:
+        return phase
+    if any(module.startswith("langchain") for module, _ in frames):
+        return "langchain glue"
+    return "other"
+
+
+def _thread_cpu_clock(ident: int) -> Optional[int]:
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError, OverflowError):
+        return None # Not available on this platform, so every sample counts as on the CPU
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread at a fixed interval from a background thread, without tracing each call,
+    so the examples run at close to normal speed (allocation tracking does slow them down somewhat).
+    Produces:
+    - folded stacks ("thread;module:function;... count" lines) for flamegraph.pl, speedscope or inferno
+    - a table of the time spent in each phase (see PHASES), estimated from the samples
+    - peak traced memory and the lines that allocated the most, from tracemalloc
+    """
+
+    def __init__(self, interval: float = 0.005, trace_allocations: bool = True):
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.stacks: Counter = Counter()
+        self.phases: Counter = Counter()
+        self.phase_seconds: Counter = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self.peak_memory = 0
+        self.allocations = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._cpu_clocks: Dict[int, Optional[int]] = {}
+        self._cpu_times: Dict[int, float] = {}
+
+    def start(self) -> "SamplingProfiler":
+        if self.trace_allocations:
+            tracemalloc.start()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        if self.trace_allocations:
+            _, self.peak_memory = tracemalloc.get_traced_memory()
+            self.allocations = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            tracemalloc.stop()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(ident, names.get(ident, f"thread-{ident}"), frame, now - last)
+            last = now
+
+    def _on_cpu(self, ident: int, wall: float) -> bool:
+        if ident not in self._cpu_clocks:
+            self._cpu_clocks[ident] = _thread_cpu_clock(ident)
+        clock = self._cpu_clocks[ident]
+        if clock is None:
+            return True
+        try:
+            cpu = time.clock_gettime(clock)
+        except OSError:
+            return True # The thread finished between listing & reading its clock
+        used = cpu - self._cpu_times.get(ident, cpu)
+        self._cpu_times[ident] = cpu
+        return used >= ON_CPU_FRACTION * wall
+
+    def _sample(self, ident: int, thread_name: str, frame, wall: float) -> None:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append((frame.f_globals.get("__name__", "?"), getattr(code, "co_qualname", code.co_name)))
+            frame = frame.f_back
+        frames.reverse()
+        phase = classify(frames, self._on_cpu(ident, wall))
+        self.samples += 1
+        self.phases[phase] += 1
+        self.phase_seconds[phase] += wall
+        self.stacks[";".join([thread_name] + [f"{module}:{function}" for module, function in frames])] += 1
+
+    def write_folded(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def report(self) -> str:
+        """
+        Returns the phase table, followed by memory use when allocations were tracked.
+        Phase times add up across threads, so they can exceed the wall time of the run.
+        """
+        total = sum(self.phase_seconds.values()) or 1.0
+        lines = [
+            f"Profiled {self.elapsed:.2f}s: {self.samples} thread samples every {self.interval * 1000:g}ms",
+            f"{'phase':<22}{'samples':>9}{'seconds':>10}{'share':>8}",
+        ]
+        for phase in PHASES:
+            if self.phases.get(phase):
+                seconds = self.phase_seconds[phase]
+                lines.append(f"{phase:<22}{self.phases[phase]:>9}{seconds:>10.2f}{seconds / total:>8.1%}")
+        if self.trace_allocations:
+            lines.append(f"Peak traced memory: {self.peak_memory / 1_000_000:.1f} MB; largest allocation sites:")
+            for statistic in self.allocations[:5]:
+                frame = statistic.traceback[0]
+                lines.append(f"  {statistic.size / 1_000_000:>7.2f} MB  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def profiled(folded_path: Optional[str], interval: float = 0.005):
+    """
+    Profiles the block when folded_path is given, writing the folded stacks there on exit.
+    Yields the profiler (or None), whose report() summarizes the run.
+    """
+    if not folded_path:
+        yield None
+        return
+
+    profiler = SamplingProfiler(interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write_folded(folded_path)
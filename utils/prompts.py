@@ -0,0 +1,103 @@
+from string import Formatter
+from typing import Any, List, Optional, Tuple
+
+from pydantic import PrivateAttr
+
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from langchain.prompts.chat import BaseMessagePromptTemplate, ChatPromptValue
+from langchain.schema import BaseMessage, PromptValue, get_buffer_string
+
+from utils.memory import RenderedHistory
+
+
+class CompiledPromptTemplate(PromptTemplate):
+    """
+    PromptTemplate that parses its f-string template once, when it is built, instead of on every format.
+    The last formatted prompt is remembered, so formatting it for logging and then running it through
+    a chain with the same inputs only builds the string once.
+    """
+
+    # (literal text, variable name or None) pairs, in template order
+    _segments: List[Tuple[str, Optional[str]]] = PrivateAttr(default_factory=list)
+    _fields: frozenset = PrivateAttr(default=frozenset())
+    # (inputs, formatted prompt) of the last format call, replaced as a single tuple so threads can share it
+    _last: Optional[Tuple[tuple, str]] = PrivateAttr(default=None)
+
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        if self.template_format != "f-string":
+            raise ValueError("CompiledPromptTemplate only supports f-string templates")
+
+        for literal, field, format_spec, conversion in Formatter().parse(self.template):
+            if field is not None and (format_spec or conversion or not field.isidentifier()):
+                # Attribute access, indexing or format specs are left to the regular formatter
+                self._segments = None
+                return
+            self._segments.append((literal, field))
+        self._fields = frozenset(field for _, field in self._segments if field is not None)
+
+    def format(self, **kwargs: Any) -> str:
+        if self._segments is None:
+            return super().format(**kwargs)
+
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        extra = kwargs.keys() - self._fields
+        if extra:
+            raise KeyError(extra)
+        key = tuple(sorted(kwargs.items()))
+        last = self._last
+        if last is not None and last[0] == key:
+            return last[1]
+
+        text = "".join(
+            literal if field is None else literal + format(kwargs[field])
+            for literal, field in self._segments
+        )
+        self._last = (key, text)
+        return text
+
+
+class RenderedChatPromptValue(ChatPromptValue):
+    """
+    ChatPromptValue that already has its text, used when the prompt is sent to a completion LLM.
+    """
+
+    text: str
+
+    def to_string(self) -> str:
+        return self.text
+
+
+class IncrementalChatPromptTemplate(ChatPromptTemplate):
+    """
+    ChatPromptTemplate that uses the text of a RenderedHistory (see IncrementalBufferMemory) as is,
+    instead of rendering every message of the history again when the prompt is sent to a completion LLM.
+    Only the other messages (e.g. the system message and the new input) are rendered on each format.
+    The history isn't validated again either, as its messages were checked when they were saved.
+    """
+
+    def format_prompt(self, **kwargs: Any) -> PromptValue:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        messages, parts = [], []
+        for message_template in self.messages:
+            value = kwargs.get(message_template.variable_name) if isinstance(message_template, MessagesPlaceholder) else None
+            if isinstance(value, RenderedHistory):
+                messages.extend(value)
+                if value:
+                    parts.append(value.text)
+                continue
+
+            if isinstance(message_template, BaseMessage):
+                formatted = [message_template]
+            elif isinstance(message_template, BaseMessagePromptTemplate):
+                formatted = message_template.format_messages(
+                    **{k: v for k, v in kwargs.items() if k in message_template.input_variables}
+                )
+            else:
+                raise ValueError(f"Unexpected input: {message_template}")
+            messages.extend(formatted)
+            if formatted:
+                parts.append(get_buffer_string(formatted))
+
+        # construct skips pydantic validation, which would copy every message of the history
+        return RenderedChatPromptValue.construct(messages=messages, text="\n".join(parts))
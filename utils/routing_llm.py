@@ -0,0 +1,297 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Mapping, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.llms.base import LLM, BaseLLM
+from pydantic import Field
+
+from utils.llm_cache import REPLAY_TOKEN_PATTERN
+
+# Rough prompt size estimate, so routing doesn't need each backend's tokenizer
+CHARS_PER_TOKEN = 4
+
+
+class AttemptCancelled(Exception):
+    """
+    Raised from a losing backend's token callback to stop its stream.
+    """
+
+
+class LatencyWindow:
+    """
+    The most recent time-to-first-token samples of one backend, with quantiles over them.
+    """
+
+    def __init__(self, size: int = 50, min_samples: int = 5):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """
+        Returns the sample at `fraction` (0-1), or None until there are min_samples of them.
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Race:
+    """
+    One routed call. The first backend to produce a token (or its whole response, if it doesn't stream) wins;
+    only the winner's tokens reach the run manager, and the others are stopped at their next token.
+    """
+
+    def __init__(self, windows: Dict[str, LatencyWindow]):
+        self.windows = windows
+        self.winner: Optional[str] = None
+        self.forwarded = 0
+        self.started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def start(self, name: str) -> None:
+        with self._lock:
+            self.started[name] = time.perf_counter()
+
+    def claim(self, name: str) -> bool:
+        """
+        Returns whether `name` is the winner, making it the winner if there isn't one yet.
+        """
+        with self._lock:
+            if self.winner is None:
+                self.winner = name
+                now = time.perf_counter()
+                for other, started in self.started.items():
+                    # Backends that started earlier but lost are at least this slow, so that's recorded too
+                    if started <= self.started[name]:
+                        self.windows[other].observe(now - started)
+            return self.winner == name
+
+
+class _RaceForwarder(BaseCallbackHandler):
+    """
+    Forwards the winner's tokens to the router's run manager and stops the losers' streams.
+    """
+
+    raise_error = True
+
+    def __init__(self, race: _Race, name: str, run_manager: Optional[CallbackManagerForLLMRun]):
+        self.race = race
+        self.name = name
+        self.run_manager = run_manager
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self.race.claim(self.name):
+            raise AttemptCancelled(f"{self.name} lost to {self.race.winner}")
+        self.race.forwarded += 1
+        if self.run_manager:
+            self.run_manager.on_llm_new_token(token)
+
+
+class _AsyncRaceForwarder(AsyncCallbackHandler):
+    """
+    Async counterpart of _RaceForwarder.
+    """
+
+    raise_error = True
+
+    def __init__(self, race: _Race, name: str, run_manager: Optional[AsyncCallbackManagerForLLMRun]):
+        self.race = race
+        self.name = name
+        self.run_manager = run_manager
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self.race.claim(self.name):
+            raise AttemptCancelled(f"{self.name} lost to {self.race.winner}")
+        self.race.forwarded += 1
+        if self.run_manager:
+            await self.run_manager.on_llm_new_token(token)
+
+
+class RoutingLLM(LLM):
+    """
+    Sends each prompt to one of several backend LLMs, picked by prompt size and recent latency:
+    - Backends whose max_prompt_tokens is below the (estimated) prompt size are skipped
+    - The rest are tried in order of their median time to first token over the last `window_size` calls,
+      with backends that have too few samples first so every backend gets measured
+    - With `hedge`, if the primary hasn't produced a token after its recent p95 time to first token
+      (`hedge_delay` until there are enough samples), the next backend is sent the same prompt.
+      Whichever answers first is used and the other is cancelled. Sync calls can't interrupt a request
+      that is still waiting for its first byte, so a losing sync backend runs on in the background
+      and its result is discarded
+    - A backend failing before the first token falls over to the next one straight away
+    Like WrappedLLM, the backends should be built without console callbacks; the router streams the
+    winner's tokens through its own.
+    """
+
+    backends: Dict[str, BaseLLM]
+    max_prompt_tokens: Dict[str, int] = Field(default_factory=dict)
+    hedge: bool = True
+    hedge_quantile: float = 0.95
+    hedge_delay: float = 2.0 # seconds
+    window_size: int = 50
+    windows: Dict[str, LatencyWindow] = Field(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "routing"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"backends": {name: llm._identifying_params for name, llm in self.backends.items()}}
+
+    def window(self, name: str) -> LatencyWindow:
+        return self.windows.setdefault(name, LatencyWindow(self.window_size))
+
+    def route(self, prompt: str) -> List[str]:
+        """
+        Returns the backend names to try for this prompt, primary first.
+        """
+        prompt_tokens = len(prompt) / CHARS_PER_TOKEN
+        names = [
+            name for name in self.backends
+            if prompt_tokens <= self.max_prompt_tokens.get(name, float("inf"))
+        ]
+        if not names:
+            # Nothing fits, so the backend accepting the longest prompts gets to try
+            names = [max(self.backends, key=lambda name: self.max_prompt_tokens.get(name, float("inf")))]
+        return sorted(names, key=lambda name: self.window(name).quantile(0.5) or 0.0)
+
+    def hedge_after(self, name: str) -> float:
+        """
+        Seconds to wait for the first token from `name` before hedging.
+        """
+        delay = self.window(name).quantile(self.hedge_quantile)
+        return self.hedge_delay if delay is None else delay
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        pending = self.route(prompt)
+        race = _Race({name: self.window(name) for name in pending})
+        events = queue.Queue()
+
+        def attempt(name):
+            try:
+                result = self.backends[name].generate(
+                    [prompt], stop=stop, callbacks=[_RaceForwarder(race, name, run_manager)], **kwargs
+                )
+                events.put((name, result.generations[0][0].text, None))
+            except BaseException as error:
+                events.put((name, None, error))
+
+        def start(name):
+            race.start(name)
+            threading.Thread(target=attempt, args=(name,), daemon=True, name=f"routing-{name}").start()
+            return time.perf_counter() + self.hedge_after(name)
+
+        hedge_at = start(pending.pop(0))
+        running = 1
+        while True:
+            timeout = None
+            if self.hedge and pending and race.winner is None:
+                timeout = max(0.0, hedge_at - time.perf_counter())
+            try:
+                name, text, error = events.get(timeout=timeout)
+            except queue.Empty:
+                hedge_at = start(pending.pop(0))
+                running += 1
+                continue
+
+            running -= 1
+            if error is None and race.claim(name):
+                return self._finish(race, text, run_manager)
+            if race.winner == name:
+                raise error # Failed after streaming part of the response, so it can't be retried elsewhere
+            if race.winner is None:
+                if pending:
+                    hedge_at = start(pending.pop(0))
+                    running += 1
+                elif not running:
+                    raise error
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        pending = self.route(prompt)
+        race = _Race({name: self.window(name) for name in pending})
+        tasks: Dict[asyncio.Task, str] = {}
+
+        async def attempt(name):
+            result = await self.backends[name].agenerate(
+                [prompt], stop=stop, callbacks=[_AsyncRaceForwarder(race, name, run_manager)], **kwargs
+            )
+            return result.generations[0][0].text
+
+        def start(name):
+            race.start(name)
+            tasks[asyncio.create_task(attempt(name))] = name
+            return time.perf_counter() + self.hedge_after(name)
+
+        hedge_at = start(pending.pop(0))
+        try:
+            while True:
+                timeout = None
+                if self.hedge and pending and race.winner is None:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = start(pending.pop(0))
+                    continue
+
+                for task in done:
+                    name = tasks.pop(task)
+                    error = task.exception()
+                    if error is None and race.claim(name):
+                        return await self._afinish(race, task.result(), run_manager)
+                    if race.winner == name:
+                        raise error
+                    if race.winner is None:
+                        if pending:
+                            hedge_at = start(pending.pop(0))
+                        elif not tasks:
+                            raise error
+        finally:
+            # Losers (and every attempt, if this call was cancelled) are cancelled rather than left running
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _finish(race: _Race, text: str, run_manager: Optional[CallbackManagerForLLMRun]) -> str:
+        # A backend that doesn't stream wins with its whole response, which is then replayed as tokens
+        if run_manager and not race.forwarded:
+            for token in REPLAY_TOKEN_PATTERN.findall(text):
+                run_manager.on_llm_new_token(token)
+        return text
+
+    @staticmethod
+    async def _afinish(race: _Race, text: str, run_manager: Optional[AsyncCallbackManagerForLLMRun]) -> str:
+        if run_manager and not race.forwarded:
+            for token in REPLAY_TOKEN_PATTERN.findall(text):
+                await run_manager.on_llm_new_token(token)
+        return text
@@ -0,0 +1,118 @@
+import hashlib
+import re
+import threading
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Punctuation & repeated whitespace are dropped before embedding, so "Why?!" and "why" embed the same
+NORMALIZE_PATTERN = re.compile(r"[^\w]+")
+
+
+class HashedNgramEmbedder:
+    """
+    Local, network-free text embedding: character n-grams hashed into a fixed-size vector, L2 normalized.
+    Texts that share most of their n-grams (rewordings, typos, extra punctuation) get a high cosine similarity.
+    crc32 is used instead of hash() so vectors are the same in every process.
+    """
+
+    def __init__(self, dimensions: int = 2048, ngram_sizes: Tuple[int, ...] = (3, 4, 5)):
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    def embed(self, text: str) -> np.ndarray:
+        text = f" {NORMALIZE_PATTERN.sub(' ', text.lower()).strip()} "
+        hashes = np.fromiter(
+            (
+                zlib.crc32(text[start:start + size].encode("utf-8"))
+                for size in self.ngram_sizes
+                for start in range(len(text) - size + 1)
+            ),
+            dtype=np.uint32
+        )
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        if hashes.size:
+            # The top bit picks the sign, so unrelated n-grams sharing a bucket tend to cancel out
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dimensions, signs)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        return vector
+
+
+def context_key(context: str) -> int:
+    return int.from_bytes(hashlib.sha256(context.encode("utf-8")).digest()[:8], "little", signed=True)
+
+
+class SemanticCache:
+    """
+    Response cache for near-duplicate prompts. Prompt embeddings are kept in one preallocated matrix,
+    so a lookup is a single matrix-vector product. A lookup hits when the most similar stored prompt with the
+    same `context` (e.g. the session & the conversation so far, which must match exactly) has a cosine
+    similarity of at least `threshold`. Past `capacity` entries the least recently used is replaced.
+    """
+
+    def __init__(self, embedder: HashedNgramEmbedder = None, threshold: float = 0.9, capacity: int = 1000):
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.threshold = threshold
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((capacity, self.embedder.dimensions), dtype=np.float32)
+        self._responses = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._contexts = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def lookup(self, prompt: str, context: str = "") -> Optional[Tuple[str, float]]:
+        """
+        Returns (response, similarity) for the most similar cached prompt in the context, or None below the threshold.
+        """
+        vector = self.embedder.embed(prompt)
+        key = context_key(context)
+        with self._lock:
+            if self._size:
+                similarities = np.where(self._contexts[:self._size] == key, self._vectors[:self._size] @ vector, -1.0)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._clock += 1
+                    self._last_used[best] = self._clock
+                    self.hits += 1
+                    return self._responses[best], float(similarities[best])
+            self.misses += 1
+            return None
+
+    def update(self, prompt: str, response: str, context: str = "") -> None:
+        """
+        Stores a response for the context, replacing the least recently used entry when the cache is full.
+        """
+        vector = self.embedder.embed(prompt)
+        with self._lock:
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._clock += 1
+            self._vectors[slot] = vector
+            self._responses[slot] = response
+            self._last_used[slot] = self._clock
+            self._contexts[slot] = context_key(context)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._size = 0
+            self._responses = [None] * self.capacity
+            self._last_used[:] = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": self._size}
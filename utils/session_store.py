@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import struct
+import threading
+from typing import Any, Dict, List, Tuple
+
+from pydantic import PrivateAttr
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import BaseMessage, get_buffer_string
+
+from utils.console_logger import ConsoleLogger
+
+# Byte offset of a turn in the log, stored as a fixed-size little-endian integer in the index file
+OFFSET = struct.Struct("<Q")
+
+SESSION_ID_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+class SessionLog:
+    """
+    Append-only on-disk log of the turns in one chat session.
+    Each turn is one JSON line in `<session_id>.jsonl`, and the byte offset of every line is kept in
+    `<session_id>.idx`, so the last N turns can be read without parsing the rest of the log.
+    """
+
+    def __init__(self, directory: str, session_id: str):
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id '{session_id}'. Use letters, numbers, '.', '_' or '-'.")
+
+        os.makedirs(directory, exist_ok=True)
+        self.session_id = session_id
+        self.log_path = os.path.join(directory, f"{session_id}.jsonl")
+        self.index_path = os.path.join(directory, f"{session_id}.idx")
+
+        self._lock = threading.Lock()
+        self._log = open(self.log_path, "a+b")
+        self._index = open(self.index_path, "a+b")
+        self._recover()
+
+    def _recover(self):
+        # A crash can leave a partial index entry, or a turn written to the log but not indexed yet.
+        # Both are dropped so the log and index agree again.
+        index_size = os.fstat(self._index.fileno()).st_size
+        self._turns = index_size // OFFSET.size
+        if index_size % OFFSET.size:
+            self._index.truncate(self._turns * OFFSET.size)
+
+        log_end = 0
+        if self._turns:
+            self._log.seek(self._offset(self._turns - 1))
+            line = self._log.readline()
+            log_end = self._log.tell() if line.endswith(b"\n") else None
+            if log_end is None:
+                # The last indexed turn itself is incomplete
+                self._turns -= 1
+                self._index.truncate(self._turns * OFFSET.size)
+                log_end = self._offset(self._turns) if self._turns else 0
+        if os.fstat(self._log.fileno()).st_size != log_end:
+            self._log.truncate(log_end)
+
+    def _offset(self, turn: int) -> int:
+        self._index.seek(turn * OFFSET.size)
+        return OFFSET.unpack(self._index.read(OFFSET.size))[0]
+
+    def __len__(self) -> int:
+        return self._turns
+
+    def append(self, human: str, ai: str) -> None:
+        """
+        Appends a turn. The turn is a single write to the log followed by a single write to the index.
+        """
+        line = json.dumps({"human": human, "ai": ai}, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            self._log.seek(0, os.SEEK_END)
+            offset = self._log.tell()
+            self._log.write(line)
+            self._log.flush()
+            self._index.write(OFFSET.pack(offset))
+            self._index.flush()
+            self._turns += 1
+
+    def tail(self, turns: int) -> List[Tuple[str, str]]:
+        """
+        Returns the last `turns` (human, ai) pairs, reading only that part of the log.
+        """
+        with self._lock:
+            first = max(0, self._turns - turns)
+            if first == self._turns:
+                return []
+            self._log.seek(self._offset(first))
+            data = self._log.read()
+        return [
+            (turn["human"], turn["ai"])
+            for turn in map(json.loads, data.splitlines())
+        ]
+
+    def close(self) -> None:
+        self._log.close()
+        self._index.close()
+
+
+class SessionMemory(BaseChatMemory):
+    """
+    Conversation memory backed by a SessionLog. Only the last `k` turns are loaded & kept in memory,
+    so resuming a long session is as fast as resuming a short one. Each saved turn is appended to the log,
+    by the `writer` executor when one is given (e.g. so an event loop doesn't wait on the disk).
+    A single-thread writer keeps each session's turns in order.
+    """
+
+    session_log: SessionLog
+    writer: Any = None
+    k: int = 20
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    memory_key: str = "history"
+
+    _loaded: bool = PrivateAttr(default=False)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        if not self._loaded:
+            for human, ai in self.session_log.tail(self.k):
+                self.chat_memory.add_user_message(human)
+                self.chat_memory.add_ai_message(ai)
+            self._loaded = True
+        return self.chat_memory.messages
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the last k turns of the session.
+        """
+        if self.return_messages:
+            return {self.memory_key: self.buffer}
+        return {
+            self.memory_key: get_buffer_string(
+                self.buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        }
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """
+        Appends the turn to the session log and drops turns older than the last k from memory.
+        """
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        if self.writer is None:
+            self.session_log.append(input_str, output_str)
+        else:
+            self.writer.submit(self.session_log.append, input_str, output_str).add_done_callback(self._log_append_error)
+
+        messages = self.buffer
+        self.chat_memory.add_user_message(input_str)
+        self.chat_memory.add_ai_message(output_str)
+        del messages[:max(0, len(messages) - 2 * self.k)]
+
+    def _log_append_error(self, future) -> None:
+        if future.exception() is not None:
+            ConsoleLogger.log_error(f"Couldn't save a turn of session '{self.session_log.session_id}': {future.exception()}")
+
+    def clear(self) -> None:
+        """
+        Clears the in-memory window. The session log itself is append-only and is kept.
+        """
+        super().clear()
+        self._loaded = True
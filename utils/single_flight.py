@@ -0,0 +1,365 @@
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, List, Mapping, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import BaseMessage, ChatResult, LLMResult
+from pydantic import Field
+
+from utils.wrapped_llm import WrappedLLM
+
+
+def flight_key(model_string: str, request: str) -> str:
+    """
+    Identifies a request by the model id & parameters and the fully formatted prompt (or messages).
+    """
+    return hashlib.sha256(f"{model_string}\0{request}".encode("utf-8")).hexdigest()
+
+
+class _FlightAbandoned(Exception):
+    """
+    Stops an upstream call once every caller's callbacks have stopped their stream, since nobody wants the rest.
+    A caller that joined too late to see that starts its own request.
+    """
+
+
+class _Subscriber:
+    """
+    One caller of a flight: its run manager (None when it isn't streaming), and the error its callbacks raised.
+    """
+
+    def __init__(self, run_manager):
+        self.run_manager = run_manager
+        self.error: Optional[BaseException] = None
+
+
+class _Flight:
+    """
+    One upstream call shared by every caller that asked for the same request while it was running.
+    Tokens are kept as they arrive, so a caller joining mid-stream is replayed what it missed before
+    it receives the rest live. A caller whose callbacks raise (e.g. its stream guard firing) is dropped
+    and gets that error straight away; the others carry on.
+    """
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.subscribers: List[_Subscriber] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.condition = threading.Condition()
+
+    def subscribe(self, run_manager: Optional[CallbackManagerForLLMRun]) -> _Subscriber:
+        subscriber = _Subscriber(run_manager)
+        # Replaying & subscribing under the lock keeps the joiner's stream in order
+        with self.condition:
+            self.subscribers.append(subscriber)
+            for token in self.tokens:
+                if not self._send(subscriber, token):
+                    break
+        return subscriber
+
+    def _send(self, subscriber: _Subscriber, token: str) -> bool:
+        # Called with the condition held
+        if subscriber.run_manager is None:
+            return True
+        try:
+            subscriber.run_manager.on_llm_new_token(token)
+            return True
+        except Exception as error:
+            subscriber.error = error
+            self.subscribers.remove(subscriber)
+            self.condition.notify_all()
+            return False
+
+    def publish(self, token: str) -> None:
+        with self.condition:
+            self.tokens.append(token)
+            for subscriber in list(self.subscribers):
+                self._send(subscriber, token)
+            if not self.subscribers:
+                raise _FlightAbandoned()
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self.condition:
+            self.result, self.error, self.done = result, error, True
+            self.condition.notify_all()
+
+    def wait(self, subscriber: _Subscriber) -> Any:
+        with self.condition:
+            self.condition.wait_for(lambda: self.done or subscriber.error is not None)
+        if subscriber.error is not None:
+            raise subscriber.error
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _AsyncFlight:
+    """
+    Async counterpart of _Flight. The upstream call runs as its own task, so a caller being cancelled
+    (or dropped by its callbacks) doesn't cancel it for the others; it is only cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.subscribers: List[_Subscriber] = []
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def subscribe(self, run_manager: Optional[AsyncCallbackManagerForLLMRun]) -> _Subscriber:
+        subscriber = _Subscriber(run_manager)
+        subscriber.stopped = asyncio.Event()
+        self.waiters += 1
+        sent = 0
+        # Tokens may arrive while the missed ones are replayed, so this catches up before subscribing
+        while sent < len(self.tokens):
+            if not await self._send(subscriber, self.tokens[sent]):
+                return subscriber
+            sent += 1
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    async def _send(self, subscriber: _Subscriber, token: str) -> bool:
+        if subscriber.run_manager is None:
+            return True
+        try:
+            await subscriber.run_manager.on_llm_new_token(token)
+            return True
+        except Exception as error:
+            subscriber.error = error
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            subscriber.stopped.set()
+            return False
+
+    async def publish(self, token: str) -> None:
+        # Callers subscribing during the loop have replayed this token already, so they're left out
+        self.tokens.append(token)
+        for subscriber in list(self.subscribers):
+            await self._send(subscriber, token)
+
+    def _leave(self) -> None:
+        self.waiters -= 1
+        if not self.waiters:
+            self.task.cancel()
+
+    async def wait(self, subscriber: _Subscriber) -> Any:
+        stopped = asyncio.ensure_future(subscriber.stopped.wait())
+        try:
+            # Waiting doesn't cancel the task when this caller is cancelled, like asyncio.shield
+            await asyncio.wait({self.task, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self._leave()
+            raise
+        finally:
+            stopped.cancel()
+        if subscriber.error is not None:
+            self._leave()
+            raise subscriber.error
+        if self.task.cancelled():
+            raise _FlightAbandoned()
+        return self.task.result()
+
+
+class _FlightForwarder(BaseCallbackHandler):
+    """
+    Fans tokens streamed by the upstream call out to every caller of the flight.
+    An error raised by a caller's callbacks (e.g. a stream guard firing) only stops that caller's stream;
+    the upstream call is stopped once every caller has been stopped.
+    """
+
+    raise_error = True
+
+    def __init__(self, flight: _Flight):
+        self.flight = flight
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.flight.publish(token)
+
+
+class _AsyncFlightForwarder(AsyncCallbackHandler):
+    """
+    Async counterpart of _FlightForwarder.
+    """
+
+    raise_error = True
+
+    def __init__(self, flight: _AsyncFlight):
+        self.flight = flight
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        await self.flight.publish(token)
+
+
+class SingleFlight:
+    """
+    In-flight requests by key. The first caller of a key runs the request; callers asking for the same key
+    before it finishes wait for its result instead of sending their own, and receive its streamed tokens.
+    Finished requests are forgotten straight away, so this never serves stale results (that's the cache's job).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, _AsyncFlight] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, run_manager: Optional[CallbackManagerForLLMRun], request) -> Any:
+        """
+        Returns the result of `request(callbacks)`, or of the identical request already running.
+        `request` gets the callbacks that fan its tokens out to every caller.
+        """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+        subscriber = flight.subscribe(run_manager)
+        if not leader:
+            try:
+                return flight.wait(subscriber)
+            except _FlightAbandoned:
+                return self.run(key, run_manager, request)
+
+        try:
+            flight.finish(result=request([_FlightForwarder(flight)]))
+        except BaseException as error:
+            flight.finish(error=error)
+        finally:
+            with self._lock:
+                self._forget(self._flights, key, flight)
+        return flight.wait(subscriber)
+
+    async def arun(self, key: str, run_manager: Optional[AsyncCallbackManagerForLLMRun], request) -> Any:
+        """
+        Async version of run; `request(callbacks)` returns an awaitable.
+        """
+        # Async flights live on one event loop, so they need no lock
+        self.calls += 1
+        flight = self._async_flights.get(key)
+        if flight is None or flight.task.done():
+            flight = self._async_flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(request([_AsyncFlightForwarder(flight)]))
+            flight.task.add_done_callback(lambda _, flight=flight: self._forget(self._async_flights, key, flight))
+        else:
+            self.shared += 1
+        subscriber = await flight.subscribe(run_manager)
+        try:
+            return await flight.wait(subscriber)
+        except _FlightAbandoned:
+            return await self.arun(key, run_manager, request)
+
+    @staticmethod
+    def _forget(flights: Dict[str, Any], key: str, flight) -> None:
+        # Done callbacks run a loop iteration later, when a newer flight may already have the key
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stats(self) -> dict:
+        """
+        Returns how many calls were made and how many of them shared another caller's request.
+        """
+        return {"calls": self.calls, "shared": self.shared}
+
+
+class SingleFlightLLM(WrappedLLM):
+    """
+    LLM wrapper that sends concurrent identical requests (same model, parameters, stop words & prompts)
+    upstream once. Every caller gets the response, and with streaming each caller's callbacks
+    (e.g. CustomStreamCallback) receive the whole token stream, replayed from the start for late joiners.
+    A request with several prompts is shared with callers sending the same prompts.
+    """
+
+    flights: SingleFlight = Field(default_factory=SingleFlight)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        def request(callbacks):
+            return self.llm.generate(prompts, stop=stop, callbacks=callbacks, **kwargs)
+
+        result = self.flights.run(flight_key(self.llm_string(stop, **kwargs), "\0".join(prompts)), run_manager, request)
+        # Each caller gets its own result, since LangChain sets the caller's run on it
+        return LLMResult(generations=result.generations, llm_output=result.llm_output)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        async def request(callbacks):
+            return await self.llm.agenerate(prompts, stop=stop, callbacks=callbacks, **kwargs)
+
+        result = await self.flights.arun(flight_key(self.llm_string(stop, **kwargs), "\0".join(prompts)), run_manager, request)
+        return LLMResult(generations=result.generations, llm_output=result.llm_output)
+
+
+class SingleFlightChatModel(BaseChatModel):
+    """
+    Chat model counterpart of SingleFlightLLM, for identical message lists.
+    Like WrappedLLM, the wrapped chat model should be built without callbacks.
+    """
+
+    chat: BaseChatModel
+    flights: SingleFlight = Field(default_factory=SingleFlight)
+
+    @property
+    def _llm_type(self) -> str:
+        return self.chat._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.chat._identifying_params
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.chat.get_num_tokens(text)
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        params = self.chat.dict()
+        params.update(kwargs)
+        params["stop"] = stop
+        request = "\0".join(f"{message.type}:{message.content}" for message in messages)
+        return flight_key(str(sorted(params.items())), request)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        def request(callbacks):
+            result = self.chat.generate([messages], stop=stop, callbacks=callbacks, **kwargs)
+            return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+        return self.flights.run(self._key(messages, stop, kwargs), run_manager, request)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        async def request(callbacks):
+            result = await self.chat.agenerate([messages], stop=stop, callbacks=callbacks, **kwargs)
+            return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+        return await self.flights.arun(self._key(messages, stop, kwargs), run_manager, request)
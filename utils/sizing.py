@@ -0,0 +1,306 @@
+import asyncio
+import math
+import threading
+import warnings
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.prompts.chat import ChatPromptValue
+from langchain.schema import (
+    BaseMessage,
+    ChatResult,
+    LLMResult,
+    PromptValue,
+    SystemMessage,
+    get_buffer_string,
+)
+
+from utils.wrapped_llm import AsyncTokenForwarder, TokenForwarder, WrappedLLM, combine_results, copy_model
+
+try:
+    import tiktoken
+except ImportError: # Optional, token counts are estimated without it
+    tiktoken = None
+
+# Context window (prompt + response tokens) per model, for models that don't report one
+CONTEXT_LIMITS = {
+    "text-davinci-003": 4097,
+    "text-davinci-002": 4097,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+DEFAULT_CONTEXT_LIMIT = 4096
+
+# Without tiktoken, English text averages about 4 characters per token; a little less is assumed so
+# estimates err on the high side and requests stay within the context
+HEURISTIC_CHARS_PER_TOKEN = 3.6
+# Tokens added around each chat message by the chat completion format
+TOKENS_PER_MESSAGE = 4
+
+
+class TokenEstimator:
+    """
+    Counts tokens with the model's tiktoken encoding when tiktoken is installed, otherwise estimates them
+    from the text length. Encodings are loaded once per model, the first time a count is needed; when one
+    can't be loaded (e.g. tiktoken can't download it offline) the length estimate is used instead.
+    """
+
+    _encodings: Dict[str, Any] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._encoding = None
+        self._loaded = tiktoken is None
+
+    @property
+    def encoding(self):
+        if not self._loaded:
+            self._encoding = self._load_encoding(self.model_name)
+            self._loaded = True
+        return self._encoding
+
+    @classmethod
+    def _load_encoding(cls, model_name: str):
+        with cls._lock:
+            if model_name not in cls._encodings:
+                try:
+                    try:
+                        cls._encodings[model_name] = tiktoken.encoding_for_model(model_name)
+                    except KeyError:
+                        cls._encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+                except Exception as error:
+                    warnings.warn(f"Couldn't load the tiktoken encoding for {model_name} ({error!r}), estimating tokens from text length")
+                    cls._encodings[model_name] = None
+            return cls._encodings[model_name]
+
+    def count(self, text: str) -> int:
+        encoding = self.encoding
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / HEURISTIC_CHARS_PER_TOKEN)
+
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(get_buffer_string([message])) + TOKENS_PER_MESSAGE for message in messages) + 3
+
+
+class RequestSizer:
+    """
+    Sizes each request to a model with a fixed context window:
+    - max_tokens comes from the policy of the chain making the call (`policies[policy]`, else `policies["default"]`)
+    - it is lowered when the prompt leaves less room than that in the context
+    - when the prompt doesn't leave room for the policy's max_tokens, the oldest history is dropped:
+      chat messages after the leading system messages, or for text prompts, lines after the first paragraph
+      (the instructions). The last message or line is always kept
+
+    Tokens are counted with a TokenEstimator for the model, unless another `estimator` (with the same
+    count & count_messages methods) is given.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        context_limit: int,
+        policies: Dict[str, int],
+        min_tokens: int = 16,
+        estimator: Optional[Any] = None,
+    ):
+        self.estimator = estimator if estimator is not None else TokenEstimator(model_name)
+        self.context_limit = context_limit
+        self.policies = policies
+        self.min_tokens = min_tokens
+
+    def policy_tokens(self, policy: str, tags: Optional[List[str]] = None) -> int:
+        """
+        max_tokens wanted by the policy; the last run tag naming a policy takes precedence.
+        """
+        for tag in reversed(tags or []):
+            if tag in self.policies:
+                return self.policies[tag]
+        return self.policies.get(policy, self.policies["default"])
+
+    def max_tokens(self, prompt_tokens: int, wanted: int) -> int:
+        return max(self.min_tokens, min(wanted, self.context_limit - prompt_tokens))
+
+    def fit_messages(self, messages: List[BaseMessage], wanted: int) -> List[BaseMessage]:
+        budget = self.context_limit - wanted
+        counts = [self.estimator.count(get_buffer_string([message])) + TOKENS_PER_MESSAGE for message in messages]
+        total = sum(counts) + 3
+        if total <= budget:
+            return messages
+
+        first = 0
+        while first < len(messages) - 1 and isinstance(messages[first], SystemMessage):
+            first += 1
+        drop = first
+        while total > budget and drop < len(messages) - 1:
+            total -= counts[drop]
+            drop += 1
+        return messages[:first] + messages[drop:]
+
+    def fit_text(self, text: str, wanted: int) -> str:
+        budget = self.context_limit - wanted
+        if self.estimator.count(text) <= budget:
+            return text
+
+        head, separator, body = text.partition("\n\n")
+        if not separator:
+            head, body = "", text
+        lines = body.split("\n")
+        counts = [self.estimator.count(line) + 1 for line in lines]
+        total = self.estimator.count(head) + sum(counts)
+        drop = 0
+        while total > budget and drop < len(lines) - 1:
+            total -= counts[drop]
+            drop += 1
+        return head + separator + "\n".join(lines[drop:])
+
+
+def _run_tags(run_manager) -> List[str]:
+    return getattr(run_manager, "tags", None) or []
+
+
+class SizedLLM(WrappedLLM):
+    """
+    LLM wrapper that sets max_tokens on every request from a RequestSizer, and drops the oldest history
+    from prompts that wouldn't leave room for the response. Chat prompts (e.g. from interactive_chat.py)
+    are trimmed message by message before they are turned into text.
+    A max_tokens passed by the caller is left as is. Several prompts are sent in one request per max_tokens
+    they need (usually one).
+    """
+
+    sizer: Any
+    policy: str = "default"
+    max_tokens_param: str = "max_tokens"
+
+    def generate_prompt(self, prompts: List[PromptValue], stop=None, callbacks=None, **kwargs: Any):
+        return super().generate_prompt(self._fit_prompts(prompts, callbacks), stop=stop, callbacks=callbacks, **kwargs)
+
+    async def agenerate_prompt(self, prompts: List[PromptValue], stop=None, callbacks=None, **kwargs: Any):
+        return await super().agenerate_prompt(self._fit_prompts(prompts, callbacks), stop=stop, callbacks=callbacks, **kwargs)
+
+    def _fit_prompts(self, prompts: List[PromptValue], callbacks) -> List[PromptValue]:
+        wanted = self.sizer.policy_tokens(self.policy, _run_tags(callbacks))
+        budget = self.sizer.context_limit - wanted
+        fitted = []
+        for prompt in prompts:
+            # The whole text is counted first, so prompts that fit (most of them) aren't counted message by message
+            if isinstance(prompt, ChatPromptValue) and self.sizer.estimator.count(prompt.to_string()) > budget:
+                prompt = ChatPromptValue(messages=self.sizer.fit_messages(prompt.messages, wanted))
+            fitted.append(prompt)
+        return fitted
+
+    def _size(self, prompts: List[str], run_manager, kwargs: Dict[str, Any]) -> List[Tuple[List[int], List[str], Dict[str, Any]]]:
+        """
+        Fits each prompt, returning (indices, prompts, kwargs) groups of the prompts that need the same max_tokens.
+        """
+        if self.max_tokens_param in kwargs:
+            return [(list(range(len(prompts))), prompts, kwargs)]
+        wanted = self.sizer.policy_tokens(self.policy, _run_tags(run_manager))
+        groups: Dict[int, Tuple[List[int], List[str], Dict[str, Any]]] = {}
+        for index, prompt in enumerate(prompts):
+            prompt = self.sizer.fit_text(prompt, wanted)
+            max_tokens = self.sizer.max_tokens(self.sizer.estimator.count(prompt), wanted)
+            if max_tokens not in groups:
+                groups[max_tokens] = ([], [], dict(kwargs, **{self.max_tokens_param: max_tokens}))
+            groups[max_tokens][0].append(index)
+            groups[max_tokens][1].append(prompt)
+        return list(groups.values())
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        parts = [
+            (indices, self._generate_llm(fitted, stop=stop, run_manager=run_manager, **group_kwargs))
+            for indices, fitted, group_kwargs in self._size(prompts, run_manager, kwargs)
+        ]
+        return combine_results(len(prompts), parts)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        groups = self._size(prompts, run_manager, kwargs)
+        results = await asyncio.gather(*(
+            self._agenerate_llm(fitted, stop=stop, run_manager=run_manager, **group_kwargs)
+            for _, fitted, group_kwargs in groups
+        ))
+        return combine_results(len(prompts), [(indices, result) for (indices, _, _), result in zip(groups, results)])
+
+
+class SizedChatModel(BaseChatModel):
+    """
+    Chat model counterpart of SizedLLM: the oldest messages after the system messages are dropped when the
+    conversation wouldn't leave room for the response, and max_tokens is set per request.
+    Like WrappedLLM, the wrapped chat model should be built without callbacks; its tokens are streamed
+    through the wrapper's.
+    """
+
+    chat: BaseChatModel
+    sizer: Any
+    policy: str = "default"
+    max_tokens_param: str = "max_tokens"
+
+    @property
+    def _llm_type(self) -> str:
+        return self.chat._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.chat._identifying_params
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.chat.get_num_tokens(text)
+
+    def _size(self, messages: List[BaseMessage], run_manager, kwargs: Dict[str, Any]) -> List[BaseMessage]:
+        if self.max_tokens_param in kwargs:
+            return messages
+        wanted = self.sizer.policy_tokens(self.policy, _run_tags(run_manager))
+        messages = self.sizer.fit_messages(messages, wanted)
+        kwargs[self.max_tokens_param] = self.sizer.max_tokens(self.sizer.estimator.count_messages(messages), wanted)
+        return messages
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        messages = self._size(messages, run_manager, kwargs)
+        result = self.chat.generate([messages], stop=stop, callbacks=[TokenForwarder(run_manager)], **kwargs)
+        return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        messages = self._size(messages, run_manager, kwargs)
+        result = await self.chat.agenerate([messages], stop=stop, callbacks=[AsyncTokenForwarder(run_manager)], **kwargs)
+        return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+
+def with_policy(model, policy: str):
+    """
+    Returns the model sized with another max_tokens policy (e.g. "agent" or "bio", see MAX_TOKENS_POLICY
+    in config.py). The copy shares the wrapped model & callbacks. Models that aren't sized are returned as is.
+    """
+    if isinstance(model, (SizedLLM, SizedChatModel)):
+        return copy_model(model, policy=policy)
+    return model
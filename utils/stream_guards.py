@@ -0,0 +1,323 @@
+import copy
+import re
+from typing import Any, List, Mapping, Optional, Pattern, Sequence, Union
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, Generation, LLMResult
+
+from utils.wrapped_llm import WrappedLLM, copy_model
+
+
+class StreamGuard:
+    """
+    Decides when a streamed response has said enough. Guards are copied for each response, so they can keep
+    state between tokens. check is called with the text so far and where the newest token starts in it.
+    """
+
+    name = "guard"
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        """
+        Returns the length of text to keep when the guard fires, otherwise None.
+        """
+        raise NotImplementedError
+
+
+class StopSequenceGuard(StreamGuard):
+    """
+    Fires on the first of the stop sequences, which is left out of the response.
+    Useful for models whose API doesn't take stop sequences, or for stopping on text the chain doesn't pass as `stop`.
+    """
+
+    name = "stop sequence"
+
+    def __init__(self, stops: Sequence[str]):
+        self.stops = list(stops)
+        self._longest = max(len(stop) for stop in self.stops)
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        # Only the newest token, plus enough before it to catch a sequence split across tokens, is searched
+        window = max(0, start - self._longest + 1)
+        found = [index for index in (text.find(stop, window) for stop in self.stops) if index != -1]
+        return min(found) if found else None
+
+
+class MaxCharsGuard(StreamGuard):
+    """
+    Fires once the response is longer than max_chars. The response is cut after the last sentence that fits
+    (when that keeps at least half of it), otherwise at max_chars.
+    """
+
+    name = "max characters"
+    SENTENCE_END = re.compile(r"[.!?](?=\s)|\n")
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        if len(text) <= self.max_chars:
+            return None
+        ends = [match.end() for match in self.SENTENCE_END.finditer(text, self.max_chars // 2, self.max_chars)]
+        return ends[-1] if ends else self.max_chars
+
+
+class RegexGuard(StreamGuard):
+    """
+    Fires when the pattern matches, keeping the response up to the end of the match. Only the last `window`
+    characters (plus the newest token) are searched on each token, so longer matches aren't found.
+    """
+
+    name = "regex"
+
+    def __init__(self, pattern: Union[str, Pattern], window: int = 200):
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.window = window
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        match = self.pattern.search(text, max(0, start - self.window))
+        return match.end() if match else None
+
+
+class JsonObjectGuard(StreamGuard):
+    """
+    Fires when the first top level JSON object in the response is complete, keeping the response up to its
+    closing brace. Text before the object (e.g. "Here you go:") is kept. Each character is scanned once.
+    """
+
+    name = "json object"
+
+    def __init__(self):
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        for index in range(self._scanned, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth:
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    return index + 1
+        self._scanned = len(text)
+        return None
+
+
+class StreamGuardTriggered(Exception):
+    """
+    Raised from the token callback to stop a response once a guard fires, carrying the text to keep.
+    Guarded models catch it and return the text, so chains see a normal (shorter) response.
+    """
+
+    def __init__(self, guard: StreamGuard, text: str):
+        super().__init__(f"Stopped by {guard.name} guard after {len(text)} characters")
+        self.guard = guard
+        self.text = text
+
+
+class _GuardedStream:
+    """
+    The guards of one response, and the text streamed so far.
+    """
+
+    def __init__(self, guards: List[StreamGuard]):
+        self.guards = [copy.deepcopy(guard) for guard in guards]
+        self.text = ""
+
+    def feed(self, token: str) -> None:
+        """
+        Adds a token, raising StreamGuardTriggered once a guard fires.
+        """
+        start = len(self.text)
+        self.text += token
+        for guard in self.guards:
+            keep = guard.check(self.text, start)
+            if keep is not None:
+                raise StreamGuardTriggered(guard, self.text[:keep])
+
+    def finish(self, text: str) -> str:
+        """
+        Applies the guards to a whole response that wasn't streamed (streamed ones have been checked already).
+        """
+        if self.text:
+            return text
+        try:
+            self.feed(text)
+        except StreamGuardTriggered as triggered:
+            return triggered.text
+        return text
+
+
+class _GuardForwarder(BaseCallbackHandler):
+    """
+    Checks each token against the guards before forwarding it to the guarded model's run manager.
+    A token that trips a guard is forwarded only up to the cut, then the response is stopped.
+    """
+
+    raise_error = True
+
+    def __init__(self, stream: _GuardedStream, run_manager: Optional[CallbackManagerForLLMRun]):
+        self.stream = stream
+        self.run_manager = run_manager
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        start = len(self.stream.text)
+        try:
+            self.stream.feed(token)
+        except StreamGuardTriggered as triggered:
+            if self.run_manager and len(triggered.text) > start:
+                self.run_manager.on_llm_new_token(triggered.text[start:])
+            raise
+        if self.run_manager:
+            self.run_manager.on_llm_new_token(token)
+
+
+class _AsyncGuardForwarder(AsyncCallbackHandler):
+    """
+    Async counterpart of _GuardForwarder.
+    """
+
+    raise_error = True
+
+    def __init__(self, stream: _GuardedStream, run_manager: Optional[AsyncCallbackManagerForLLMRun]):
+        self.stream = stream
+        self.run_manager = run_manager
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        start = len(self.stream.text)
+        try:
+            self.stream.feed(token)
+        except StreamGuardTriggered as triggered:
+            if self.run_manager and len(triggered.text) > start:
+                await self.run_manager.on_llm_new_token(triggered.text[start:])
+            raise
+        if self.run_manager:
+            await self.run_manager.on_llm_new_token(token)
+
+
+class GuardedLLM(WrappedLLM):
+    """
+    LLM wrapper that stops the response as soon as one of its guards fires and returns what was streamed so far,
+    saving the tokens & time the rest would have taken. Responses that aren't streamed (including every response
+    to a request with several prompts) are cut the same way once they've arrived.
+    """
+
+    guards: List[Any]
+
+    def _finish(self, result: LLMResult) -> LLMResult:
+        generations = [[Generation(text=_GuardedStream(self.guards).finish(generation[0].text))] for generation in result.generations]
+        return LLMResult(generations=generations, llm_output=result.llm_output)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        if len(prompts) > 1:
+            return self._finish(self._generate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs))
+        stream = _GuardedStream(self.guards)
+        try:
+            result = self.llm.generate(prompts, stop=stop, callbacks=[_GuardForwarder(stream, run_manager)], **kwargs)
+        except StreamGuardTriggered as triggered:
+            return LLMResult(generations=[[Generation(text=triggered.text)]])
+        text = stream.finish(result.generations[0][0].text)
+        return LLMResult(generations=[[Generation(text=text)]], llm_output=result.llm_output)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        if len(prompts) > 1:
+            return self._finish(await self._agenerate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs))
+        stream = _GuardedStream(self.guards)
+        try:
+            result = await self.llm.agenerate(prompts, stop=stop, callbacks=[_AsyncGuardForwarder(stream, run_manager)], **kwargs)
+        except StreamGuardTriggered as triggered:
+            return LLMResult(generations=[[Generation(text=triggered.text)]])
+        text = stream.finish(result.generations[0][0].text)
+        return LLMResult(generations=[[Generation(text=text)]], llm_output=result.llm_output)
+
+
+class GuardedChatModel(BaseChatModel):
+    """
+    Chat model counterpart of GuardedLLM. Like WrappedLLM, the wrapped chat model should be built without callbacks.
+    """
+
+    chat: BaseChatModel
+    guards: List[Any]
+
+    @property
+    def _llm_type(self) -> str:
+        return self.chat._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.chat._identifying_params
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.chat.get_num_tokens(text)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        stream = _GuardedStream(self.guards)
+        try:
+            result = self.chat.generate([messages], stop=stop, callbacks=[_GuardForwarder(stream, run_manager)], **kwargs)
+        except StreamGuardTriggered as triggered:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=triggered.text))])
+        text = stream.finish(result.generations[0][0].text)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))], llm_output=result.llm_output)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        stream = _GuardedStream(self.guards)
+        try:
+            result = await self.chat.agenerate([messages], stop=stop, callbacks=[_AsyncGuardForwarder(stream, run_manager)], **kwargs)
+        except StreamGuardTriggered as triggered:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=triggered.text))])
+        text = stream.finish(result.generations[0][0].text)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))], llm_output=result.llm_output)
+
+
+def with_guards(model, *guards: StreamGuard):
+    """
+    Returns the model (as built by config.py) wrapped so its responses stop once a guard fires.
+    The wrapper takes over the model's callbacks, so streamed output is only printed once, up to the cut.
+    """
+    if not guards:
+        return model
+    callbacks = model.callbacks
+    inner = copy_model(model, callbacks=None)
+    if isinstance(model, BaseChatModel):
+        return GuardedChatModel(chat=inner, guards=list(guards), callbacks=callbacks)
+    return GuardedLLM(llm=inner, guards=list(guards), callbacks=callbacks)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from inspect import signature
+from typing import Any, Dict, List, Optional, Union
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+    Callbacks,
+)
+from langchain.tools.base import BaseTool
+
+# (input key, cached output or None) looked up by CachedTool.run/arun for the _run/_arun call that follows.
+# A context variable keeps concurrent calls (threads or async tasks) from seeing each other's lookups.
+_pending_lookup = ContextVar("pending_tool_lookup")
+
+
+class ToolResultCache:
+    """
+    Keyed store for tool results: an in-memory LRU, optionally backed by a SQLite file so results survive across runs.
+    Expiry is decided when reading, using the TTL of the tool asking, so each tool can keep results for as long as suits it.
+    """
+
+    def __init__(self, max_entries=1024, path=None, max_disk_entries=100_000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # key -> (output, created)
+        self._connection = None
+        self._disk_writes = 0
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results (key TEXT PRIMARY KEY, output TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def key(tool_name: str, tool_input: str) -> str:
+        return hashlib.sha256(f"{tool_name}\0{tool_input}".encode("utf-8")).hexdigest()
+
+    def get(self, tool_name: str, tool_input: str, ttl: Optional[float] = None) -> Optional[str]:
+        """
+        Returns the cached output, or None if missing or older than `ttl` seconds (None never expires).
+        """
+        key = self.key(tool_name, tool_input)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._connection is not None:
+                entry = self._connection.execute(
+                    "SELECT output, created FROM tool_results WHERE key = ?", (key,)
+                ).fetchone()
+                if entry is not None:
+                    self._remember(key, tuple(entry))
+
+            if entry is None or (ttl is not None and now - entry[1] > ttl):
+                self.misses += 1
+                return None
+
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, tool_name: str, tool_input: str, output: str) -> None:
+        """
+        Stores a tool output in memory, and on disk when a path was given.
+        """
+        key = self.key(tool_name, tool_input)
+        entry = (output, time.time())
+        with self._lock:
+            self._remember(key, entry)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO tool_results (key, output, created) VALUES (?, ?, ?)",
+                    (key,) + entry
+                )
+                self._disk_writes += 1
+                if self._disk_writes % 100 == 0:
+                    # Keep the newest results once the file grows past its limit
+                    self._connection.execute(
+                        "DELETE FROM tool_results WHERE key NOT IN (SELECT key FROM tool_results ORDER BY created DESC LIMIT ?)",
+                        (self.max_disk_entries,)
+                    )
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
+
+
+class CachedTool(BaseTool):
+    """
+    Wraps an agent tool so repeated calls with the same input are answered from a ToolResultCache.
+    Callbacks receive `cache_hit` in on_tool_start/on_tool_end, so CustomStreamCallback can report cached results.
+    """
+
+    tool: BaseTool
+    result_cache: ToolResultCache
+    ttl: Optional[float] = None # Seconds a result stays valid, None keeps it forever
+
+    @staticmethod
+    def _input_key(tool_input: Union[str, Dict]) -> str:
+        return tool_input if isinstance(tool_input, str) else json.dumps(tool_input, sort_keys=True)
+
+    def run(
+        self,
+        tool_input: Union[str, Dict],
+        verbose: Optional[bool] = None,
+        start_color: Optional[str] = "green",
+        color: Optional[str] = "green",
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Any:
+        # Look the result up before the run starts, so on_tool_start can already report the hit
+        input_key = self._input_key(tool_input)
+        output = self.result_cache.get(self.name, input_key, self.ttl)
+        _pending_lookup.set((input_key, output))
+        return super().run(
+            tool_input, verbose, start_color, color, callbacks,
+            cache_hit=output is not None, **kwargs
+        )
+
+    async def arun(
+        self,
+        tool_input: Union[str, Dict],
+        verbose: Optional[bool] = None,
+        start_color: Optional[str] = "green",
+        color: Optional[str] = "green",
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Any:
+        input_key = self._input_key(tool_input)
+        output = self.result_cache.get(self.name, input_key, self.ttl)
+        _pending_lookup.set((input_key, output))
+        return await super().arun(
+            tool_input, verbose, start_color, color, callbacks,
+            cache_hit=output is not None, **kwargs
+        )
+
+    def _run(self, *args: Any, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        input_key, output = _pending_lookup.get()
+        if output is not None:
+            return output
+
+        if signature(self.tool._run).parameters.get("run_manager"):
+            kwargs["run_manager"] = run_manager
+        output = self.tool._run(*args, **kwargs)
+        self.result_cache.set(self.name, input_key, str(output))
+        return output
+
+    async def _arun(self, *args: Any, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        input_key, output = _pending_lookup.get()
+        if output is not None:
+            return output
+
+        if signature(self.tool._arun).parameters.get("run_manager"):
+            kwargs["run_manager"] = run_manager
+        output = await self.tool._arun(*args, **kwargs)
+        self.result_cache.set(self.name, input_key, str(output))
+        return output
+
+
+def cache_tools(
+    tools: List[BaseTool],
+    result_cache: ToolResultCache,
+    ttls: Dict[str, Optional[float]],
+    callbacks: Callbacks = None,
+) -> List[BaseTool]:
+    """
+    Wraps each tool in a CachedTool using its TTL from `ttls` (by tool name). Tools without an entry aren't cached.
+    """
+    return [
+        CachedTool(
+            tool=tool,
+            result_cache=result_cache,
+            ttl=ttls[tool.name],
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            return_direct=tool.return_direct,
+            callbacks=callbacks,
+        )
+        if tool.name in ttls else tool
+        for tool in tools
+    ]
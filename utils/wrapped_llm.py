@@ -0,0 +1,179 @@
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.llms.base import LLM, BaseLLM
+from langchain.schema import LLMResult
+
+
+class TokenForwarder(BaseCallbackHandler):
+    """
+    Forwards tokens streamed by a wrapped LLM to the run manager of the wrapper, so the wrapper's callbacks
+    (e.g. CustomStreamCallback) see the stream as if it came from the wrapper itself.
+    Errors that the wrapper's callbacks choose to raise (e.g. a StreamGuardTriggered) are passed on,
+    so they stop the wrapped LLM too.
+    """
+
+    raise_error = True
+
+    def __init__(self, run_manager: Optional[CallbackManagerForLLMRun]):
+        self.run_manager = run_manager
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.run_manager:
+            self.run_manager.on_llm_new_token(token)
+
+
+class AsyncTokenForwarder(AsyncCallbackHandler):
+    """
+    Async counterpart of TokenForwarder.
+    """
+
+    raise_error = True
+
+    def __init__(self, run_manager: Optional[AsyncCallbackManagerForLLMRun]):
+        self.run_manager = run_manager
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.run_manager:
+            await self.run_manager.on_llm_new_token(token)
+
+
+def copy_model(model, **update):
+    """
+    Returns a copy of a LangChain model with some fields replaced, sharing every other field (wrapped models,
+    clients, callbacks) with the original. Under pydantic v1, copy.copy shares the model's field dict itself,
+    so setting a field changes the original too, and model.copy() copies nested models without their
+    callbacks, which are excluded fields.
+    """
+    fields = dict(model.__dict__, **update)
+    return model.construct(_fields_set=model.__fields_set__ | set(update), **fields)
+
+
+def merge_llm_outputs(outputs: Sequence[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Combines the llm_output of several requests (e.g. OpenAI's {"token_usage": ..., "model_name": ...}),
+    adding up their token usage.
+    """
+    outputs = [output for output in outputs if output]
+    if len(outputs) <= 1:
+        return outputs[0] if outputs else None
+    merged = dict(outputs[0])
+    usage: Dict[str, Any] = {}
+    for output in outputs:
+        for name, count in (output.get("token_usage") or {}).items():
+            usage[name] = usage.get(name, 0) + count
+    if usage:
+        merged["token_usage"] = usage
+    return merged
+
+
+def combine_results(count: int, parts: Sequence[Tuple[Sequence[int], LLMResult]]) -> LLMResult:
+    """
+    Builds the result for `count` prompts from parts that each answered some of them, as
+    (indices of the prompts answered, their LLMResult) pairs.
+    """
+    generations: List[Any] = [None] * count
+    for indices, result in parts:
+        for index, generation in zip(indices, result.generations):
+            generations[index] = generation
+    return LLMResult(generations=generations, llm_output=merge_llm_outputs([result.llm_output for _, result in parts]))
+
+
+class WrappedLLM(LLM):
+    """
+    Base class for LLMs that add behaviour (caching, deduplication, ...) around another LLM.
+    The wrapped LLM should be built without callbacks; the wrapper carries them and receives its streamed tokens.
+    Prompts are passed to the wrapped LLM as one list, so a generate() call with several prompts stays one
+    (batched) request, and its llm_output (e.g. token usage) is returned with the generations.
+    Subclasses add their behaviour in _generate/_agenerate.
+    """
+
+    llm: BaseLLM
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.llm._identifying_params
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.llm.get_num_tokens(text)
+
+    def llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        """
+        Identifies the wrapped model and its parameters (including per-call overrides),
+        built the same way as LangChain's own cache key.
+        """
+        params = self.llm.dict()
+        params.update(kwargs)
+        params["stop"] = stop
+        return str(sorted(params.items()))
+
+    def _generate_llm(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """
+        Runs the wrapped LLM on the prompts in one request, streaming its tokens through this wrapper's callbacks.
+        """
+        result = self.llm.generate(prompts, stop=stop, callbacks=[TokenForwarder(run_manager)], **kwargs)
+        return LLMResult(generations=result.generations, llm_output=result.llm_output)
+
+    async def _agenerate_llm(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """
+        Async version of _generate_llm.
+        """
+        result = await self.llm.agenerate(prompts, stop=stop, callbacks=[AsyncTokenForwarder(run_manager)], **kwargs)
+        return LLMResult(generations=result.generations, llm_output=result.llm_output)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        return self._generate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        return await self._agenerate_llm(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self._generate([prompt], stop=stop, run_manager=run_manager, **kwargs).generations[0][0].text
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        result = await self._agenerate([prompt], stop=stop, run_manager=run_manager, **kwargs)
+        return result.generations[0][0].text